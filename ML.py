@@ -1,53 +1,67 @@
 # ML.py - Logic for Scan Processing and Database Interaction
-from config import ROBOFLOW
+from config import SCAN_CACHE_MEMORY_ENTRIES, SCAN_CACHE_DB_ENTRIES, SCAN_CACHE_TTL_SECONDS, SCAN_BATCH_WORKERS
+from config import ASYNC_BATCH_CONCURRENCY
+import asyncio
 import sqlite3
 import base64
-from datetime import datetime
+import binascii
+import time
+from concurrent.futures import ThreadPoolExecutor
 from flask import jsonify # Keep jsonify temporarily for serialization if needed, or use json module
 import json # Use standard json for serialization within this module
-from inference_sdk import InferenceHTTPClient
+from inference_backends import get_backend, backend_loaded
+from scan_cache import InferenceCache
+from scan_repository import get_repository
+from config import ROBOFLOW_MODEL_ID
+from instrumentation import SCAN_STAGE_SECONDS, bind_context, callback_metric, log_event
 
 # --- Configuration ---
 DB_PATH = "scans.db"  # Database file path
+REPOSITORY = get_repository(DB_PATH)  # Pooled per-thread connections to DB_PATH
+
+# --- Inference Cache ---
+# Re-submitted images (retries, double-clicks, re-uploads) are answered from here
+# instead of paying another Roboflow round trip.
+INFERENCE_CACHE = InferenceCache(
+    REPOSITORY,
+    memory_entries=SCAN_CACHE_MEMORY_ENTRIES,
+    db_entries=SCAN_CACHE_DB_ENTRIES,
+    ttl_seconds=SCAN_CACHE_TTL_SECONDS,
+)
+callback_metric(
+    "inference_cache_events_total", "Inference cache lookups by outcome.", "counter",
+    lambda: {(outcome,): INFERENCE_CACHE.stats()[outcome] for outcome in ("hits", "misses", "coalesced")},
+    ("outcome",)
+)
+
+# --- Inference Backend ---
+# Roboflow API, local ONNX model or stub, chosen by INFERENCE_BACKEND in config.py and
+# loaded on first use (see inference_backends.py).
+RF_MODEL_ID = ROBOFLOW_MODEL_ID
+
+
+def _inference_backend():
+    """Returns the shared inference backend, raising ConnectionError if it can't be loaded."""
+    try:
+        return get_backend()
+    except Exception as e:
+        print(f"Error initializing inference backend: {e}")
+        raise ConnectionError(f"Inference backend not available: {e}") from e
+
+
+async def _inference_backend_async():
+    """_inference_backend() for the event loop: the first (possibly slow) load runs on a worker thread."""
+    if backend_loaded():
+        return _inference_backend()
+    return await asyncio.to_thread(_inference_backend)
 
-# --- Roboflow Client Initialization ---
-# !! IMPORTANT: Replace with your actual API key and Model ID !!
-# Consider using environment variables for the API key in production.
-try:
-    RF_API_KEY = ROBOFLOW  # Replace!
-    RF_MODEL_ID = "early-detection-xvxmf/1" # Replace! e.g., "early-detection-xvxmf/1"
-
-
-    RF = InferenceHTTPClient(
-        api_url="https://detect.roboflow.com", # Or appropriate URL for your model type
-        api_key=RF_API_KEY
-    )
-    print("Roboflow client initialized successfully.")
-except ValueError as ve:
-     print(f"Configuration Error: {ve}")
-     RF = None
-except Exception as e:
-    print(f"Error initializing Roboflow client: {e}")
-    RF = None
 
 # --- Database Initialization Function ---
 def init_db():
-    """Creates the scans table if it doesn't already exist."""
+    """Creates or migrates the scans schema and the inference cache table."""
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.execute("""
-                CREATE TABLE IF NOT EXISTS scans (
-                    id INTEGER PRIMARY KEY AUTOINCREMENT,
-                    fullName TEXT NOT NULL,
-                    age INTEGER NOT NULL,
-                    gender TEXT NOT NULL,
-                    contact TEXT,
-                    timestamp TEXT NOT NULL,
-                    result_json TEXT NOT NULL,
-                    primary_class TEXT
-                )
-            """)
-            conn.commit()
+        REPOSITORY.migrate()
+        INFERENCE_CACHE.init_db()
         print(f"Database initialized successfully at {DB_PATH}")
         return True # Indicate success
     except sqlite3.Error as e:
@@ -56,44 +70,89 @@ def init_db():
         print(f"An unexpected error occurred during DB init: {e}")
     return False # Indicate failure
 
-# --- Core Scan Processing Function ---
-def process_scan(img_b64, user_info):
+# --- Scan Processing Stages ---
+def _decode_image(img_b64):
+    """Decodes a base64 image string, raising ValueError if it isn't valid base64."""
+    try:
+        with SCAN_STAGE_SECONDS.time(stage="decode"):
+            return base64.b64decode(img_b64)
+    except (binascii.Error, TypeError) as e:
+        raise ValueError(f"Image data is not valid base64: {e}") from e
+
+
+def _run_inference(img_bytes, user_info, img_b64=None):
     """
-    Performs inference, fetches previous scan, saves current scan, and returns results.
+    Runs (or reuses cached) inference for one image and extracts the primary class.
 
     Args:
-        img_b64 (str): Base64 encoded image string.
-        user_info (dict): Dictionary containing 'fullName', 'age', 'gender', 'contact'.
+        img_bytes (bytes): Raw image bytes (used for the cache key).
+        user_info (dict): Used for logging only.
+        img_b64 (str, optional): Base64 form of the same image, if the caller already has it.
+                                 Otherwise it is only built on a cache miss.
 
     Returns:
-        dict: Contains 'current' (inference result) and 'previous' (previous result JSON string or None).
+        tuple: (current_result, primary_class, result_json_str)
 
     Raises:
-        ConnectionError: If Roboflow client isn't initialized or inference/DB operations fail.
-        ValueError: If image decoding fails.
-        sqlite3.Error: If database operations encounter issues.
+        ConnectionError: If the inference call fails.
+        ValueError: If the image cannot be decoded for preprocessing.
     """
-    if not RF or not RF_MODEL_ID:
-        raise ConnectionError("Roboflow client not properly initialized.")
+    try:
+        backend = _inference_backend()
+        # The namespace identifies model + settings, so results are only reused when both match
+        cache_key = InferenceCache.make_key(img_bytes, backend.cache_namespace())
+        with SCAN_STAGE_SECONDS.time(stage="infer"):
+            current_result = INFERENCE_CACHE.get_or_compute(
+                cache_key, lambda: backend.infer(img_bytes, img_b64)
+            )
+        print(f"Inference successful for user: {user_info.get('fullName')}")
+    except ValueError:
+        raise # Undecodable image: a client error, not an upstream failure
+    except Exception as e:
+        print(f"Inference error for user {user_info.get('fullName')}: {e}")
+        raise ConnectionError(f"Inference failed: {e}") from e
+
+    return (current_result, *_summarize_result(current_result))
+
 
-    # 1) Run inference
+async def _run_inference_async(img_bytes, user_info, img_b64=None):
+    """Coroutine version of _run_inference() for the async app (same return value and errors)."""
     try:
-        img_bytes = base64.b64decode(img_b64)
-        current_result = RF.infer(img_b64, model_id=RF_MODEL_ID)
+        backend = _inference_backend()
+        cache_key = InferenceCache.make_key(img_bytes, backend.cache_namespace())
+        with SCAN_STAGE_SECONDS.time(stage="infer"):
+            current_result = await INFERENCE_CACHE.get_or_compute_async(
+                cache_key, lambda: backend.infer_async(img_bytes, img_b64)
+            )
         print(f"Inference successful for user: {user_info.get('fullName')}")
+    except ValueError:
+        raise
     except Exception as e:
-      print("new error",e)
+        print(f"Inference error for user {user_info.get('fullName')}: {e}")
+        raise ConnectionError(f"Inference failed: {e}") from e
+
+    return (current_result, *_summarize_result(current_result))
+
 
+def extract_primary_class(current_result):
+    """Returns the class of the most confident prediction in a model response ("Unknown" if none)."""
     # Extract primary prediction (adjust based on your model type - detection/classification)
     primary_class = "Unknown"
+    if isinstance(current_result, dict) and 'predictions' in current_result and current_result['predictions']:
+        predictions = sorted(current_result['predictions'], key=lambda x: x.get('confidence', 0), reverse=True)
+        if predictions:
+            primary_class = predictions[0].get('class', 'Unknown')
+    elif isinstance(current_result, list) and current_result: # Simple classification list
+        # Assuming the list is sorted or the first item is relevant
+         primary_class = current_result[0].get('class', 'Unknown')
+    return primary_class
+
+
+def _summarize_result(current_result):
+    """Extracts the primary class and serializes the result. Returns (primary_class, result_json_str)."""
+    primary_class = "Unknown"
     try:
-        if isinstance(current_result, dict) and 'predictions' in current_result and current_result['predictions']:
-            predictions = sorted(current_result['predictions'], key=lambda x: x.get('confidence', 0), reverse=True)
-            if predictions:
-                primary_class = predictions[0].get('class', 'Unknown')
-        elif isinstance(current_result, list) and current_result: # Simple classification list
-            # Assuming the list is sorted or the first item is relevant
-             primary_class = current_result[0].get('class', 'Unknown')
+        primary_class = extract_primary_class(current_result)
         print(f"Extracted primary class: {primary_class}")
     except Exception as e:
         print(f"Warning: Could not extract primary class from result. {e}")
@@ -101,57 +160,192 @@ def process_scan(img_b64, user_info):
 
     # Serialize the full result using standard json
     try:
-        result_json_str = json.dumps(current_result)
+        with SCAN_STAGE_SECONDS.time(stage="serialize"):
+            result_json_str = json.dumps(current_result)
     except TypeError as e:
         print(f"Error serializing inference result: {e}")
         # Decide how to handle: store placeholder, raise error?
         result_json_str = json.dumps({"error": "Result serialization failed"})
 
+    return primary_class, result_json_str
 
-    # 2) Fetch previous scan for this contact
-    previous_result_json_str = None
-    contact = user_info.get("contact")
-    if contact: # Only query if contact info is provided and not empty
-        try:
-            with sqlite3.connect(DB_PATH) as conn:
-                cur = conn.execute(
-                    "SELECT result_json FROM scans WHERE contact = ? ORDER BY timestamp DESC LIMIT 1",
-                    (contact,)
-                )
-                row = cur.fetchone()
-                if row:
-                    previous_result_json_str = row[0]
-                # print(f"Previous scan lookup for contact {contact}: {'Found' if row else 'Not Found'}")
-        except sqlite3.Error as e:
-            print(f"Database Error fetching previous scan for contact {contact}: {e}")
-            # Decide if this is critical. Maybe log and continue.
-
-    # 3) Save the new scan
+
+def _save_scan(user_info, current_result, primary_class, result_json_str):
+    """
+    Looks up the contact's previous scan and saves the new one in a single transaction.
+    Returns the previous scan (or None); raises ConnectionError if the database fails.
+    """
     try:
-        with sqlite3.connect(DB_PATH) as conn:
-            conn.execute(
-                """INSERT INTO scans
-                   (fullName, age, gender, contact, timestamp, result_json, primary_class)
-                   VALUES (?, ?, ?, ?, ?, ?, ?)""",
-                (
-                    user_info.get("fullName", "N/A"),
-                    user_info.get("age", 0),
-                    user_info.get("gender", "N/A"),
-                    contact, # Store None if not provided
-                    datetime.utcnow().isoformat() + "Z", # ISO 8601 UTC format
-                    result_json_str,
-                    primary_class
-                )
-            )
-            conn.commit()
-            print(f"New scan saved for user {user_info.get('fullName')}")
+        with REPOSITORY.transaction(immediate=True) as conn:
+            with SCAN_STAGE_SECONDS.time(stage="previous_lookup"):
+                previous_scan = REPOSITORY.latest_scan_for_contact(conn, user_info.get("contact"))
+            insert_started = time.perf_counter()
+            REPOSITORY.insert_scan(conn, user_info, current_result, result_json_str, primary_class)
+        SCAN_STAGE_SECONDS.observe(time.perf_counter() - insert_started, stage="insert")  # Includes the commit
+        print(f"New scan saved for user {user_info.get('fullName')}")
+        log_event("scan_saved", primary_class=primary_class, has_previous=previous_scan is not None)
+        return previous_scan
     except sqlite3.Error as e:
         print(f"Database Error saving new scan for user {user_info.get('fullName')}: {e}")
         # This is likely a critical error, re-raise it to be caught by the route handler
         raise ConnectionError(f"Failed to save scan results to database: {e}") from e
 
+
+# --- Core Scan Processing Function ---
+def process_scan(img_b64, user_info):
+    """
+    Performs inference, fetches previous scan, saves current scan, and returns results.
+
+    Args:
+        img_b64 (str): Base64 encoded image string.
+        user_info (dict): Dictionary containing 'fullName', 'age', 'gender', 'contact'.
+
+    Returns:
+        dict: Contains 'current' (inference result) and 'previous' (the contact's previous scan as a dict, or None).
+
+    Raises:
+        ConnectionError: If the inference backend isn't available or inference/DB operations fail.
+        ValueError: If image decoding fails.
+        sqlite3.Error: If database operations encounter issues.
+    """
+    return process_scan_bytes(_decode_image(img_b64), user_info, img_b64=img_b64)
+
+
+def process_scan_bytes(img_bytes, user_info, img_b64=None):
+    """
+    Same as process_scan(), but takes raw image bytes (e.g. from a binary upload).
+
+    Args:
+        img_bytes (bytes): Raw image bytes.
+        user_info (dict): Dictionary containing 'fullName', 'age', 'gender', 'contact'.
+        img_b64 (str, optional): Base64 form of the same image, if already available.
+
+    Returns:
+        dict: Contains 'current' (inference result) and 'previous' (the contact's previous scan as a dict, or None).
+
+    Raises:
+        ConnectionError: If the inference backend isn't available or inference/DB operations fail.
+    """
+    _inference_backend()  # Fail fast if the backend isn't available
+
+    # 1) Run inference (or reuse the cached result for identical image bytes)
+    current_result, primary_class, result_json_str = _run_inference(img_bytes, user_info, img_b64)
+
+    # 2) Fetch previous scan for this contact and 3) save the new scan, in one transaction
+    previous_scan = _save_scan(user_info, current_result, primary_class, result_json_str)
+
     # 4) Return structured results
     return {
         "current": current_result,
-        "previous": previous_result_json_str # Send back the raw JSON string from DB
-    }
\ No newline at end of file
+        "previous": previous_scan  # Structured: scan_id, timestamp, primary_class, predictions
+    }
+
+
+# --- Batch Scan Processing ---
+def process_scan_batch(items, max_workers=SCAN_BATCH_WORKERS):
+    """
+    Runs inference for many scans in parallel and saves all rows in one transaction.
+
+    Inference is fanned out over a bounded thread pool; the previous-scan lookups and
+    inserts then run in input order on a single connection, so two views of the same
+    contact in one batch see each other as "previous" just like sequential calls would.
+
+    Args:
+        items (list): (img_b64, user_info) tuples, same shapes as process_scan().
+        max_workers (int): Maximum number of concurrent inference calls.
+
+    Returns:
+        list: One dict per item, in input order. Successful items contain 'index',
+              'current' and 'previous'; failed items contain 'index' and 'error'.
+
+    Raises:
+        ConnectionError: If the inference backend isn't available or the batch insert fails
+                         (in which case no rows from the batch are saved).
+    """
+    _inference_backend()  # Fail fast if the backend isn't available
+
+    # 1) Fan out inference; failures are reported per item
+    inferred = [None] * len(items)
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(items) or 1))) as pool:
+        futures = {}
+        for index, (img_b64, user_info) in enumerate(items):
+            try:
+                img_bytes = _decode_image(img_b64)
+            except ValueError as e:
+                inferred[index] = e
+                continue
+            futures[pool.submit(bind_context(_run_inference), img_bytes, user_info, img_b64)] = index
+        for future, index in futures.items():
+            try:
+                inferred[index] = future.result()
+            except Exception as e:
+                inferred[index] = e
+
+    # 2) Look up previous scans and insert every successful row in one transaction
+    return _save_batch(items, inferred)
+
+
+def _save_batch(items, inferred):
+    """
+    Saves every successfully inferred item of a batch in one transaction, in input order.
+    `inferred` holds (current_result, primary_class, result_json_str) or an Exception per item.
+    """
+    results = []
+    try:
+        with REPOSITORY.transaction(immediate=True) as conn:
+            for index, ((_, user_info), outcome) in enumerate(zip(items, inferred)):
+                if isinstance(outcome, Exception):
+                    results.append({"index": index, "error": str(outcome)})
+                    continue
+                current_result, primary_class, result_json_str = outcome
+                with SCAN_STAGE_SECONDS.time(stage="previous_lookup"):
+                    previous_scan = REPOSITORY.latest_scan_for_contact(conn, user_info.get("contact"))
+                with SCAN_STAGE_SECONDS.time(stage="insert"):
+                    REPOSITORY.insert_scan(conn, user_info, current_result, result_json_str, primary_class)
+                results.append({
+                    "index": index,
+                    "current": current_result,
+                    "previous": previous_scan
+                })
+        print(f"Batch of {len(items)} scans processed ({sum('error' not in r for r in results)} saved)")
+    except sqlite3.Error as e:
+        print(f"Database Error saving scan batch: {e}")
+        raise ConnectionError(f"Failed to save scan batch to database: {e}") from e
+
+    return results
+
+
+# --- Async Scan Processing (asgi_app.py) ---
+# Same contracts as the functions above. Inference awaits the backend's async path, so a
+# scan waiting on Roboflow holds no thread; the short SQLite work runs on a worker thread.
+async def process_scan_async(img_b64, user_info):
+    """Coroutine version of process_scan()."""
+    return await process_scan_bytes_async(_decode_image(img_b64), user_info, img_b64=img_b64)
+
+
+async def process_scan_bytes_async(img_bytes, user_info, img_b64=None):
+    """Coroutine version of process_scan_bytes()."""
+    await _inference_backend_async()  # Fail fast if the backend isn't available
+    current_result, primary_class, result_json_str = await _run_inference_async(img_bytes, user_info, img_b64)
+    previous_scan = await asyncio.to_thread(_save_scan, user_info, current_result, primary_class, result_json_str)
+    return {
+        "current": current_result,
+        "previous": previous_scan
+    }
+
+
+async def process_scan_batch_async(items, max_concurrency=ASYNC_BATCH_CONCURRENCY):
+    """Coroutine version of process_scan_batch(); at most `max_concurrency` inferences run at once."""
+    await _inference_backend_async()
+    limit = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def infer(img_b64, user_info):
+        try:
+            img_bytes = _decode_image(img_b64)
+            async with limit:
+                return await _run_inference_async(img_bytes, user_info, img_b64)
+        except Exception as e:
+            return e
+
+    inferred = await asyncio.gather(*(infer(img_b64, user_info) for img_b64, user_info in items))
+    return await asyncio.to_thread(_save_batch, items, inferred)
@@ -0,0 +1,209 @@
+# answer_matcher.py - Local, deterministic matching of quiz answers to options
+#
+# Most quiz answers are "no", "yes", "don't know" or a number that falls in one of the
+# option ranges. Those are matched here without an LLM call; anything ambiguous gets a
+# low confidence so the caller can fall back to the LLM.
+import re
+import threading
+from collections import namedtuple
+from difflib import SequenceMatcher
+
+MatchResult = namedtuple("MatchResult", ["option_index", "confidence", "method"])
+
+_PUNCTUATION = re.compile(r"[^\w\s'/.<>+-]")
+_NUMBER = re.compile(r"\d+(?:\.\d+)?")
+_FILLER_PREFIXES = ("i am ", "i'm ", "im ", "i have ", "about ", "around ", "approximately ", "roughly ")
+_WORD = re.compile(r"[a-z]+")
+
+# Unit and time words, by the unit they name. A number in an answer is only compared with
+# the option ranges when every unit it comes with is one the question itself uses
+# ("3 hours" for hours per week, not "30 minutes a day"); "born" and "ago" always
+# mean the number is something else (a year of birth, a time since).
+_UNIT_WORDS = {
+    "minute": "minute", "minutes": "minute", "min": "minute", "mins": "minute",
+    "hour": "hour", "hours": "hour", "hr": "hour", "hrs": "hour",
+    "day": "day", "days": "day", "daily": "day", "night": "day", "nights": "day",
+    "week": "week", "weeks": "week", "weekly": "week", "wk": "week", "wks": "week",
+    "month": "month", "months": "month", "monthly": "month",
+    "year": "year", "years": "year", "yr": "year", "yrs": "year", "yearly": "year", "old": "year",
+    "born": "born", "ago": "ago",
+}
+_NEVER_UNITS = {"born", "ago"}
+_YEAR_LIKE = 1000            # Four-digit numbers are years, not ages or counts
+_PLAUSIBLE_FACTOR = 3        # Numbers above this multiple of the largest option bound are rejected
+
+# Canonical short answers and the phrasings that mean them
+_CANONICAL_ANSWERS = {
+    "yes": {"yes", "y", "yeah", "yep", "yup", "correct", "true", "i have", "i did", "i do", "affirmative"},
+    "no": {"no", "n", "nope", "never", "none", "nah", "not really", "i have not", "i haven't", "i havent",
+           "i did not", "i didn't", "i do not", "i don't", "no never", "negative", "zero", "0"},
+    "dont know": {"dont know", "don't know", "do not know", "i don't know", "i dont know", "i do not know",
+                  "not sure", "unsure", "idk", "no idea", "i'm not sure", "im not sure", "unknown",
+                  "have not been tested", "never been tested", "not tested"},
+    "not applicable": {"n/a", "na", "not applicable", "does not apply", "doesn't apply"},
+}
+# Option texts (normalised) that each canonical answer maps onto
+_CANONICAL_OPTIONS = {
+    "yes": ("yes",),
+    "no": ("no", "none"),
+    "dont know": ("don't know", "dont know", "don't know/have not been tested"),
+    "not applicable": ("not applicable",),
+}
+
+# Option range phrasings, tried in order: (pattern, builder(match) -> (low, high))
+_INF = float("inf")
+_RANGE_PATTERNS = [
+    (re.compile(r"(\d+(?:\.\d+)?)\s*-\s*(\d+(?:\.\d+)?)"), lambda m: (float(m[1]), float(m[2]))),
+    (re.compile(r"(?:under|less than|before age|before|younger than|<)\s*(\d+(?:\.\d+)?)"),
+     lambda m: (-_INF, float(m[1]) - 1e-9)),
+    (re.compile(r"(\d+(?:\.\d+)?)(?:\s*\w+)*?\s*(?:or older|or more|or higher|or over|\+)"),
+     lambda m: (float(m[1]), _INF)),
+    (re.compile(r"(\d+(?:\.\d+)?)(?:\s*\w+)*?\s*(?:or younger|or less|or fewer)"),
+     lambda m: (-_INF, float(m[1]))),
+    (re.compile(r"^(?:age\s*)?(\d+(?:\.\d+)?)\b"), lambda m: (float(m[1]), float(m[1]))),
+]
+
+# --- Hit-rate Counters ---
+_stats_lock = threading.Lock()
+_stats = {"local": 0, "llm": 0}
+
+
+def record_resolution(source):
+    """Counts one answer as resolved by "local" matching or by the "llm"."""
+    with _stats_lock:
+        _stats[source] += 1
+
+
+def matcher_stats():
+    """Returns process-wide counts of locally resolved vs LLM-resolved answers and the hit rate."""
+    with _stats_lock:
+        local, llm = _stats["local"], _stats["llm"]
+    total = local + llm
+    return {"local": local, "llm": llm, "local_hit_rate": (local / total) if total else 0.0}
+
+
+# --- Matching ---
+def normalize(text):
+    """Lower-cases, strips punctuation (keeping range symbols) and collapses whitespace."""
+    text = _PUNCTUATION.sub(" ", text.lower().replace("\u2019", "'"))
+    return " ".join(text.split()).strip(" .")
+
+
+def _strip_fillers(text):
+    for prefix in _FILLER_PREFIXES:
+        if text.startswith(prefix):
+            return text[len(prefix):]
+    return text
+
+
+def option_interval(option_text):
+    """Parses a numeric option like "40-49", "Under 40" or "70 or older" into (low, high), or None."""
+    text = normalize(option_text)
+    for pattern, build in _RANGE_PATTERNS:
+        match = pattern.search(text)
+        if match:
+            return build(match)
+    return None
+
+
+def question_units(question_text, option_texts):
+    """
+    Returns the units a question's answers may be given in: those named in the question
+    or its options, plus years for questions about an age.
+    """
+    words = set(_WORD.findall(" ".join([question_text, *option_texts]).lower()))
+    units = {_UNIT_WORDS[word] for word in words if word in _UNIT_WORDS} - _NEVER_UNITS
+    if "age" in words:
+        units.add("year")
+    return units
+
+
+def _unique(indexes, confidence, method):
+    return MatchResult(indexes[0], confidence, method) if len(indexes) == 1 else None
+
+
+def _match_canonical(answer, options_norm):
+    for canonical, phrasings in _CANONICAL_ANSWERS.items():
+        if answer in phrasings:
+            targets = _CANONICAL_OPTIONS[canonical]
+            exact = [i for i, opt in enumerate(options_norm) if opt in targets]
+            if exact:
+                return _unique(exact, 0.95, "synonym")
+            # e.g. "yes" when only one option starts with "Yes, ..."
+            prefixed = [
+                i for i, opt in enumerate(options_norm)
+                if any(opt.startswith(target + " ") for target in targets)
+            ]
+            return _unique(prefixed, 0.9, "synonym")
+    return None
+
+
+def _match_numeric(answer, intervals, units):
+    numbers = _NUMBER.findall(answer)
+    # Only trust short answers with a single number ("I'm 52", "about 3 hours")
+    if len(numbers) != 1 or len(answer.split()) > 6:
+        return None
+    value = float(numbers[0])
+    if sum(interval is not None for interval in intervals) < 2:
+        return None
+    # The number must be the quantity asked about: no foreign units, years or outliers
+    answer_units = {_UNIT_WORDS[word] for word in _WORD.findall(answer) if word in _UNIT_WORDS}
+    if answer_units - units or value >= _YEAR_LIKE:
+        return None
+    bounds = [bound for interval in intervals if interval for bound in interval if abs(bound) != _INF]
+    if bounds and value > _PLAUSIBLE_FACTOR * max(bounds):
+        return None
+    hits = [i for i, interval in enumerate(intervals) if interval and interval[0] <= value <= interval[1]]
+    return _unique(hits, 0.9, "numeric")
+
+
+def _match_fuzzy(answer, options_norm):
+    ratios = sorted(
+        ((SequenceMatcher(None, answer, opt).ratio(), i) for i, opt in enumerate(options_norm)),
+        reverse=True
+    )
+    best_ratio, best_index = ratios[0]
+    runner_up = ratios[1][0] if len(ratios) > 1 else 0.0
+    # A close second means the answer sits between two options: halve the confidence
+    confidence = best_ratio if best_ratio - runner_up >= 0.15 else best_ratio / 2
+    return MatchResult(best_index, confidence, "fuzzy")
+
+
+def match_answer(question_obj, user_answer):
+    """
+    Matches a free-text answer to one of the question's options without an LLM.
+
+    Tries, in order: exact normalised option text, yes/no/don't-know synonyms, numeric
+    ranges (for age/count style options) and fuzzy text similarity.
+
+    Args:
+        question_obj (dict): Quiz question with an "options" list of {"text", "points"}.
+                             Precomputed "options_normalized" / "option_intervals" /
+                             "answer_units" (see quiz_model.CompiledQuiz) are used when present.
+        user_answer (str): The user's free-text reply.
+
+    Returns:
+        MatchResult | None: option_index, confidence in [0, 1] and the method used,
+        or None if nothing plausible matched.
+    """
+    options = question_obj["options"]
+    answer = normalize(user_answer or "")
+    if not answer or not options:
+        return None
+    options_norm = question_obj.get("options_normalized") or [normalize(opt["text"]) for opt in options]
+    intervals = question_obj.get("option_intervals") or [option_interval(opt["text"]) for opt in options]
+    units = question_obj.get("answer_units")
+    if units is None:
+        units = question_units(question_obj.get("question", ""), [opt["text"] for opt in options])
+
+    exact = [i for i, opt in enumerate(options_norm) if opt == answer]
+    if exact:
+        return _unique(exact, 1.0, "exact")
+
+    stripped = _strip_fillers(answer)
+    return (
+        _match_canonical(answer, options_norm)
+        or _match_canonical(stripped, options_norm)
+        or _match_numeric(stripped, intervals, units)
+        or _match_fuzzy(answer, options_norm)
+    )
@@ -0,0 +1,178 @@
+# api_common.py - Request parsing and response formatting shared by app.py and asgi_app.py
+#
+# Framework-neutral: everything here takes plain dicts / mappings (a JSON body, form or
+# query string) so the Flask and the async app validate requests identically.
+import csv
+import io
+import json
+from datetime import datetime, timezone
+
+from config import SCAN_BATCH_MAX_ITEMS
+from scan_repository import SCAN_COLUMNS
+
+USER_FIELDS = ("fullName", "age", "gender", "contact")
+MISSING_USER_FIELDS = "Missing required fields: 'fullName', 'age', 'gender'."
+
+
+def user_info_from(data):
+    """Builds the user_info dict from a request body, form or query string."""
+    return {
+        "fullName": data.get("fullName"),
+        "age": data.get("age"),
+        "gender": data.get("gender"),
+        "contact": data.get("contact"),
+    }
+
+
+def missing_user_fields(user_info):
+    return not user_info["fullName"] or not user_info["age"] or not user_info["gender"]
+
+
+def parse_scan_request(data):
+    """Extracts (img_b64, user_info) from a scan request body, or returns an error message."""
+    img_b64 = data.get("image")
+    user_info = user_info_from(data)
+
+    # Basic Validation
+    if not img_b64:
+        return None, None, "Missing 'image' data (base64 encoded)."
+    if missing_user_fields(user_info):
+        return None, None, MISSING_USER_FIELDS
+    return img_b64, user_info, None
+
+
+def parse_scan_batch(data):
+    """
+    Validates a batch scan request body ({"scans": [...]}, with optional top-level user
+    fields that apply to every scan that doesn't set its own).
+
+    Returns:
+        tuple: (results, valid_items, valid_indexes, error). results holds a per-item error
+               dict for invalid entries and None for the rest; valid_items are the
+               (img_b64, user_info) pairs to process. error is (message, status) when the
+               request as a whole is rejected, otherwise None.
+    """
+    scans = data.get("scans")
+    if not scans or not isinstance(scans, list):
+        return None, None, None, ("'scans' must be a non-empty list.", 400)
+    if len(scans) > SCAN_BATCH_MAX_ITEMS:
+        return None, None, None, (f"Too many scans in one batch (max {SCAN_BATCH_MAX_ITEMS}).", 413)
+
+    # Validate each item up front so bad entries never reach inference
+    results = [None] * len(scans)
+    valid_items, valid_indexes = [], []
+    for index, scan in enumerate(scans):
+        if not isinstance(scan, dict):
+            results[index] = {"index": index, "error": "Each scan must be an object."}
+            continue
+        user_info = {key: scan.get(key, data.get(key)) for key in USER_FIELDS}
+        if not scan.get("image"):
+            results[index] = {"index": index, "error": "Missing 'image' data (base64 encoded)."}
+        elif missing_user_fields(user_info):
+            results[index] = {"index": index, "error": MISSING_USER_FIELDS}
+        else:
+            valid_items.append((scan["image"], user_info))
+            valid_indexes.append(index)
+    return results, valid_items, valid_indexes, None
+
+
+def merge_batch_results(results, valid_indexes, processed):
+    """Puts processed batch results back at their input positions."""
+    for index, item_result in zip(valid_indexes, processed):
+        item_result["index"] = index
+        results[index] = item_result
+    return results
+
+
+def history_filters(args):
+    """Reads and validates the scan history filters from the query string."""
+    filters = {
+        "contact": args.get("contact") or None,
+        "primary_class": args.get("primary_class") or None,
+        "since": args.get("since") or None,
+        "until": args.get("until") or None,
+        "min_confidence": args.get("min_confidence") or None,
+    }
+    if filters["min_confidence"] is not None:
+        try:
+            filters["min_confidence"] = float(filters["min_confidence"])
+        except ValueError:
+            raise ValueError("'min_confidence' must be a number.")
+    for key in ("since", "until"):
+        if filters[key]:
+            filters[key] = _utc_timestamp(filters[key], key)
+    return filters
+
+
+def _utc_timestamp(value, key):
+    """
+    Converts an ISO 8601 date or timestamp to the stored scan timestamp form
+    (YYYY-MM-DDTHH:MM:SS.ffffffZ, UTC), so it compares correctly as text. Timestamps
+    without an offset are taken as UTC; a date alone means midnight UTC.
+    """
+    try:
+        parsed = datetime.fromisoformat(value.replace("Z", "+00:00"))
+    except ValueError:
+        raise ValueError(f"'{key}' must be an ISO 8601 date or timestamp.")
+    if parsed.tzinfo is not None:
+        parsed = parsed.astimezone(timezone.utc).replace(tzinfo=None)
+    return parsed.strftime("%Y-%m-%dT%H:%M:%S.%fZ")
+
+
+def export_lines(rows, export_format):
+    """
+    Yields scan history rows as NDJSON lines or CSV text (header first).
+    Nested fields (predictions, result) are written as JSON text in CSV.
+    """
+    if export_format != "csv":
+        for row in rows:
+            yield json.dumps(row) + "\n"
+        return
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(SCAN_COLUMNS)
+    for row in rows:
+        writer.writerow([
+            json.dumps(row[column]) if isinstance(row[column], (dict, list)) else row[column]
+            for column in SCAN_COLUMNS
+        ])
+        yield buffer.getvalue()
+        buffer.seek(0)
+        buffer.truncate(0)
+    yield buffer.getvalue()
+
+
+EXPORT_FORMATS = {
+    "ndjson": ("application/x-ndjson", "scans.ndjson"),
+    "csv": ("text/csv", "scans.csv"),
+}
+
+
+def risk_assessment_response(result):
+    """Turns a run_quiz_from_conversation() result into the (body, status) the API returns."""
+    if isinstance(result, dict) and "interpretation" in result:
+        return {"risk_assessment_result": result.get("interpretation") or "No interpretation available."}, 200
+    if isinstance(result, dict) and "error" in result:
+        return {"error": result["error"]}, 400
+    return {"error": "Failed to process risk assessment."}, 500
+
+
+def parse_session_answer(data):
+    """Extracts (question_id, answer) from a risk session answer body, or returns an error message."""
+    question_id, answer = data.get("question_id"), data.get("answer")
+    if isinstance(question_id, str) and question_id.isdigit():
+        question_id = int(question_id)
+    if not isinstance(question_id, int) or isinstance(question_id, bool):
+        return None, None, "'question_id' must be an integer."
+    if not isinstance(answer, str):
+        return None, None, "'answer' must be a string."
+    return question_id, answer, None  # Not stripped: it must match the conversation sent at the end
+
+
+def sse(data, event=None):
+    """Formats one Server-Sent Event; data is JSON-encoded so newlines can't break framing."""
+    prefix = f"event: {event}\n" if event else ""
+    return f"{prefix}data: {json.dumps(data)}\n\n"
+
+
+CHAT_STREAM_ERROR = "Gemini was unable to generate a response at this time. Please try again later."
@@ -1,8 +1,26 @@
 # app.py - Flask Application Routes
 
 import sqlite3 # Keep for potential direct error handling if needed
-from flask import Flask, request, jsonify
+import time
+from flask import Flask, request, jsonify, Response, stream_with_context, g
 from flask_cors import CORS
+from config import SCAN_JOB_WORKERS, SCAN_JOB_MAX_DEPTH, SCAN_JOB_MAX_WAIT_SECONDS
+from config import SCAN_JOB_HEARTBEAT_SECONDS, SCAN_JOB_STALE_SECONDS, SCAN_JOB_RESULT_TTL_SECONDS
+from config import SCAN_UPLOAD_MAX_BYTES, SCAN_UPLOAD_SPOOL_BYTES
+from config import SCAN_HISTORY_PAGE_SIZE, SCAN_HISTORY_MAX_PAGE_SIZE
+from config import RISK_SESSION_WORKERS, RISK_SESSION_TTL_SECONDS
+from scan_jobs import ScanJobQueue, QueueFullError
+from risk_sessions import RiskSessionStore
+from answer_matcher import matcher_stats
+from scan_repository import get_repository
+from uploads import read_upload, read_image_header, UploadTooLargeError
+from clients import client_status, warm_up
+from inference_backends import get_backend, backend_status
+from resilience import breaker_status
+from api_common import user_info_from, missing_user_fields, MISSING_USER_FIELDS, parse_scan_request
+from api_common import parse_scan_batch, merge_batch_results, history_filters, export_lines, EXPORT_FORMATS
+from api_common import risk_assessment_response, parse_session_answer, sse, CHAT_STREAM_ERROR
+from instrumentation import REGISTRY, HTTP_REQUEST_SECONDS, callback_metric, log_event, new_request_id, set_request_id
 
 # --- Import Logic Modules ---
 try:
@@ -13,7 +31,7 @@ try:
 except ImportError:
     print("FATAL ERROR: ML.py not found. Scan processing will fail.")
     # Define dummy functions to prevent app crash on import error, but log clearly
-    ml_logic = type('obj', (object,), {'init_db': lambda: False, 'process_scan': lambda img, usr: (_ for _ in ()).throw(ImportError("ML module missing"))})()
+    ml_logic = type('obj', (object,), {'DB_PATH': 'scans.db', 'init_db': lambda: False, 'process_scan': lambda img, usr: (_ for _ in ()).throw(ImportError("ML module missing")), 'process_scan_batch': lambda items: (_ for _ in ()).throw(ImportError("ML module missing")), 'process_scan_bytes': lambda img, usr: (_ for _ in ()).throw(ImportError("ML module missing"))})()
 
 
 try:
@@ -23,10 +41,11 @@ except ImportError:
     def run_quiz_from_conversation(conv): return {"error": "Module not found"}
 
 try:
-    from chatbot import get_chat_response
+    from chatbot import get_chat_response, stream_chat_response
 except ImportError:
     print("Warning: chatbot module not found. /api/chat endpoint will fail.")
     def get_chat_response(msg): return "Chatbot module not found"
+    def stream_chat_response(msg): yield "Chatbot module not found"
 
 
 # --- Flask App Initialization ---
@@ -40,6 +59,64 @@ if not ml_logic.init_db():
      # import sys
      # sys.exit(1)
 
+# --- Scan Job Queue ---
+# Runs ML.process_scan on local worker threads for the submit/poll API below.
+scan_jobs = ScanJobQueue(
+    get_repository(ml_logic.DB_PATH),
+    ml_logic.process_scan,
+    workers=SCAN_JOB_WORKERS,
+    max_depth=SCAN_JOB_MAX_DEPTH,
+    heartbeat_seconds=SCAN_JOB_HEARTBEAT_SECONDS,
+    stale_seconds=SCAN_JOB_STALE_SECONDS,
+    result_ttl_seconds=SCAN_JOB_RESULT_TTL_SECONDS,
+)
+try:
+    scan_jobs.init_db()
+    scan_jobs.start()
+except sqlite3.Error as e:
+    print(f"FATAL ERROR: Scan job queue initialization failed: {e}")
+callback_metric("scan_queue_depth", "Scan jobs queued or running.", "gauge", lambda: {(): scan_jobs.depth()})
+
+# --- Risk Assessment Sessions ---
+# Quiz answers are scored as they arrive (see risk_sessions.py).
+risk_sessions = RiskSessionStore(
+    get_repository(ml_logic.DB_PATH),
+    workers=RISK_SESSION_WORKERS,
+    ttl_seconds=RISK_SESSION_TTL_SECONDS,
+)
+try:
+    risk_sessions.init_db()
+except sqlite3.Error as e:
+    print(f"FATAL ERROR: Risk session store initialization failed: {e}")
+callback_metric(
+    "quiz_answers_resolved_total", "Quiz answers mapped to an option by the local matcher or the LLM.", "counter",
+    lambda: {(source,): matcher_stats()[source] for source in ("local", "llm")}, ("source",)
+)
+callback_metric("quiz_local_hit_rate", "Share of quiz answers mapped without an LLM call.", "gauge",
+                lambda: {(): matcher_stats()["local_hit_rate"]})
+
+
+# --- Request Ids and Timing ---
+# Every request gets an id (the caller's X-Request-ID, if it sent one) that is echoed in
+# the response and tagged on every structured log line written while handling it.
+
+@app.before_request
+def _start_request():
+    g.request_id = request.headers.get("X-Request-ID") or new_request_id()
+    g.request_started = time.perf_counter()
+    set_request_id(g.request_id)
+
+
+@app.after_request
+def _finish_request(response):
+    elapsed = time.perf_counter() - g.request_started
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    HTTP_REQUEST_SECONDS.observe(elapsed, method=request.method, route=route, status=response.status_code)
+    log_event("http_request", method=request.method, route=route, status=response.status_code,
+              duration_ms=elapsed * 1000)
+    response.headers["X-Request-ID"] = g.request_id
+    return response
+
 
 # --- API Routes ---
 
@@ -49,26 +126,15 @@ def check_scan_route():
     if not request.is_json:
         return jsonify({"error": "Request must be JSON"}), 415
 
-    data = request.get_json()
-    img_b64 = data.get("image")
-    user_info = {
-        "fullName": data.get("fullName"),
-        "age": data.get("age"),
-        "gender": data.get("gender"),
-        "contact": data.get("contact"),
-    }
-
-    # Basic Validation
-    if not img_b64:
-        return jsonify({"error": "Missing 'image' data (base64 encoded)."}), 400
-    if not user_info["fullName"] or not user_info["age"] or not user_info["gender"]:
-        return jsonify({"error": "Missing required fields: 'fullName', 'age', 'gender'."}), 400
+    img_b64, user_info, error = parse_scan_request(request.get_json())
+    if error:
+        return jsonify({"error": error}), 400
 
     try:
         # Call the processing function from the ML module
         results = ml_logic.process_scan(img_b64, user_info)
 
-        # The previous result is already a JSON string, current is a dict/list
+        # current is the model response, previous the contact's last scan as a dict
         # We can return this structure directly
         return jsonify(results), 200
 
@@ -88,26 +154,257 @@ def check_scan_route():
         return jsonify({"error": "An unexpected server error occurred."}), 500
 
 
+@app.route('/api/check_scan_upload', methods=['POST'])
+def check_scan_upload_route():
+    """
+    Binary variant of /api/check_scan that avoids base64 and JSON parsing of the image.
+
+    Accepts either multipart/form-data (an 'image' file part plus user fields as form
+    fields) or a raw application/octet-stream / image/* body with user fields in the
+    query string. The body is streamed to a spooled buffer and only the image header is
+    validated before the bytes go to inference.
+    """
+    if request.content_length is not None and request.content_length > SCAN_UPLOAD_MAX_BYTES:
+        return jsonify({"error": f"Upload exceeds the {SCAN_UPLOAD_MAX_BYTES} byte limit."}), 413
+
+    mimetype = request.mimetype
+    try:
+        if mimetype == "multipart/form-data":
+            upload = request.files.get("image")
+            if upload is None:
+                return jsonify({"error": "Missing 'image' file part."}), 400
+            user_info = user_info_from(request.form)
+            img_bytes = read_upload(upload.stream, SCAN_UPLOAD_MAX_BYTES, SCAN_UPLOAD_SPOOL_BYTES)
+        elif mimetype == "application/octet-stream" or mimetype.startswith("image/"):
+            user_info = user_info_from(request.args)
+            img_bytes = read_upload(request.stream, SCAN_UPLOAD_MAX_BYTES, SCAN_UPLOAD_SPOOL_BYTES)
+        else:
+            return jsonify({"error": "Request must be multipart/form-data or application/octet-stream"}), 415
+    except UploadTooLargeError as e:
+        return jsonify({"error": str(e)}), 413
+
+    # Basic Validation
+    if not img_bytes:
+        return jsonify({"error": "Missing image data."}), 400
+    if missing_user_fields(user_info):
+        return jsonify({"error": MISSING_USER_FIELDS}), 400
+    try:
+        read_image_header(img_bytes)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid image: {e}"}), 400
+
+    try:
+        results = ml_logic.process_scan_bytes(img_bytes, user_info)
+        return jsonify(results), 200
+
+    except ConnectionError as e:
+        print(f"Connection/Processing Error in check_scan_upload_route: {e}")
+        return jsonify({"error": f"Processing failed: {e}"}), 500
+    except sqlite3.Error as e:
+        print(f"Database Error in check_scan_upload_route: {e}")
+        return jsonify({"error": "A database error occurred."}), 500
+    except Exception as e:
+        print(f"Unexpected Error in /api/check_scan_upload route: {e.__class__.__name__}: {e}")
+        return jsonify({"error": "An unexpected server error occurred."}), 500
+
+
+@app.route('/api/check_scan_batch', methods=['POST'])
+def check_scan_batch_route():
+    """
+    Endpoint to process many scans in one request (e.g. CC and MLO views, or a clinic backlog).
+
+    Body: {"scans": [{"image": ..., "fullName": ..., "age": ..., "gender": ..., "contact": ...}, ...]}
+    User fields given at the top level apply to every scan that doesn't set its own.
+    Results are returned in input order, with per-item errors.
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 415
+
+    results, valid_items, valid_indexes, error = parse_scan_batch(request.get_json())
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    try:
+        if valid_items:
+            merge_batch_results(results, valid_indexes, ml_logic.process_scan_batch(valid_items))
+        return jsonify({"results": results}), 200
+
+    except ConnectionError as e:
+        print(f"Connection/Processing Error in check_scan_batch_route: {e}")
+        return jsonify({"error": f"Processing failed: {e}"}), 500
+    except Exception as e:
+        print(f"Unexpected Error in /api/check_scan_batch route: {e.__class__.__name__}: {e}")
+        return jsonify({"error": "An unexpected server error occurred."}), 500
+
+
+@app.route('/api/scans/jobs', methods=['POST'])
+def submit_scan_job_route():
+    """Queues a scan for background processing and returns its job id immediately."""
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 415
+
+    img_b64, user_info, error = parse_scan_request(request.get_json())
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        job_id = scan_jobs.submit(img_b64, user_info)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+    except sqlite3.Error as e:
+        print(f"Database Error in submit_scan_job_route: {e}")
+        return jsonify({"error": "A database error occurred."}), 500
+
+    log_event("scan_job_submitted", job_id=job_id)
+    response = jsonify({"job_id": job_id, "status": "queued"})
+    response.headers["Location"] = f"/api/scans/jobs/{job_id}"
+    return response, 202
+
+
+@app.route('/api/scans/jobs/<job_id>', methods=['GET'])
+def get_scan_job_route(job_id):
+    """Returns a job's status and result. Pass ?wait=<seconds> to long-poll until it finishes."""
+    try:
+        wait = min(float(request.args.get("wait", 0)), SCAN_JOB_MAX_WAIT_SECONDS)
+    except ValueError:
+        return jsonify({"error": "'wait' must be a number of seconds."}), 400
+
+    try:
+        job = scan_jobs.wait(job_id, wait) if wait > 0 else scan_jobs.get(job_id)
+    except sqlite3.Error as e:
+        print(f"Database Error in get_scan_job_route: {e}")
+        return jsonify({"error": "A database error occurred."}), 500
+
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify(job), 200
+
+
+# --- Scan History ---
+
+@app.route('/api/scans', methods=['GET'])
+def list_scans_route():
+    """
+    Pages through scan history, newest first.
+
+    Query: contact, primary_class, since (inclusive), until (exclusive), min_confidence
+    (only scans with a prediction - of primary_class, if given - at or above it), limit, cursor.
+    Pass the returned next_cursor as ?cursor= to get the following page.
+    """
+    try:
+        filters = history_filters(request.args)
+        limit = int(request.args.get("limit", SCAN_HISTORY_PAGE_SIZE))
+        if limit < 1:
+            raise ValueError("'limit' must be a positive integer.")
+        limit = min(limit, SCAN_HISTORY_MAX_PAGE_SIZE)
+        rows, next_cursor = get_repository(ml_logic.DB_PATH).list_scans(
+            cursor=request.args.get("cursor"), limit=limit, **filters
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except sqlite3.Error as e:
+        print(f"Database Error in list_scans_route: {e}")
+        return jsonify({"error": "A database error occurred."}), 500
+
+    return jsonify({"scans": rows, "next_cursor": next_cursor}), 200
+
+
+@app.route('/api/scans/export', methods=['GET'])
+def export_scans_route():
+    """
+    Streams every matching scan as NDJSON (default) or CSV (?format=csv).
+    Accepts the same filters as /api/scans. Rows are read through a cursor and written
+    as they are fetched, so memory use doesn't grow with the table.
+    """
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in ("ndjson", "csv"):
+        return jsonify({"error": "'format' must be 'ndjson' or 'csv'."}), 400
+    try:
+        filters = history_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    rows = get_repository(ml_logic.DB_PATH).iter_scans(**filters)
+    mimetype, filename = EXPORT_FORMATS[export_format]
+    return Response(
+        stream_with_context(export_lines(rows, export_format)),
+        mimetype=mimetype,
+        headers={"Content-Disposition": f"attachment; filename={filename}"},
+    )
+
+
 # --- Other Routes (Risk Assessment, Chatbot) ---
 # Keep these routes as they were in the previous combined version,
 # ensuring they handle errors gracefully.
 
 @app.route('/api/risk-assessment', methods=['POST'])
 def risk_assessment():
-    """Endpoint for risk assessment based on conversation."""
-    # (Keep implementation from previous version)
+    """
+    Endpoint for risk assessment based on conversation. With a "session_id" from
+    /api/risk-sessions, answers (and the final summary) already scored in that session are reused.
+    """
     if not request.is_json: return jsonify({"error": "Request must be JSON"}), 415
     try:
         data = request.get_json(); conversation = data.get("conversation", [])
         if not conversation or not isinstance(conversation, list): return jsonify({"error": "Conversation must be a non-empty list."}), 400
-        result = run_quiz_from_conversation(conversation)
-        if isinstance(result, dict) and "interpretation" in result:
-            risk_assessment_result = result.get("interpretation")
-            return jsonify({"risk_assessment_result": risk_assessment_result or "No interpretation available."}), 200
-        elif isinstance(result, dict) and "error" in result: return jsonify({"error": result["error"]}), 400
-        else: return jsonify({"error": "Failed to process risk assessment."}), 500
+        result = risk_sessions.finish(data["session_id"], conversation) if data.get("session_id") else None
+        if result is None:
+            result = run_quiz_from_conversation(conversation)
+        body, status = risk_assessment_response(result)
+        return jsonify(body), status
     except Exception as e: print(f"Error in /api/risk-assessment: {e}"); return jsonify({"error": "Internal server error."}), 500
 
+@app.route('/api/risk-sessions', methods=['POST'])
+def create_risk_session_route():
+    """Starts an incremental risk assessment. Optional body: {"user_name": ...}."""
+    data = request.get_json(silent=True) or {}
+    try:
+        session_id = risk_sessions.create(data.get("user_name") or None)
+        state = risk_sessions.get(session_id)
+    except sqlite3.Error as e:
+        print(f"Database Error in create_risk_session_route: {e}")
+        return jsonify({"error": "A database error occurred."}), 500
+    response = jsonify(state)
+    response.headers["Location"] = f"/api/risk-sessions/{session_id}"
+    return response, 201
+
+
+@app.route('/api/risk-sessions/<session_id>', methods=['GET'])
+def get_risk_session_route(session_id):
+    """Returns a session's progress: answers scored so far, running total and summary state."""
+    try:
+        state = risk_sessions.get(session_id)
+    except sqlite3.Error as e:
+        print(f"Database Error in get_risk_session_route: {e}")
+        return jsonify({"error": "A database error occurred."}), 500
+    if state is None:
+        return jsonify({"error": "Session not found."}), 404
+    return jsonify(state), 200
+
+
+@app.route('/api/risk-sessions/<session_id>/answers', methods=['POST'])
+def answer_risk_session_route(session_id):
+    """
+    Records one answer ({"question_id": 3, "answer": "no"}) and scores it in the background.
+    Returns 202 with the session state; re-posting a changed answer replaces it.
+    """
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 415
+    question_id, answer, error = parse_session_answer(request.get_json())
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        state = risk_sessions.answer(session_id, question_id, answer)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except sqlite3.Error as e:
+        print(f"Database Error in answer_risk_session_route: {e}")
+        return jsonify({"error": "A database error occurred."}), 500
+    if state is None:
+        return jsonify({"error": "Session not found."}), 404
+    return jsonify(state), 202
+
+
 @app.route('/api/chat', methods=['POST'])
 def chat():
     """Endpoint for the chatbot."""
@@ -121,6 +418,81 @@ def chat():
     except Exception as e: print(f"Error in /api/chat: {e}"); return jsonify({"error": "Internal server error."}), 500
 
 
+@app.route('/api/chat/stream', methods=['GET', 'POST'])
+def chat_stream():
+    """
+    Streaming variant of /api/chat using Server-Sent Events.
+
+    Accepts {"message": ...} as a JSON POST body, or ?message= on GET for EventSource clients.
+    Sends one unnamed event per text fragment ({"delta": "..."}), then either a "done"
+    event with the full response or an "error" event.
+    """
+    if request.method == 'POST':
+        if not request.is_json: return jsonify({"error": "Request must be JSON"}), 415
+        user_message = (request.get_json(silent=True) or {}).get('message', '')
+    else:
+        user_message = request.args.get('message', '')
+    if not user_message: return jsonify({"error": "Empty message received."}), 400
+
+    def events():
+        parts = []
+        try:
+            for text in stream_chat_response(user_message):
+                parts.append(text)
+                yield sse({"delta": text})
+        except Exception as e:
+            print(f"Error in /api/chat/stream: {e}")
+            yield sse({"error": CHAT_STREAM_ERROR}, event="error")
+            return
+        yield sse({"response": "".join(parts).strip()}, event="done")
+
+    return Response(
+        stream_with_context(events()),
+        mimetype="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# --- Health ---
+
+@app.route('/healthz', methods=['GET'])
+def healthz():
+    """
+    Readiness check: database reachability, scan queue depth, inference backend,
+    external client and circuit breaker state. With ?warm=1 the inference backend is
+    loaded and the SDK clients are built now (so the first user request doesn't pay for
+    it); anything that fails to load makes the check fail.
+    """
+    warm = request.args.get('warm', '').lower() in ('1', 'true', 'yes')
+    health = {"status": "ok"}
+    try:
+        get_repository(ml_logic.DB_PATH).connection().execute("SELECT 1").fetchone()
+        health["database"] = "ok"
+    except sqlite3.Error as e:
+        health["database"] = f"error: {e}"
+        health["status"] = "unavailable"
+    health["scan_queue_depth"] = scan_jobs.depth()
+    health["inference_backend"] = backend_status()
+    if warm:
+        try:
+            get_backend()
+            health["inference_backend"]["state"] = "ready"
+        except Exception as e:
+            health["inference_backend"]["state"] = f"error: {e}"
+    health["clients"] = warm_up() if warm else client_status()
+    health["circuits"] = breaker_status()  # An open circuit degrades features but isn't a readiness failure
+    states = [health["inference_backend"]["state"], *health["clients"].values()]
+    if any(state.startswith("error") for state in states):
+        health["status"] = "unavailable"
+    return jsonify(health), 200 if health["status"] == "ok" else 503
+
+
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """Prometheus scrape endpoint: latency histograms, LLM call outcomes and cache counters."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
 # --- Run Application ---
 if __name__ == '__main__':
     print("Starting Flask server...")
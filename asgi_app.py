@@ -0,0 +1,496 @@
+# asgi_app.py - Async (ASGI) variant of the API in app.py
+#
+# Same routes and JSON contracts as the Flask app, served from one event loop: requests
+# waiting on Roboflow, Groq or Gemini hold no thread, and every upstream call shares the
+# connection pool in clients.get_async_http(). SQLite work runs on worker threads.
+#
+# Needs quart and hypercorn (see requirements.txt); run with:
+#     hypercorn asgi_app:app --bind 0.0.0.0:5000
+import asyncio
+import sqlite3
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from quart import Quart, request, jsonify, Response, g
+from config import ASYNC_WORKER_THREADS, SCAN_JOB_WORKERS, SCAN_JOB_MAX_DEPTH, SCAN_JOB_MAX_WAIT_SECONDS
+from config import SCAN_JOB_HEARTBEAT_SECONDS, SCAN_JOB_STALE_SECONDS, SCAN_JOB_RESULT_TTL_SECONDS
+from config import SCAN_UPLOAD_MAX_BYTES, SCAN_UPLOAD_SPOOL_BYTES
+from config import SCAN_HISTORY_PAGE_SIZE, SCAN_HISTORY_MAX_PAGE_SIZE
+from config import RISK_SESSION_WORKERS, RISK_SESSION_TTL_SECONDS
+from scan_jobs import ScanJobQueue, QueueFullError
+from risk_sessions import RiskSessionStore
+from answer_matcher import matcher_stats
+from scan_repository import get_repository
+from uploads import read_upload, read_image_header, UploadTooLargeError
+from clients import client_status, warm_up, close_async_clients
+from inference_backends import get_backend, backend_status
+from resilience import breaker_status
+from api_common import user_info_from, missing_user_fields, MISSING_USER_FIELDS, parse_scan_request
+from api_common import parse_scan_batch, merge_batch_results, history_filters, export_lines, EXPORT_FORMATS
+from api_common import risk_assessment_response, parse_session_answer, sse, CHAT_STREAM_ERROR
+from instrumentation import REGISTRY, HTTP_REQUEST_SECONDS, callback_metric, log_event, new_request_id, set_request_id
+import ML as ml_logic
+from risk_assessment import run_quiz_from_conversation_async
+from chatbot import get_chat_response_async, stream_chat_response_async
+
+# --- Quart App Initialization ---
+app = Quart("her's")
+app.config["MAX_CONTENT_LENGTH"] = SCAN_UPLOAD_MAX_BYTES + 1024 * 1024  # Room for multipart framing
+CORS_ORIGINS = {"http://localhost:3000", "YOUR_PRODUCTION_FRONTEND_URL"}  # Add production URL
+
+if not ml_logic.init_db():
+    print("FATAL ERROR: Database initialization failed. Application might not function correctly.")
+
+# --- Scan Job Queue ---
+# Queued scans still run ML.process_scan on worker threads, exactly as in app.py.
+scan_jobs = ScanJobQueue(
+    get_repository(ml_logic.DB_PATH),
+    ml_logic.process_scan,
+    workers=SCAN_JOB_WORKERS,
+    max_depth=SCAN_JOB_MAX_DEPTH,
+    heartbeat_seconds=SCAN_JOB_HEARTBEAT_SECONDS,
+    stale_seconds=SCAN_JOB_STALE_SECONDS,
+    result_ttl_seconds=SCAN_JOB_RESULT_TTL_SECONDS,
+)
+try:
+    scan_jobs.init_db()
+    scan_jobs.start()
+except sqlite3.Error as e:
+    print(f"FATAL ERROR: Scan job queue initialization failed: {e}")
+callback_metric("scan_queue_depth", "Scan jobs queued or running.", "gauge", lambda: {(): scan_jobs.depth()})
+
+# --- Risk Assessment Sessions ---
+# Session answers are mapped on the store's own threads, as in app.py.
+risk_sessions = RiskSessionStore(
+    get_repository(ml_logic.DB_PATH),
+    workers=RISK_SESSION_WORKERS,
+    ttl_seconds=RISK_SESSION_TTL_SECONDS,
+)
+try:
+    risk_sessions.init_db()
+except sqlite3.Error as e:
+    print(f"FATAL ERROR: Risk session store initialization failed: {e}")
+callback_metric(
+    "quiz_answers_resolved_total", "Quiz answers mapped to an option by the local matcher or the LLM.", "counter",
+    lambda: {(source,): matcher_stats()[source] for source in ("local", "llm")}, ("source",)
+)
+callback_metric("quiz_local_hit_rate", "Share of quiz answers mapped without an LLM call.", "gauge",
+                lambda: {(): matcher_stats()["local_hit_rate"]})
+
+
+@app.before_serving
+async def _start_serving():
+    # asyncio.to_thread's default pool (CPU count + 4 threads) would queue every request's
+    # SQLite work behind a handful of threads
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=ASYNC_WORKER_THREADS, thread_name_prefix="asgi-worker")
+    )
+    try:
+        await asyncio.to_thread(get_backend)
+    except Exception as e:
+        print(f"Warning: inference backend failed to load at startup (retried on first scan): {e}")
+
+
+@app.after_serving
+async def _close_clients():
+    await close_async_clients()
+
+
+# --- Request Ids, Timing and CORS ---
+
+@app.before_request
+async def _start_request():
+    g.request_id = request.headers.get("X-Request-ID") or new_request_id()
+    g.request_started = time.perf_counter()
+    set_request_id(g.request_id)
+
+
+@app.after_request
+async def _finish_request(response):
+    elapsed = time.perf_counter() - g.request_started
+    route = request.url_rule.rule if request.url_rule else "unmatched"
+    HTTP_REQUEST_SECONDS.observe(elapsed, method=request.method, route=route, status=response.status_code)
+    log_event("http_request", method=request.method, route=route, status=response.status_code,
+              duration_ms=elapsed * 1000)
+    response.headers["X-Request-ID"] = g.request_id
+    origin = request.headers.get("Origin")
+    if origin in CORS_ORIGINS:
+        response.headers["Access-Control-Allow-Origin"] = origin
+        response.headers["Access-Control-Allow-Headers"] = "Content-Type, X-Request-ID"
+        response.headers["Access-Control-Allow-Methods"] = "GET, POST, OPTIONS"
+        response.headers["Access-Control-Expose-Headers"] = "X-Request-ID, Location"
+        response.headers["Vary"] = "Origin"
+    return response
+
+
+async def _read_body(chunks):
+    """Reads a request body chunk by chunk, failing as soon as it passes SCAN_UPLOAD_MAX_BYTES."""
+    body, total = [], 0
+    async for chunk in chunks:
+        total += len(chunk)
+        if total > SCAN_UPLOAD_MAX_BYTES:
+            raise UploadTooLargeError(f"Upload exceeds the {SCAN_UPLOAD_MAX_BYTES} byte limit.")
+        body.append(chunk)
+    return b"".join(body)
+
+
+# --- API Routes ---
+
+@app.route('/api/check_scan', methods=['POST'])
+async def check_scan_route():
+    """Async /api/check_scan: inference awaits Roboflow (or the local backend) without a thread."""
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 415
+
+    img_b64, user_info, error = parse_scan_request(await request.get_json())
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        results = await ml_logic.process_scan_async(img_b64, user_info)
+        return jsonify(results), 200
+
+    except ConnectionError as e:
+        print(f"Connection/Processing Error in check_scan_route: {e}")
+        return jsonify({"error": f"Processing failed: {e}"}), 500
+    except ValueError as e:
+        print(f"Value Error in check_scan_route: {e}")
+        return jsonify({"error": f"Invalid input data: {e}"}), 400
+    except sqlite3.Error as e:
+        print(f"Database Error in check_scan_route: {e}")
+        return jsonify({"error": "A database error occurred."}), 500
+    except Exception as e:
+        print(f"Unexpected Error in /api/check_scan route: {e.__class__.__name__}: {e}")
+        return jsonify({"error": "An unexpected server error occurred."}), 500
+
+
+@app.route('/api/check_scan_upload', methods=['POST'])
+async def check_scan_upload_route():
+    """Async /api/check_scan_upload (multipart 'image' part, or a raw body with user fields in the query)."""
+    if request.content_length is not None and request.content_length > SCAN_UPLOAD_MAX_BYTES:
+        return jsonify({"error": f"Upload exceeds the {SCAN_UPLOAD_MAX_BYTES} byte limit."}), 413
+
+    mimetype = request.mimetype
+    try:
+        if mimetype == "multipart/form-data":
+            upload = (await request.files).get("image")
+            if upload is None:
+                return jsonify({"error": "Missing 'image' file part."}), 400
+            user_info = user_info_from(await request.form)
+            img_bytes = read_upload(upload.stream, SCAN_UPLOAD_MAX_BYTES, SCAN_UPLOAD_SPOOL_BYTES)
+        elif mimetype == "application/octet-stream" or mimetype.startswith("image/"):
+            user_info = user_info_from(request.args)
+            img_bytes = await _read_body(request.body)
+        else:
+            return jsonify({"error": "Request must be multipart/form-data or application/octet-stream"}), 415
+    except UploadTooLargeError as e:
+        return jsonify({"error": str(e)}), 413
+
+    if not img_bytes:
+        return jsonify({"error": "Missing image data."}), 400
+    if missing_user_fields(user_info):
+        return jsonify({"error": MISSING_USER_FIELDS}), 400
+    try:
+        read_image_header(img_bytes)
+    except ValueError as e:
+        return jsonify({"error": f"Invalid image: {e}"}), 400
+
+    try:
+        results = await ml_logic.process_scan_bytes_async(img_bytes, user_info)
+        return jsonify(results), 200
+
+    except ConnectionError as e:
+        print(f"Connection/Processing Error in check_scan_upload_route: {e}")
+        return jsonify({"error": f"Processing failed: {e}"}), 500
+    except sqlite3.Error as e:
+        print(f"Database Error in check_scan_upload_route: {e}")
+        return jsonify({"error": "A database error occurred."}), 500
+    except Exception as e:
+        print(f"Unexpected Error in /api/check_scan_upload route: {e.__class__.__name__}: {e}")
+        return jsonify({"error": "An unexpected server error occurred."}), 500
+
+
+@app.route('/api/check_scan_batch', methods=['POST'])
+async def check_scan_batch_route():
+    """Async /api/check_scan_batch: up to ASYNC_BATCH_CONCURRENCY inferences in flight per batch."""
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 415
+
+    results, valid_items, valid_indexes, error = parse_scan_batch(await request.get_json())
+    if error:
+        return jsonify({"error": error[0]}), error[1]
+
+    try:
+        if valid_items:
+            merge_batch_results(results, valid_indexes, await ml_logic.process_scan_batch_async(valid_items))
+        return jsonify({"results": results}), 200
+
+    except ConnectionError as e:
+        print(f"Connection/Processing Error in check_scan_batch_route: {e}")
+        return jsonify({"error": f"Processing failed: {e}"}), 500
+    except Exception as e:
+        print(f"Unexpected Error in /api/check_scan_batch route: {e.__class__.__name__}: {e}")
+        return jsonify({"error": "An unexpected server error occurred."}), 500
+
+
+@app.route('/api/scans/jobs', methods=['POST'])
+async def submit_scan_job_route():
+    """Queues a scan for background processing and returns its job id immediately."""
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 415
+
+    img_b64, user_info, error = parse_scan_request(await request.get_json())
+    if error:
+        return jsonify({"error": error}), 400
+
+    try:
+        job_id = await asyncio.to_thread(scan_jobs.submit, img_b64, user_info)
+    except QueueFullError as e:
+        return jsonify({"error": str(e)}), 503
+    except sqlite3.Error as e:
+        print(f"Database Error in submit_scan_job_route: {e}")
+        return jsonify({"error": "A database error occurred."}), 500
+
+    log_event("scan_job_submitted", job_id=job_id)
+    response = jsonify({"job_id": job_id, "status": "queued"})
+    response.headers["Location"] = f"/api/scans/jobs/{job_id}"
+    return response, 202
+
+
+@app.route('/api/scans/jobs/<job_id>', methods=['GET'])
+async def get_scan_job_route(job_id):
+    """Returns a job's status and result. Pass ?wait=<seconds> to long-poll until it finishes."""
+    try:
+        wait = min(float(request.args.get("wait", 0)), SCAN_JOB_MAX_WAIT_SECONDS)
+    except ValueError:
+        return jsonify({"error": "'wait' must be a number of seconds."}), 400
+
+    try:
+        if wait > 0:
+            job = await asyncio.to_thread(scan_jobs.wait, job_id, wait)
+        else:
+            job = await asyncio.to_thread(scan_jobs.get, job_id)
+    except sqlite3.Error as e:
+        print(f"Database Error in get_scan_job_route: {e}")
+        return jsonify({"error": "A database error occurred."}), 500
+
+    if job is None:
+        return jsonify({"error": "Job not found."}), 404
+    return jsonify(job), 200
+
+
+# --- Scan History ---
+
+@app.route('/api/scans', methods=['GET'])
+async def list_scans_route():
+    """Pages through scan history, newest first (same filters and cursor as app.py)."""
+    try:
+        filters = history_filters(request.args)
+        limit = int(request.args.get("limit", SCAN_HISTORY_PAGE_SIZE))
+        if limit < 1:
+            raise ValueError("'limit' must be a positive integer.")
+        limit = min(limit, SCAN_HISTORY_MAX_PAGE_SIZE)
+        rows, next_cursor = await asyncio.to_thread(
+            get_repository(ml_logic.DB_PATH).list_scans,
+            cursor=request.args.get("cursor"), limit=limit, **filters
+        )
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except sqlite3.Error as e:
+        print(f"Database Error in list_scans_route: {e}")
+        return jsonify({"error": "A database error occurred."}), 500
+
+    return jsonify({"scans": rows, "next_cursor": next_cursor}), 200
+
+
+@app.route('/api/scans/export', methods=['GET'])
+async def export_scans_route():
+    """
+    Streams every matching scan as NDJSON (default) or CSV (?format=csv).
+    The cursor is read on one worker thread, a chunk of lines at a time.
+    """
+    export_format = request.args.get("format", "ndjson")
+    if export_format not in EXPORT_FORMATS:
+        return jsonify({"error": "'format' must be 'ndjson' or 'csv'."}), 400
+    try:
+        filters = history_filters(request.args)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    def read_chunk(lines, size=500):
+        return "".join(line for _, line in zip(range(size), lines))
+
+    def close(rows, lines):
+        lines.close()
+        rows.close()  # Closes the cursor
+
+    async def body():
+        # Thread-local SQLite connections: the whole export must run on a single thread
+        loop = asyncio.get_running_loop()
+        with ThreadPoolExecutor(max_workers=1, thread_name_prefix="scan-export") as executor:
+            # Generators: nothing touches the database until the first chunk is read on the executor
+            rows = get_repository(ml_logic.DB_PATH).iter_scans(**filters)
+            lines = export_lines(rows, export_format)
+            try:
+                while True:
+                    chunk = await loop.run_in_executor(executor, read_chunk, lines)
+                    if not chunk:
+                        break
+                    yield chunk
+            finally:
+                # Also when the client disconnects: the cursor belongs to the export thread
+                await loop.run_in_executor(executor, close, rows, lines)
+
+    mimetype, filename = EXPORT_FORMATS[export_format]
+    return Response(body(), mimetype=mimetype, headers={"Content-Disposition": f"attachment; filename={filename}"})
+
+
+# --- Other Routes (Risk Assessment, Chatbot) ---
+
+@app.route('/api/risk-assessment', methods=['POST'])
+async def risk_assessment():
+    """Endpoint for risk assessment based on conversation (and optionally a risk session), as in app.py."""
+    if not request.is_json: return jsonify({"error": "Request must be JSON"}), 415
+    try:
+        data = await request.get_json(); conversation = data.get("conversation", [])
+        if not conversation or not isinstance(conversation, list): return jsonify({"error": "Conversation must be a non-empty list."}), 400
+        result = None
+        if data.get("session_id"):
+            result = await asyncio.to_thread(risk_sessions.finish, data["session_id"], conversation)
+        if result is None:
+            result = await run_quiz_from_conversation_async(conversation)
+        body, status = risk_assessment_response(result)
+        return jsonify(body), status
+    except Exception as e: print(f"Error in /api/risk-assessment: {e}"); return jsonify({"error": "Internal server error."}), 500
+
+@app.route('/api/risk-sessions', methods=['POST'])
+async def create_risk_session_route():
+    """Starts an incremental risk assessment. Optional body: {"user_name": ...}."""
+    data = (await request.get_json(silent=True)) or {}
+    try:
+        session_id = await asyncio.to_thread(risk_sessions.create, data.get("user_name") or None)
+        state = await asyncio.to_thread(risk_sessions.get, session_id)
+    except sqlite3.Error as e:
+        print(f"Database Error in create_risk_session_route: {e}")
+        return jsonify({"error": "A database error occurred."}), 500
+    response = jsonify(state)
+    response.headers["Location"] = f"/api/risk-sessions/{session_id}"
+    return response, 201
+
+
+@app.route('/api/risk-sessions/<session_id>', methods=['GET'])
+async def get_risk_session_route(session_id):
+    """Returns a session's progress: answers scored so far, running total and summary state."""
+    try:
+        state = await asyncio.to_thread(risk_sessions.get, session_id)
+    except sqlite3.Error as e:
+        print(f"Database Error in get_risk_session_route: {e}")
+        return jsonify({"error": "A database error occurred."}), 500
+    if state is None:
+        return jsonify({"error": "Session not found."}), 404
+    return jsonify(state), 200
+
+
+@app.route('/api/risk-sessions/<session_id>/answers', methods=['POST'])
+async def answer_risk_session_route(session_id):
+    """Records one answer and scores it in the background (202 with the session state)."""
+    if not request.is_json:
+        return jsonify({"error": "Request must be JSON"}), 415
+    question_id, answer, error = parse_session_answer(await request.get_json())
+    if error:
+        return jsonify({"error": error}), 400
+    try:
+        state = await asyncio.to_thread(risk_sessions.answer, session_id, question_id, answer)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    except sqlite3.Error as e:
+        print(f"Database Error in answer_risk_session_route: {e}")
+        return jsonify({"error": "A database error occurred."}), 500
+    if state is None:
+        return jsonify({"error": "Session not found."}), 404
+    return jsonify(state), 202
+
+
+@app.route('/api/chat', methods=['POST'])
+async def chat():
+    """Endpoint for the chatbot."""
+    if not request.is_json: return jsonify({"error": "Request must be JSON"}), 415
+    try:
+        user_message = (await request.get_json()).get('message', '')
+        if not user_message: return jsonify({"error": "Empty message received."}), 400
+        response_message = await get_chat_response_async(user_message)
+        return jsonify({'response': response_message}), 200
+    except Exception as e: print(f"Error in /api/chat: {e}"); return jsonify({"error": "Internal server error."}), 500
+
+
+@app.route('/api/chat/stream', methods=['GET', 'POST'])
+async def chat_stream():
+    """Streaming variant of /api/chat using Server-Sent Events (same events as app.py)."""
+    if request.method == 'POST':
+        if not request.is_json: return jsonify({"error": "Request must be JSON"}), 415
+        user_message = ((await request.get_json(silent=True)) or {}).get('message', '')
+    else:
+        user_message = request.args.get('message', '')
+    if not user_message: return jsonify({"error": "Empty message received."}), 400
+
+    async def events():
+        parts = []
+        try:
+            async for text in stream_chat_response_async(user_message):
+                parts.append(text)
+                yield sse({"delta": text})
+        except Exception as e:
+            print(f"Error in /api/chat/stream: {e}")
+            yield sse({"error": CHAT_STREAM_ERROR}, event="error")
+            return
+        yield sse({"response": "".join(parts).strip()}, event="done")
+
+    response = Response(events(), mimetype="text/event-stream",
+                        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"})
+    response.timeout = None  # The stream ends when Gemini's does, bounded by CHAT_GEMINI_TIMEOUT_SECONDS
+    return response
+
+
+# --- Health ---
+
+@app.route('/healthz', methods=['GET'])
+async def healthz():
+    """Readiness check, as in app.py (?warm=1 loads the inference backend and SDK clients now)."""
+    warm = request.args.get('warm', '').lower() in ('1', 'true', 'yes')
+    health = {"status": "ok"}
+
+    def ping_database():
+        get_repository(ml_logic.DB_PATH).connection().execute("SELECT 1").fetchone()
+
+    try:
+        await asyncio.to_thread(ping_database)
+        health["database"] = "ok"
+    except sqlite3.Error as e:
+        health["database"] = f"error: {e}"
+        health["status"] = "unavailable"
+    health["scan_queue_depth"] = scan_jobs.depth()
+    health["inference_backend"] = backend_status()
+    if warm:
+        try:
+            await asyncio.to_thread(get_backend)
+            health["inference_backend"]["state"] = "ready"
+        except Exception as e:
+            health["inference_backend"]["state"] = f"error: {e}"
+    health["clients"] = await asyncio.to_thread(warm_up) if warm else client_status()
+    health["circuits"] = breaker_status()
+    states = [health["inference_backend"]["state"], *health["clients"].values()]
+    if any(state.startswith("error") for state in states):
+        health["status"] = "unavailable"
+    return jsonify(health), 200 if health["status"] == "ok" else 503
+
+
+@app.route('/metrics', methods=['GET'])
+async def metrics():
+    """Prometheus scrape endpoint (shared registry with the rest of the process)."""
+    return Response(REGISTRY.render(), mimetype="text/plain; version=0.0.4")
+
+
+# --- Run Application ---
+if __name__ == '__main__':
+    print("Starting Quart development server (use hypercorn in production)...")
+    app.run(host='0.0.0.0', port=5000)
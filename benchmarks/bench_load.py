@@ -0,0 +1,385 @@
+# bench_load.py - End-to-end load and latency benchmark against local stand-in services
+#
+# Starts the stand-ins from stand_ins.py, runs app.py in a subprocess pointed at them
+# (fresh database in a temporary directory), then drives /api/check_scan,
+# /api/risk-assessment and /api/chat at each concurrency level. Reports throughput,
+# p50/p95/p99 latency and the app's peak RSS per endpoint and level, and can save the
+# results as a baseline or compare them against one.
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_load.py                                  # defaults
+#   python benchmarks/bench_load.py --concurrency 1,8,32 --requests 200
+#   python benchmarks/bench_load.py --save-baseline main             # writes benchmarks/baselines/main.json
+#   python benchmarks/bench_load.py --compare main --max-regression 0.15
+#   python benchmarks/bench_load.py --endpoints chat --gemini-error-rate 0.2
+#   python benchmarks/bench_load.py --server asgi --concurrency 16,64,256  # asgi_app.py under hypercorn
+#
+# Extra app settings can be passed through the environment (e.g. INFERENCE_BACKEND=stub,
+# CHAT_CACHE_SIMILARITY=2 to measure chat without cache hits).
+import argparse
+import base64
+import glob
+import json
+import os
+import random
+import shutil
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import urllib.error
+import urllib.request
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from stand_ins import StandIns, add_profile_arguments, profiles_from_args  # noqa: E402
+
+BASELINE_DIR = os.path.join(ROOT, "benchmarks", "baselines")
+DATA_FILES = ("breast_cancer.txt", "breast_cancer_quiz.json")
+ENDPOINTS = ("check_scan", "risk_assessment", "chat")
+
+CHAT_TOPICS = ("alcohol", "obesity", "dense breast tissue", "BRCA1 mutations", "hormone therapy",
+               "family history", "physical activity", "diet", "age", "early menstruation", "radiation",
+               "pregnancy", "smoking", "mammograms", "breastfeeding")
+CHAT_TEMPLATES = ("Does {topic} increase breast cancer risk?", "How does {topic} affect my risk?",
+                  "What should I know about {topic} and breast cancer?", "Is {topic} linked to breast cancer?",
+                  "Can {topic} cause breast cancer?")
+FREE_TEXT_ANSWERS = ("I think it was somewhere in the middle", "hmm, probably the second one",
+                     "it's complicated, maybe a bit", "my doctor mentioned something like that once")
+
+
+# --- Workloads ---
+class Workloads:
+    """Builds request bodies for each endpoint from the sample images and the quiz."""
+
+    def __init__(self, seed, unique_images=True):
+        self.random = random.Random(seed)
+        self.lock = threading.Lock()
+        self.unique_images = unique_images
+        self.images = []
+        for path in sorted(glob.glob(os.path.join(ROOT, "P*_DM_CC.jpg"))):
+            with open(path, "rb") as f:
+                self.images.append(f.read())
+        if not self.images:
+            sys.exit("No sample images (P*_DM_CC.jpg) found in the repository root.")
+        with open(os.path.join(ROOT, "breast_cancer_quiz.json"), "r") as f:
+            self.quiz = json.load(f)
+
+    def check_scan(self, n):
+        with self.lock:
+            image = self.images[n % len(self.images)]
+            if self.unique_images:
+                # Bytes after the JPEG end marker are ignored by decoders but defeat the inference cache
+                image += self.random.randbytes(16)
+        return "/api/check_scan", {
+            "image": base64.b64encode(image).decode("ascii"),
+            "fullName": f"Bench User {n % 50}",
+            "age": 40 + n % 30,
+            "gender": "Female",
+            "contact": f"bench{n % 50}@example.com",
+        }
+
+    def _answer(self, question):
+        """A realistic reply: option text, a synonym, a number in range or free text."""
+        options = [option["text"] for option in question["options"]]
+        roll = self.random.random()
+        if roll < 0.5:
+            return self.random.choice(options)
+        if roll < 0.7:
+            return self.random.choice(("no", "nope", "yes", "I don't know", "not sure"))
+        if roll < 0.85:
+            return f"about {self.random.randint(1, 75)}"
+        return self.random.choice(FREE_TEXT_ANSWERS)
+
+    def risk_assessment(self, n):
+        with self.lock:
+            conversation = [
+                {"role": "assistant", "content": "Hi! What's your name?"},
+                {"role": "user", "content": f"My name is Bench User {n}"},
+            ]
+            for number, question in enumerate(self.quiz["questions"], start=1):
+                conversation.append({"role": "assistant", "content": f"Q{number}: {question['question']}"})
+                conversation.append({"role": "user", "content": self._answer(question)})
+        return "/api/risk-assessment", {"conversation": conversation}
+
+    def chat(self, n):
+        with self.lock:
+            template = self.random.choice(CHAT_TEMPLATES)
+            topic = self.random.choice(CHAT_TOPICS)
+        return "/api/chat", {"message": template.format(topic=topic)}
+
+
+# --- App Process ---
+def _free_port():
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class AppProcess:
+    """Runs app.py's Flask server (or asgi_app.py under hypercorn) in a subprocess inside a scratch directory."""
+
+    def __init__(self, env, threaded=True, server="flask"):
+        self.env = env
+        self.threaded = threaded
+        self.server = server
+        self.port = _free_port()
+        self.workdir = tempfile.mkdtemp(prefix="bench_load_")
+        self.log_path = os.path.join(self.workdir, "app.log")
+        self.proc = None
+
+    @property
+    def base_url(self):
+        return f"http://127.0.0.1:{self.port}"
+
+    def start(self, timeout=60):
+        for name in DATA_FILES:
+            shutil.copy(os.path.join(ROOT, name), self.workdir)
+        env = dict(os.environ, **self.env)
+        env["PYTHONPATH"] = ROOT + os.pathsep + env.get("PYTHONPATH", "")
+        if self.server == "asgi":
+            command = [sys.executable, "-m", "hypercorn", "asgi_app:app", "--bind", f"127.0.0.1:{self.port}",
+                       "--backlog", "1024", "--workers", "0"]  # In-process, so RSS is the app's
+        else:
+            command = [sys.executable, "-c",
+                       f"import app; app.app.run(host='127.0.0.1', port={self.port}, threaded={self.threaded}, "
+                       f"debug=False, use_reloader=False)"]
+        self._log = open(self.log_path, "w")
+        self.proc = subprocess.Popen(command, cwd=self.workdir, env=env,
+                                     stdout=self._log, stderr=subprocess.STDOUT)
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            if self.proc.poll() is not None:
+                sys.exit(f"App exited during startup; see {self.log_path}")
+            try:
+                with urllib.request.urlopen(f"{self.base_url}/healthz?warm=1", timeout=30) as response:
+                    if response.status == 200:
+                        return self
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.2)
+        sys.exit(f"App did not become ready within {timeout}s; see {self.log_path}")
+
+    def rss_bytes(self):
+        """Current resident set size of the app process (Linux /proc), or None."""
+        try:
+            with open(f"/proc/{self.proc.pid}/status") as f:
+                for line in f:
+                    if line.startswith("VmRSS:"):
+                        return int(line.split()[1]) * 1024
+        except OSError:
+            return None
+        return None
+
+    def stop(self, keep_workdir=False):
+        if self.proc and self.proc.poll() is None:
+            self.proc.terminate()
+            try:
+                self.proc.wait(10)
+            except subprocess.TimeoutExpired:
+                self.proc.kill()
+        self._log.close()
+        if not keep_workdir:
+            shutil.rmtree(self.workdir, ignore_errors=True)
+
+
+class RssSampler:
+    """Samples a process's RSS on a background thread and tracks the peak."""
+
+    def __init__(self, read_rss, interval=0.02):
+        self.read_rss = read_rss
+        self.interval = interval
+        self.peak = None
+        self._stop = threading.Event()
+        self._thread = threading.Thread(target=self._run, daemon=True)
+
+    def _run(self):
+        while not self._stop.is_set():
+            rss = self.read_rss()
+            if rss is not None and (self.peak is None or rss > self.peak):
+                self.peak = rss
+            self._stop.wait(self.interval)
+
+    def __enter__(self):
+        self._thread.start()
+        return self
+
+    def __exit__(self, *exc):
+        self._stop.set()
+        self._thread.join()
+
+
+# --- Driving Load ---
+def _post(base_url, path, body, timeout):
+    """POSTs JSON. Returns (ok, seconds)."""
+    data = json.dumps(body).encode("utf-8")
+    request = urllib.request.Request(base_url + path, data=data, headers={"Content-Type": "application/json"})
+    start = time.perf_counter()
+    try:
+        with urllib.request.urlopen(request, timeout=timeout) as response:
+            response.read()
+            ok = 200 <= response.status < 300
+    except (urllib.error.URLError, ConnectionError, TimeoutError):
+        ok = False
+    return ok, time.perf_counter() - start
+
+
+def percentile(sorted_values, fraction):
+    """Nearest-rank percentile of an already sorted list."""
+    if not sorted_values:
+        return 0.0
+    index = max(0, min(len(sorted_values) - 1, int(round(fraction * len(sorted_values) + 0.5)) - 1))
+    return sorted_values[index]
+
+
+def run_level(app, build_request, concurrency, requests, timeout):
+    """Sends `requests` requests with `concurrency` in flight. Returns a result dict."""
+    bodies = [build_request(n) for n in range(requests)]
+    latencies, errors = [], 0
+    lock = threading.Lock()
+
+    def send(item):
+        nonlocal errors
+        ok, seconds = _post(app.base_url, item[0], item[1], timeout)
+        with lock:
+            latencies.append(seconds)
+            errors += not ok
+
+    with RssSampler(app.rss_bytes) as sampler:
+        start = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            list(pool.map(send, bodies))
+        elapsed = time.perf_counter() - start
+
+    latencies.sort()
+    return {
+        "concurrency": concurrency,
+        "requests": requests,
+        "errors": errors,
+        "throughput_rps": requests / elapsed if elapsed else 0.0,
+        "p50_ms": percentile(latencies, 0.50) * 1000,
+        "p95_ms": percentile(latencies, 0.95) * 1000,
+        "p99_ms": percentile(latencies, 0.99) * 1000,
+        "peak_rss_mb": sampler.peak / (1024 * 1024) if sampler.peak else None,
+    }
+
+
+# --- Reporting ---
+def _format_row(key, result):
+    rss = f"{result['peak_rss_mb']:.1f}" if result["peak_rss_mb"] is not None else "n/a"
+    return (f"{key:<22}{result['requests']:>6}{result['errors']:>7}{result['throughput_rps']:>10.2f}"
+            f"{result['p50_ms']:>10.1f}{result['p95_ms']:>10.1f}{result['p99_ms']:>10.1f}{rss:>10}")
+
+
+def print_results(results):
+    print(f"{'endpoint@concurrency':<22}{'reqs':>6}{'errors':>7}{'req/s':>10}"
+          f"{'p50 ms':>10}{'p95 ms':>10}{'p99 ms':>10}{'RSS MB':>10}")
+    for key, result in results.items():
+        print(_format_row(key, result))
+
+
+def compare(results, baseline, max_regression):
+    """Prints changes against a baseline. Returns the keys that regressed beyond max_regression."""
+    regressed = []
+    print(f"\nCompared with baseline from {baseline.get('created', '?')}:")
+    print(f"{'endpoint@concurrency':<22}{'req/s':>18}{'p95 ms':>22}{'p99 ms':>22}")
+    for key, result in results.items():
+        base = baseline["results"].get(key)
+        if not base:
+            print(f"{key:<22}  (not in baseline)")
+            continue
+        changes = {}
+        for metric in ("throughput_rps", "p95_ms", "p99_ms"):
+            changes[metric] = (result[metric] - base[metric]) / base[metric] if base[metric] else 0.0
+        print(f"{key:<22}"
+              f"{base['throughput_rps']:>8.2f} -> {result['throughput_rps']:<7.2f}"
+              f"{base['p95_ms']:>9.1f} -> {result['p95_ms']:<9.1f}{changes['p95_ms']:>+4.0%}"
+              f"{base['p99_ms']:>9.1f} -> {result['p99_ms']:<9.1f}{changes['p99_ms']:>+4.0%}")
+        if changes["throughput_rps"] < -max_regression or changes["p95_ms"] > max_regression:
+            regressed.append(key)
+    return regressed
+
+
+def _baseline_path(name):
+    return name if name.endswith(".json") else os.path.join(BASELINE_DIR, f"{name}.json")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the API against local stand-in services.")
+    parser.add_argument("--endpoints", default=",".join(ENDPOINTS), help=f"Comma-separated subset of {ENDPOINTS}")
+    parser.add_argument("--concurrency", default="1,4,16", help="Comma-separated concurrency levels")
+    parser.add_argument("--requests", type=int, default=50, help="Requests per endpoint and level")
+    parser.add_argument("--warmup", type=int, default=2, help="Unmeasured requests per endpoint first")
+    parser.add_argument("--timeout", type=float, default=120.0, help="Per-request timeout in seconds")
+    parser.add_argument("--seed", type=int, default=1, help="Seed for workloads and stand-in jitter")
+    parser.add_argument("--allow-cache-hits", action="store_true",
+                        help="Re-send identical scan images (measures the inference cache instead of inference)")
+    parser.add_argument("--save-baseline", metavar="NAME", help="Save results to benchmarks/baselines/NAME.json")
+    parser.add_argument("--compare", metavar="NAME", help="Compare with a saved baseline (name or path)")
+    parser.add_argument("--max-regression", type=float, default=0.2,
+                        help="With --compare, exit non-zero if p95 rises or throughput falls by more than this")
+    parser.add_argument("--server", choices=("flask", "asgi"), default="flask",
+                        help="Serve app.py with Flask's threaded server, or asgi_app.py with hypercorn")
+    parser.add_argument("--keep-workdir", action="store_true", help="Keep the app's scratch directory and log")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    endpoints = [name.strip() for name in args.endpoints.split(",") if name.strip()]
+    unknown = set(endpoints) - set(ENDPOINTS)
+    if unknown:
+        parser.error(f"Unknown endpoints: {', '.join(sorted(unknown))}")
+    levels = [int(level) for level in args.concurrency.split(",")]
+    baseline = None
+    if args.compare:
+        with open(_baseline_path(args.compare), "r") as f:
+            baseline = json.load(f)
+
+    workloads = Workloads(args.seed, unique_images=not args.allow_cache_hits)
+    stand_ins = StandIns(profiles_from_args(args, seed=args.seed)).start()
+    app = AppProcess(stand_ins.app_env(), server=args.server)
+    print(f"Starting app (scratch directory {app.workdir}) ...")
+    app.start()
+
+    results = {}
+    try:
+        for endpoint in endpoints:
+            build = getattr(workloads, endpoint)
+            for n in range(args.warmup):
+                _post(app.base_url, *build(-1 - n), args.timeout)
+            for level in levels:
+                key = f"{endpoint}@{level}"
+                results[key] = run_level(app, build, level, args.requests, args.timeout)
+                print(_format_row(key, results[key]), flush=True)
+    finally:
+        app.stop(keep_workdir=args.keep_workdir)
+        stand_ins.stop()
+
+    print()
+    print_results(results)
+
+    settings = {name: value for name, value in vars(args).items()
+                if name not in ("save_baseline", "compare", "keep_workdir")}
+    if args.save_baseline:
+        os.makedirs(BASELINE_DIR, exist_ok=True)
+        path = _baseline_path(args.save_baseline)
+        with open(path, "w") as f:
+            json.dump({"created": datetime.utcnow().isoformat() + "Z", "settings": settings, "results": results},
+                      f, indent=2)
+        print(f"\nSaved baseline to {path}")
+
+    if baseline:
+        if baseline.get("settings", {}) != settings:
+            print("\nNote: baseline was recorded with different settings; comparisons may not be like-for-like.")
+        regressed = compare(results, baseline, args.max_regression)
+        if regressed:
+            print(f"\nFAIL: regressed beyond {args.max_regression:.0%}: {', '.join(regressed)}")
+            sys.exit(1)
+        print("\nOK: no regressions beyond the threshold")
+
+
+if __name__ == "__main__":
+    main()
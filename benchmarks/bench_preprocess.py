@@ -0,0 +1,98 @@
+# bench_preprocess.py - Reports bytes and time saved by scan preprocessing
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_preprocess.py                    # sample P*_DM_CC.jpg images
+#   python benchmarks/bench_preprocess.py scan1.jpg --mbps 10
+#   python benchmarks/bench_preprocess.py --infer            # also time real Roboflow calls
+import argparse
+import base64
+import glob
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from preprocess import preprocess_image, preprocess_signature  # noqa: E402
+
+
+def _time_infer(rf, model_id, img_bytes, repeat):
+    """Median wall time of `repeat` Roboflow calls for the given image bytes."""
+    payload = base64.b64encode(img_bytes).decode("ascii")
+    timings = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        rf.infer(payload, model_id=model_id)
+        timings.append(time.perf_counter() - start)
+    return sorted(timings)[len(timings) // 2]
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the effect of scan preprocessing.")
+    parser.add_argument("images", nargs="*", help="Images to measure (default: sample P*_DM_CC.jpg files)")
+    parser.add_argument("--repeat", type=int, default=5, help="Repetitions per measurement (median is reported)")
+    parser.add_argument("--mbps", type=float, default=20.0, help="Uplink bandwidth used to estimate upload time")
+    parser.add_argument("--infer", action="store_true", help="Also time Roboflow inference on both versions")
+    args = parser.parse_args()
+
+    images = args.images or sorted(glob.glob(os.path.join(ROOT, "P*_DM_CC.jpg")))
+    if not images:
+        parser.error("No images found.")
+
+    rf = model_id = None
+    if args.infer:
+        import ML
+        from clients import get_roboflow_client
+        try:
+            rf, model_id = get_roboflow_client(), ML.RF_MODEL_ID
+        except ValueError:
+            parser.error("Roboflow client is not configured (set ROBOFLOW).")
+
+    print(f"Preprocessing settings: {preprocess_signature()}")
+    print(f"{'image':<24}{'original':>12}{'processed':>12}{'saved':>8}{'prep ms':>10}{'upload saved ms':>17}"
+          + (f"{'infer orig ms':>15}{'infer prep ms':>15}" if args.infer else ""))
+
+    total_original = total_processed = 0
+    total_prep = total_upload_saved = total_infer_saved = 0.0
+    for path in images:
+        with open(path, "rb") as f:
+            img_bytes = f.read()
+
+        prep_times = []
+        for _ in range(args.repeat):
+            start = time.perf_counter()
+            prep = preprocess_image(img_bytes)
+            prep_times.append(time.perf_counter() - start)
+        prep_time = sorted(prep_times)[len(prep_times) // 2]
+
+        # Base64 adds a third to what actually goes over the wire
+        saved_bytes = (len(img_bytes) - len(prep.data)) * 4 / 3
+        upload_saved = saved_bytes * 8 / (args.mbps * 1e6)
+
+        total_original += len(img_bytes)
+        total_processed += len(prep.data)
+        total_prep += prep_time
+        total_upload_saved += upload_saved
+
+        line = (f"{os.path.basename(path):<24}{len(img_bytes):>12,}{len(prep.data):>12,}"
+                f"{1 - len(prep.data) / len(img_bytes):>8.1%}{prep_time * 1000:>10.1f}"
+                f"{(upload_saved - prep_time) * 1000:>17.1f}")
+        if args.infer:
+            infer_original = _time_infer(rf, model_id, img_bytes, args.repeat)
+            infer_processed = _time_infer(rf, model_id, prep.data, args.repeat)
+            total_infer_saved += infer_original - infer_processed - prep_time
+            line += f"{infer_original * 1000:>15.1f}{infer_processed * 1000:>15.1f}"
+        print(line)
+
+    print()
+    print(f"Total bytes: {total_original:,} -> {total_processed:,} "
+          f"({1 - total_processed / total_original:.1%} saved)")
+    print(f"Estimated upload time saved at {args.mbps:g} Mbit/s, net of preprocessing: "
+          f"{(total_upload_saved - total_prep) * 1000:.1f} ms")
+    if args.infer:
+        print(f"Measured end-to-end inference time saved, net of preprocessing: {total_infer_saved * 1000:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,95 @@
+# bench_startup.py - Import-time budget check for the Flask app
+#
+# Imports app.py in fresh interpreters with `python -X importtime`, reports the slowest
+# modules and fails if the median import time exceeds the budget or if an external SDK
+# is imported at startup (they must stay lazy, see clients.py).
+#
+# Usage (from the repository root):
+#   python benchmarks/bench_startup.py                 # default budget
+#   python benchmarks/bench_startup.py --budget-ms 800 --repeat 7 --top 20
+import argparse
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Modules that must only be imported on first use
+LAZY_MODULES = ("inference_sdk", "groq", "google.generativeai")
+# Data files app.py reads at import, copied so the run doesn't touch the real scans.db
+DATA_FILES = ("breast_cancer.txt", "breast_cancer_quiz.json")
+
+_IMPORTTIME_LINE = re.compile(r"^import time:\s+(\d+)\s+\|\s+(\d+)\s+\|(\s*)(\S+)")
+
+
+def _import_app(workdir):
+    """Imports app in a fresh interpreter. Returns {module: (self_us, cumulative_us, depth)}."""
+    env = dict(os.environ, PYTHONPATH=ROOT + os.pathsep + os.environ.get("PYTHONPATH", ""))
+    proc = subprocess.run(
+        [sys.executable, "-X", "importtime", "-c", "import app"],
+        cwd=workdir, env=env, capture_output=True, text=True
+    )
+    if proc.returncode != 0:
+        sys.exit(f"Importing app failed:\n{proc.stderr[-2000:]}")
+    modules = {}
+    for line in proc.stderr.splitlines():
+        match = _IMPORTTIME_LINE.match(line)
+        if match:
+            self_us, cumulative_us, indent, name = match.groups()
+            modules[name] = (int(self_us), int(cumulative_us), len(indent) // 2)
+    return modules
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Check app.py import time against a budget.")
+    parser.add_argument("--budget-ms", type=float, default=1000.0, help="Maximum median import time of app.py")
+    parser.add_argument("--repeat", type=int, default=5, help="Fresh interpreters to run (median is reported)")
+    parser.add_argument("--top", type=int, default=15, help="Slowest top-level imports to list")
+    args = parser.parse_args()
+
+    workdir = tempfile.mkdtemp(prefix="bench_startup_")
+    try:
+        for name in DATA_FILES:
+            if os.path.exists(os.path.join(ROOT, name)):
+                shutil.copy(os.path.join(ROOT, name), workdir)
+        runs = [_import_app(workdir) for _ in range(args.repeat)]
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    totals = sorted(run["app"][1] for run in runs if "app" in run)
+    median_ms = totals[len(totals) // 2] / 1000
+    last = runs[-1]
+
+    print("Slowest imports under app (cumulative ms, last run):")
+    children = sorted(
+        ((cumulative, name) for name, (_, cumulative, depth) in last.items() if depth == 1),
+        reverse=True
+    )
+    for cumulative, name in children[:args.top]:
+        print(f"  {cumulative / 1000:>9.1f}  {name}")
+    print()
+    print(f"app import time: median {median_ms:.1f} ms over {len(totals)} runs "
+          f"(min {totals[0] / 1000:.1f}, max {totals[-1] / 1000:.1f}), budget {args.budget_ms:g} ms")
+
+    failures = []
+    eager = sorted({name for run in runs for name in run
+                    if any(name == lazy or name.startswith(lazy + ".") for lazy in LAZY_MODULES)})
+    if eager:
+        roots = sorted({lazy for lazy in LAZY_MODULES for name in eager
+                        if name == lazy or name.startswith(lazy + ".")})
+        failures.append(f"SDKs imported at startup (should be lazy): {', '.join(roots)}")
+    if median_ms > args.budget_ms:
+        failures.append(f"import time {median_ms:.1f} ms exceeds budget {args.budget_ms:g} ms")
+
+    for failure in failures:
+        print(f"FAIL: {failure}")
+    if failures:
+        sys.exit(1)
+    print("OK")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,279 @@
+# stand_ins.py - Local stand-ins for Roboflow, Groq and Gemini used by the load benchmark
+#
+# Each stand-in is a small threaded HTTP server that speaks just enough of the real API
+# for the SDKs this app uses, with configurable latency, jitter and error rate. Responses
+# are deterministic for a given request body.
+#
+# Run standalone (from the repository root) and point the app at it:
+#   python benchmarks/stand_ins.py --roboflow-latency-ms 400 --groq-latency-ms 250
+#   ROBOFLOW=rf_local GROQ_API_KEY=gsk_local GEMINI_API_KEY=local \
+#   ROBOFLOW_API_URL=http://127.0.0.1:9001 GROQ_BASE_URL=http://127.0.0.1:9002 \
+#   GEMINI_API_ENDPOINT=http://127.0.0.1:9003 python app.py
+import argparse
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+_OPTION_LINE = re.compile(r"^([A-Z]): .* - (\d+) points?$", re.MULTILINE)
+_CHAT_WORDS = (
+    "Breast cancer risk depends on several factors including age family history genetics breast density "
+    "and lifestyle. Regular screening helps find changes early when treatment works best. Staying active "
+    "limiting alcohol and keeping a healthy weight can lower risk. Talk to a healthcare provider about "
+    "screening that suits your personal history and any symptoms you notice."
+).split()
+
+
+class ServiceProfile:
+    """Latency and failure behaviour of one stand-in service."""
+
+    def __init__(self, latency_ms=0.0, jitter_ms=0.0, error_rate=0.0, seed=None):
+        self.latency_ms = latency_ms
+        self.jitter_ms = jitter_ms
+        self.error_rate = error_rate
+        self._random = random.Random(seed)
+        self._lock = threading.Lock()
+
+    def delay(self):
+        """Sleeps for latency_ms +/- jitter_ms (uniform, never negative)."""
+        with self._lock:
+            jitter = self._random.uniform(-self.jitter_ms, self.jitter_ms) if self.jitter_ms else 0.0
+        time.sleep(max(0.0, self.latency_ms + jitter) / 1000)
+
+    def should_fail(self):
+        with self._lock:
+            return self.error_rate > 0 and self._random.random() < self.error_rate
+
+
+class _StandInHandler(BaseHTTPRequestHandler):
+    profile = ServiceProfile()
+    service = "stand-in"
+
+    def log_message(self, format, *args):
+        pass  # Keep benchmark output readable
+
+    def _read_body(self):
+        length = int(self.headers.get("Content-Length") or 0)
+        return self.rfile.read(length)
+
+    def _send_json(self, status, payload):
+        body = json.dumps(payload).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_POST(self):
+        body = self._read_body()
+        self.profile.delay()
+        if self.profile.should_fail():
+            self._send_json(503, {"error": {"code": 503, "message": f"{self.service} stand-in injected failure"}})
+            return
+        self.respond(body)
+
+    def respond(self, body):
+        raise NotImplementedError
+
+
+class RoboflowHandler(_StandInHandler):
+    """Roboflow hosted detect API (v0): POST /<model>/<version>?api_key=... with a base64 body."""
+
+    service = "roboflow"
+
+    def respond(self, body):
+        digest = hashlib.sha256(body).digest()
+        predictions = []
+        if digest[0] >= 64:
+            predictions.append({
+                "x": 100.0 + digest[1], "y": 100.0 + digest[2], "width": 40.0 + digest[3] % 60,
+                "height": 40.0 + digest[4] % 60, "confidence": round(0.5 + digest[5] / 510, 3),
+                "class": "Breast-cancer", "class_id": 0, "detection_id": digest.hex()[:32],
+            })
+        self._send_json(200, {
+            "time": self.profile.latency_ms / 1000,
+            "image": {"width": 640, "height": 640},
+            "predictions": predictions,
+        })
+
+
+class GroqHandler(_StandInHandler):
+    """Groq's OpenAI-compatible chat completions: POST /openai/v1/chat/completions."""
+
+    service = "groq"
+
+    def respond(self, body):
+        request = json.loads(body or b"{}")
+        prompt = "".join(message.get("content", "") for message in request.get("messages", []))
+        options = _OPTION_LINE.findall(prompt)
+        if options:
+            letter, points = options[hashlib.sha256(prompt.encode("utf-8")).digest()[0] % len(options)]
+            content = json.dumps({"selected_option": letter, "score": int(points)})
+        else:
+            content = "OK"
+        self._send_json(200, {
+            "id": "chatcmpl-standin",
+            "object": "chat.completion",
+            "created": int(time.time()),
+            "model": request.get("model", "stand-in"),
+            "choices": [{"index": 0, "finish_reason": "stop",
+                         "message": {"role": "assistant", "content": content}}],
+            "usage": {"prompt_tokens": len(prompt.split()), "completion_tokens": len(content.split()),
+                      "total_tokens": len(prompt.split()) + len(content.split())},
+        })
+
+
+class GeminiHandler(_StandInHandler):
+    """
+    Gemini REST API: POST /v1beta/models/<model>:generateContent and :streamGenerateContent
+    (the latter returns a JSON array of chunks written out over time, or Server-Sent Events
+    with ?alt=sse, as the async app requests).
+    """
+
+    service = "gemini"
+    chunk_interval_ms = 30.0
+
+    @staticmethod
+    def _candidate(text):
+        return {"candidates": [{"content": {"role": "model", "parts": [{"text": text}]},
+                                "finishReason": "STOP", "index": 0}]}
+
+    def respond(self, body):
+        request = json.loads(body or b"{}")
+        prompt = "".join(
+            part.get("text", "") for content in request.get("contents", []) for part in content.get("parts", [])
+        )
+        if "quiz_analysis" in prompt:
+            text = json.dumps({
+                "quiz_analysis": "Stand-in analysis of the quiz answers.",
+                "system_recommendation": "Discuss screening with your doctor.",
+                "credible_sources": ["https://www.cancer.org", "https://www.cancer.gov", "https://www.who.int"],
+                "motivational_note": "Knowing your risk is a strong first step. - Stand-in",
+            })
+        else:
+            text = " ".join(_CHAT_WORDS)
+
+        if ":streamGenerateContent" not in self.path:
+            self._send_json(200, self._candidate(text))
+            return
+
+        # Stream: first chunk after the base latency, then one chunk per interval
+        words = text.split(" ")
+        pieces = [" ".join(words[i:i + 10]) + " " for i in range(0, len(words), 10)]
+        sse = "alt=sse" in self.path
+        self.send_response(200)
+        self.send_header("Content-Type", "text/event-stream" if sse else "application/json")
+        self.send_header("Connection", "close")
+        self.end_headers()
+        if sse:
+            for n, piece in enumerate(pieces):
+                if n:
+                    time.sleep(self.chunk_interval_ms / 1000)
+                self.wfile.write(b"data: " + json.dumps(self._candidate(piece)).encode("utf-8") + b"\r\n\r\n")
+                self.wfile.flush()
+            self.close_connection = True
+            return
+        self.wfile.write(b"[")
+        for n, piece in enumerate(pieces):
+            if n:
+                time.sleep(self.chunk_interval_ms / 1000)
+                self.wfile.write(b",")
+            self.wfile.write(json.dumps(self._candidate(piece)).encode("utf-8"))
+            self.wfile.flush()
+        self.wfile.write(b"]")
+        self.close_connection = True
+
+
+class _Server(ThreadingHTTPServer):
+    request_queue_size = 1024  # The default backlog of 5 resets connections under a burst of clients
+
+
+HANDLERS = {"roboflow": RoboflowHandler, "groq": GroqHandler, "gemini": GeminiHandler}
+
+
+class StandIns:
+    """Starts and stops the three stand-in servers on background threads."""
+
+    def __init__(self, profiles, host="127.0.0.1", ports=None):
+        self.profiles = profiles  # service -> ServiceProfile
+        self.host = host
+        self.ports = ports or {}
+        self.servers = {}
+
+    def start(self):
+        for service, handler in HANDLERS.items():
+            handler_class = type(handler.__name__, (handler,), {"profile": self.profiles[service]})
+            server = _Server((self.host, self.ports.get(service, 0)), handler_class)
+            server.daemon_threads = True
+            threading.Thread(target=server.serve_forever, name=f"{service}-stand-in", daemon=True).start()
+            self.servers[service] = server
+        return self
+
+    def url(self, service):
+        host, port = self.servers[service].server_address[:2]
+        return f"http://{host}:{port}"
+
+    def app_env(self):
+        """Environment variables that point the app's clients at these stand-ins."""
+        return {
+            "ROBOFLOW": "rf_standin",
+            "GROQ_API_KEY": "gsk_standin",
+            "GEMINI_API_KEY": "standin",
+            "ROBOFLOW_API_URL": self.url("roboflow"),
+            "ROBOFLOW_API_VERSION": "v0",
+            "GROQ_BASE_URL": self.url("groq"),
+            "GEMINI_API_ENDPOINT": self.url("gemini"),
+        }
+
+    def stop(self):
+        for server in self.servers.values():
+            server.shutdown()
+            server.server_close()
+        self.servers = {}
+
+
+def add_profile_arguments(parser):
+    """Adds --<service>-latency-ms / -jitter-ms / -error-rate options for every service."""
+    defaults = {"roboflow": 350.0, "groq": 200.0, "gemini": 600.0}
+    for service, latency in defaults.items():
+        parser.add_argument(f"--{service}-latency-ms", type=float, default=latency,
+                            help=f"Mean {service} stand-in latency (default {latency:g})")
+        parser.add_argument(f"--{service}-jitter-ms", type=float, default=latency / 4,
+                            help=f"Uniform +/- jitter on the {service} latency")
+        parser.add_argument(f"--{service}-error-rate", type=float, default=0.0,
+                            help=f"Fraction of {service} calls that fail with HTTP 503")
+
+
+def profiles_from_args(args, seed=0):
+    return {
+        service: ServiceProfile(
+            getattr(args, f"{service}_latency_ms"), getattr(args, f"{service}_jitter_ms"),
+            getattr(args, f"{service}_error_rate"), seed=seed + n
+        )
+        for n, service in enumerate(HANDLERS)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run local stand-ins for Roboflow, Groq and Gemini.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port-base", type=int, default=9001, help="Roboflow port; Groq and Gemini use the next two")
+    add_profile_arguments(parser)
+    args = parser.parse_args()
+
+    ports = {service: args.port_base + n for n, service in enumerate(HANDLERS)}
+    stand_ins = StandIns(profiles_from_args(args), args.host, ports).start()
+    for name, value in stand_ins.app_env().items():
+        print(f"{name}={value}")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        stand_ins.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,189 @@
+# chat_cache.py - Normalised and near-duplicate response cache for the chatbot
+import math
+import re
+import threading
+import time
+from collections import Counter, OrderedDict
+
+_WORD = re.compile(r"[a-z0-9]+")
+
+STOPWORDS = frozenset("""
+a about am an and any are as at be been being can could did do does doing for from get
+got had has have having how i if in into is it its me my of on or our please should so
+some tell than that the their them then there these they this to was we were what when
+where which who why will with would you your yours
+""".split())
+
+
+def _stem(word):
+    """Very light plural stripping so "mammograms" and "mammogram" share a token."""
+    if len(word) > 4 and word.endswith("ies"):
+        return word[:-3] + "y"
+    if len(word) > 3 and word.endswith("s") and not word.endswith("ss"):
+        return word[:-1]
+    return word
+
+
+def normalize_query(text):
+    """Returns the content tokens of a message: lower-cased, punctuation and stopwords removed."""
+    return [_stem(word) for word in _WORD.findall(text.lower()) if word not in STOPWORDS]
+
+
+class _Entry:
+    __slots__ = ("message", "tokens", "response", "stored_at")
+
+    def __init__(self, message, tokens, response, stored_at):
+        self.message = message
+        self.tokens = tokens
+        self.response = response
+        self.stored_at = stored_at
+
+
+class ResponseCache:
+    """
+    LRU + TTL cache of chatbot answers that also matches paraphrases.
+
+    Lookups first try the normalised token string exactly, then compare TF-IDF vectors
+    against cached entries that share at least one token (found via an inverted index)
+    and return the best answer whose cosine similarity reaches `threshold`.
+    Entries can optionally be persisted to SQLite through a ScanRepository.
+    """
+
+    def __init__(self, max_entries=1000, ttl_seconds=86400, threshold=0.8, repository=None):
+        self.max_entries = max_entries
+        self.ttl_seconds = ttl_seconds
+        self.threshold = threshold
+        self.repository = repository
+        self._entries = OrderedDict()  # normalised key -> _Entry
+        self._postings = {}            # token -> set of keys containing it
+        self._lock = threading.Lock()
+        self.exact_hits = 0
+        self.similar_hits = 0
+        self.misses = 0
+        if repository is not None:
+            self._load()
+
+    # --- Persistence ---
+    def _load(self):
+        with self.repository.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS chat_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    message TEXT NOT NULL,
+                    response TEXT NOT NULL,
+                    stored_at REAL NOT NULL
+                )
+            """)
+            if self.ttl_seconds:
+                conn.execute("DELETE FROM chat_cache WHERE stored_at < ?", (time.time() - self.ttl_seconds,))
+            rows = conn.execute(
+                "SELECT cache_key, message, response, stored_at FROM chat_cache ORDER BY stored_at DESC LIMIT ?",
+                (self.max_entries,)
+            ).fetchall()
+        with self._lock:
+            for key, message, response, stored_at in reversed(rows):
+                self._add(key, _Entry(message, normalize_query(message), response, stored_at))
+
+    def _persist(self, key, entry, evicted):
+        if self.repository is None:
+            return
+        try:
+            with self.repository.transaction() as conn:
+                conn.execute(
+                    "INSERT OR REPLACE INTO chat_cache (cache_key, message, response, stored_at) VALUES (?, ?, ?, ?)",
+                    (key, entry.message, entry.response, entry.stored_at)
+                )
+                conn.executemany("DELETE FROM chat_cache WHERE cache_key = ?", [(k,) for k in evicted])
+        except Exception as e:
+            print(f"Chat cache write failed: {e}")
+
+    # --- Index Maintenance (call with self._lock held) ---
+    def _add(self, key, entry):
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = entry
+        for token in set(entry.tokens):
+            self._postings.setdefault(token, set()).add(key)
+
+    def _remove(self, key):
+        entry = self._entries.pop(key)
+        for token in set(entry.tokens):
+            keys = self._postings.get(token)
+            if keys is not None:
+                keys.discard(key)
+                if not keys:
+                    del self._postings[token]
+
+    def _expired(self, entry):
+        return bool(self.ttl_seconds) and time.time() - entry.stored_at > self.ttl_seconds
+
+    def _vector(self, tokens):
+        """TF-IDF vector (smoothed IDF over the cached entries) as a dict, with its norm."""
+        total = len(self._entries) + 1
+        vector = {
+            token: count * (math.log(total / (len(self._postings.get(token, ())) + 1)) + 1)
+            for token, count in Counter(tokens).items()
+        }
+        return vector, math.sqrt(sum(weight * weight for weight in vector.values()))
+
+    # --- Public API ---
+    def lookup(self, message):
+        """Returns a cached response for the message or a close paraphrase of it, or None."""
+        tokens = normalize_query(message)
+        if not tokens:
+            return None
+        key = " ".join(tokens)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is not None and not self._expired(entry):
+                self._entries.move_to_end(key)
+                self.exact_hits += 1
+                return entry.response
+
+            candidates = set()
+            for token in set(tokens):
+                candidates |= self._postings.get(token, set())
+            best_key, best_score = None, 0.0
+            if candidates:
+                query, query_norm = self._vector(tokens)
+                for candidate in candidates:
+                    other = self._entries[candidate]
+                    if self._expired(other):
+                        continue
+                    vector, norm = self._vector(other.tokens)
+                    dot = sum(weight * vector.get(token, 0.0) for token, weight in query.items())
+                    score = dot / (query_norm * norm) if query_norm and norm else 0.0
+                    if score > best_score:
+                        best_key, best_score = candidate, score
+            if best_key is not None and best_score >= self.threshold:
+                self._entries.move_to_end(best_key)
+                self.similar_hits += 1
+                return self._entries[best_key].response
+            self.misses += 1
+            return None
+
+    def store(self, message, response):
+        """Caches a response for a message, evicting least recently used entries over the limit."""
+        tokens = normalize_query(message)
+        if not tokens:
+            return
+        key = " ".join(tokens)
+        entry = _Entry(message, tokens, response, time.time())
+        evicted = []
+        with self._lock:
+            self._add(key, entry)
+            while len(self._entries) > self.max_entries:
+                oldest = next(iter(self._entries))
+                self._remove(oldest)
+                evicted.append(oldest)
+        self._persist(key, entry, evicted)
+
+    def stats(self):
+        """Returns hit/miss counters and the current number of entries."""
+        with self._lock:
+            return {
+                "exact_hits": self.exact_hits,
+                "similar_hits": self.similar_hits,
+                "misses": self.misses,
+                "entries": len(self._entries),
+            }
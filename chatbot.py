@@ -1,29 +1,85 @@
+import asyncio
 import os
-import google.generativeai as genai
+import time
 from config import GEMINI_API_KEY  # Or just hardcode if needed
+from config import CHAT_CACHE_ENTRIES, CHAT_CACHE_TTL_SECONDS, CHAT_CACHE_SIMILARITY, CHAT_CACHE_DB_PATH
+from config import KNOWLEDGE_BASE_PATH, CHAT_KB_TOP_K, CHAT_KB_DIRECT_MIN_COVERAGE, CHAT_KB_DIRECT_MIN_MARGIN
+from config import CHAT_GEMINI_TIMEOUT_SECONDS
+from chat_cache import ResponseCache
+from knowledge_base import load_knowledge_base, summarize
+from clients import get_gemini_model, gemini_generate_async, gemini_stream_async
+from scan_repository import get_repository
+from instrumentation import CHAT_RESPONSE_SECONDS, callback_metric, llm_call, log_event
+from resilience import GEMINI_POLICY
 
 # -----------------------------
-# Setup Gemini Client
+# Response Cache
 # -----------------------------
-def setup_gemini():
-    api_key = os.environ.get("GEMINI_API_KEY") or GEMINI_API_KEY
-    if not api_key:
-        raise ValueError("GEMINI_API_KEY is required.")
-    genai.configure(api_key=api_key)
-    return genai.GenerativeModel("gemini-2.0-flash")
+# Common questions and their paraphrases are answered without calling Gemini.
+CHAT_CACHE = ResponseCache(
+    max_entries=CHAT_CACHE_ENTRIES,
+    ttl_seconds=CHAT_CACHE_TTL_SECONDS,
+    threshold=CHAT_CACHE_SIMILARITY,
+    repository=get_repository(CHAT_CACHE_DB_PATH) if CHAT_CACHE_DB_PATH else None,
+)
+callback_metric(
+    "chat_cache_events_total", "Chat response cache lookups by outcome.", "counter",
+    lambda: {(outcome,): CHAT_CACHE.stats()[outcome] for outcome in ("exact_hits", "similar_hits", "misses")},
+    ("outcome",)
+)
 
 # -----------------------------
-# Get Chat Response Using Gemini
+# Knowledge Base
 # -----------------------------
-def get_chat_response(user_message):
+# BM25 index over breast_cancer.txt, built once at import
+KNOWLEDGE_BASE = load_knowledge_base(KNOWLEDGE_BASE_PATH)
+
+
+def direct_answer(hits):
     """
-    Uses Gemini to generate an AI response to the user's breast cancer-related query.
-    The prompt ensures it pulls from medically reliable information.
+    Returns an answer taken straight from the best passage when retrieval is confident,
+    otherwise None. Confident means the passage's heading names the topic, it contains
+    nearly all of the question's terms, and it clearly outscores the runner-up.
+    """
+    if not hits:
+        return None
+    best = hits[0]
+    runner_up = hits[1].score if len(hits) > 1 else 0.0
+    if (best.title_match and best.coverage >= CHAT_KB_DIRECT_MIN_COVERAGE
+            and best.score >= CHAT_KB_DIRECT_MIN_MARGIN * runner_up):
+        return summarize(best.passage.text)
+    return None
+
+
+def fallback_answer(hits):
+    """Best-effort answer from the knowledge base for when Gemini is unavailable, or None."""
+    if hits and hits[0].coverage >= 0.5:
+        return summarize(hits[0].passage.text)
+    return None
+
+# -----------------------------
+# Setup Gemini Client
+# -----------------------------
+def setup_gemini():
+    """
+    Returns the process-wide Gemini model; the SDK is imported and configured on first use.
+    The model is reused by every request instead of being rebuilt per message.
     """
-    model = setup_gemini()
+    return get_gemini_model(os.environ.get("GEMINI_API_KEY") or GEMINI_API_KEY)
 
-    # System prompt to anchor it on reliable, evidence-based knowledge
-    prompt = f"""
+# -----------------------------
+# Prompt
+# -----------------------------
+def build_prompt(user_message, hits=()):
+    """System prompt to anchor the model on reliable, evidence-based knowledge, plus retrieved passages."""
+    references = ""
+    if hits:
+        passages = "\n".join(f"[{n}] {hit.passage.title}: {hit.passage.text}" for n, hit in enumerate(hits, start=1))
+        references = f"""
+Reference passages from our curated breast cancer knowledge base. Base your answer on them when they are relevant:
+{passages}
+"""
+    return f"""
 You are an expert digital health assistant trained in cancer awareness and women's health.
 
 Your task is to answer user questions specifically about **breast cancer** in a conversational yet medically reliable way.
@@ -42,13 +98,197 @@ Please follow these principles:
 5. If u are unable to find satisfying results from the website then answer according to your knowledge or search over the web
 6. Output format is just a paragraph of a maximum 100 words with no special characters paragraph change is good but do not exceed word limit of 100 keep it as concise as possible.
 
+{references}
 User question: "{user_message}"
 
 Your response:
 """
 
+# -----------------------------
+# Get Chat Response Using Gemini
+# -----------------------------
+def _record_chat(source, started):
+    """Observes one chat answer's latency under where it came from."""
+    elapsed = time.perf_counter() - started
+    CHAT_RESPONSE_SECONDS.observe(elapsed, source=source)
+    log_event("chat_response", source=source, duration_ms=elapsed * 1000)
+
+
+def get_chat_response(user_message):
+    """
+    Uses Gemini to generate an AI response to the user's breast cancer-related query.
+    The prompt ensures it pulls from medically reliable information.
+    Answers are served from CHAT_CACHE when the same or a near-identical question was seen recently,
+    and straight from the knowledge base when one passage clearly answers the question.
+    Otherwise the top passages are added to the prompt; they also serve as the answer if Gemini fails.
+    """
+    started = time.perf_counter()
+    cached = CHAT_CACHE.lookup(user_message)
+    if cached is not None:
+        _record_chat("cache", started)
+        return cached
+
+    hits = KNOWLEDGE_BASE.search(user_message, k=CHAT_KB_TOP_K)
+    answer = direct_answer(hits)
+    if answer is not None:
+        _record_chat("knowledge_base", started)
+        return answer
+
+    try:
+        model, prompt = setup_gemini(), build_prompt(user_message, hits)
+        with llm_call("gemini", "chat"):
+            response = GEMINI_POLICY.call(
+                lambda timeout: model.generate_content(prompt, request_options={"timeout": timeout}),
+                timeout=CHAT_GEMINI_TIMEOUT_SECONDS,
+            )
+            answer = response.text.strip()
+        CHAT_CACHE.store(user_message, answer)
+        _record_chat("llm", started)
+        return answer
+    except Exception as e:
+        print(f"Gemini chat request failed: {e}")
+        _record_chat("fallback", started)
+        answer = fallback_answer(hits)
+        if answer is not None:
+            return answer
+        return f"⚠️ Gemini was unable to generate a response at this time. Please try again later. Error: {str(e)}"
+
+
+def stream_chat_response(user_message):
+    """
+    Same as get_chat_response, but yields the answer in pieces as Gemini produces them.
+    Cached and knowledge-base answers are yielded in one piece. The full answer is cached
+    once the stream completes.
+
+    Yields:
+        str: Successive text fragments of the answer.
+
+    Raises:
+        Exception: Whatever the Gemini SDK raises, unless nothing was sent yet and the
+                   knowledge base has a fallback answer; text already yielded is not retracted.
+    """
+    started = time.perf_counter()
+    cached = CHAT_CACHE.lookup(user_message)
+    if cached is not None:
+        _record_chat("cache", started)
+        yield cached
+        return
+
+    hits = KNOWLEDGE_BASE.search(user_message, k=CHAT_KB_TOP_K)
+    answer = direct_answer(hits)
+    if answer is not None:
+        _record_chat("knowledge_base", started)
+        yield answer
+        return
+
+    parts = []
+    try:
+        # A stream can't be retried once text has been sent; only the breaker applies
+        with llm_call("gemini", "chat_stream"), GEMINI_POLICY.guard():
+            stream = setup_gemini().generate_content(
+                build_prompt(user_message, hits),
+                stream=True,
+                request_options={"timeout": CHAT_GEMINI_TIMEOUT_SECONDS},
+            )
+            for chunk in stream:
+                text = chunk.text
+                if text:
+                    parts.append(text)
+                    yield text
+    except Exception as e:
+        _record_chat("fallback", started)
+        answer = None if parts else fallback_answer(hits)
+        if answer is None:
+            raise
+        print(f"Gemini chat stream failed: {e}")
+        yield answer
+        return
+    _record_chat("llm", started)
+    answer = "".join(parts).strip()
+    if answer:
+        CHAT_CACHE.store(user_message, answer)
+
+
+# -----------------------------
+# Async Variants (asgi_app.py)
+# -----------------------------
+# Same answer sources and fallbacks as above; Gemini is called over the shared async HTTP
+# client and the SQLite-backed cache is touched from a worker thread.
+async def get_chat_response_async(user_message):
+    """Async get_chat_response, for the ASGI app."""
+    started = time.perf_counter()
+    cached = await asyncio.to_thread(CHAT_CACHE.lookup, user_message)
+    if cached is not None:
+        _record_chat("cache", started)
+        return cached
+
+    hits = KNOWLEDGE_BASE.search(user_message, k=CHAT_KB_TOP_K)
+    answer = direct_answer(hits)
+    if answer is not None:
+        _record_chat("knowledge_base", started)
+        return answer
+
     try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
+        api_key, prompt = os.environ.get("GEMINI_API_KEY") or GEMINI_API_KEY, build_prompt(user_message, hits)
+        with llm_call("gemini", "chat"):
+            answer = await GEMINI_POLICY.call_async(
+                lambda timeout: gemini_generate_async(api_key, prompt, timeout),
+                timeout=CHAT_GEMINI_TIMEOUT_SECONDS,
+            )
+            answer = answer.strip()
+        await asyncio.to_thread(CHAT_CACHE.store, user_message, answer)
+        _record_chat("llm", started)
+        return answer
     except Exception as e:
+        print(f"Gemini chat request failed: {e}")
+        _record_chat("fallback", started)
+        answer = fallback_answer(hits)
+        if answer is not None:
+            return answer
         return f"⚠️ Gemini was unable to generate a response at this time. Please try again later. Error: {str(e)}"
+
+
+async def stream_chat_response_async(user_message):
+    """
+    Async stream_chat_response, for the ASGI app.
+
+    Yields:
+        str: Successive text fragments of the answer.
+    """
+    started = time.perf_counter()
+    cached = await asyncio.to_thread(CHAT_CACHE.lookup, user_message)
+    if cached is not None:
+        _record_chat("cache", started)
+        yield cached
+        return
+
+    hits = KNOWLEDGE_BASE.search(user_message, k=CHAT_KB_TOP_K)
+    answer = direct_answer(hits)
+    if answer is not None:
+        _record_chat("knowledge_base", started)
+        yield answer
+        return
+
+    parts = []
+    try:
+        with llm_call("gemini", "chat_stream"), GEMINI_POLICY.guard():
+            stream = gemini_stream_async(
+                os.environ.get("GEMINI_API_KEY") or GEMINI_API_KEY,
+                build_prompt(user_message, hits),
+                CHAT_GEMINI_TIMEOUT_SECONDS,
+            )
+            async for text in stream:
+                parts.append(text)
+                yield text
+    except Exception as e:
+        _record_chat("fallback", started)
+        answer = None if parts else fallback_answer(hits)
+        if answer is None:
+            raise
+        print(f"Gemini chat stream failed: {e}")
+        yield answer
+        return
+    _record_chat("llm", started)
+    answer = "".join(parts).strip()
+    if answer:
+        await asyncio.to_thread(CHAT_CACHE.store, user_message, answer)
@@ -0,0 +1,271 @@
+# clients.py - Lazily created, process-wide clients for external services
+#
+# The SDKs (inference_sdk, groq, google.generativeai) take seconds to import, so they are
+# imported and their clients built on first use instead of when the app starts. Each
+# client is then shared by every request thread.
+import json
+import os
+import threading
+from typing import TYPE_CHECKING
+
+from config import ROBOFLOW, GROQ_API_KEY, GEMINI_API_KEY
+from config import ROBOFLOW_API_URL, ROBOFLOW_API_VERSION, GROQ_BASE_URL, GEMINI_API_ENDPOINT
+from config import ASYNC_MAX_CONNECTIONS
+
+if TYPE_CHECKING:
+    import httpx
+    from groq import AsyncGroq, Groq
+
+GEMINI_MODEL_NAME = "gemini-2.0-flash"
+GEMINI_DEFAULT_ENDPOINT = "https://generativelanguage.googleapis.com"
+
+_lock = threading.Lock()
+_roboflow = None
+_groq_clients = {}    # api key -> Groq
+_gemini_models = {}   # (api key, model name) -> GenerativeModel
+
+
+def get_roboflow_client():
+    """
+    Returns the shared Roboflow InferenceHTTPClient, building it on first use.
+
+    Raises:
+        ValueError: If the ROBOFLOW API key isn't configured.
+    """
+    global _roboflow
+    if _roboflow is not None:
+        return _roboflow
+    with _lock:
+        if _roboflow is None:
+            if not ROBOFLOW:
+                raise ValueError("ROBOFLOW API key is not configured.")
+            from inference_sdk import InferenceHTTPClient
+            client = InferenceHTTPClient(api_url=ROBOFLOW_API_URL, api_key=ROBOFLOW)
+            # The SDK picks the protocol from the URL; pin it so proxies and stand-ins work too
+            _roboflow = client.select_api_v1() if ROBOFLOW_API_VERSION == "v1" else client.select_api_v0()
+            print("Roboflow client initialized successfully.")
+        return _roboflow
+
+
+def get_groq_client(api_key: str) -> "Groq":
+    """Returns one reusable (thread-safe) Groq client per API key, so connections are pooled."""
+    client = _groq_clients.get(api_key)
+    if client is not None:
+        return client
+    with _lock:
+        client = _groq_clients.get(api_key)
+        if client is None:
+            from groq import Groq
+            # Retries are handled by resilience.GROQ_POLICY, within its budget
+            client = _groq_clients[api_key] = Groq(api_key=api_key, base_url=GROQ_BASE_URL or None, max_retries=0)
+        return client
+
+
+def get_gemini_model(api_key, model_name=GEMINI_MODEL_NAME):
+    """
+    Returns one shared GenerativeModel per API key and model name, configuring the SDK
+    on first use.
+
+    Raises:
+        ValueError: If api_key is empty.
+    """
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY is required.")
+    key = (api_key, model_name)
+    model = _gemini_models.get(key)
+    if model is not None:
+        return model
+    with _lock:
+        model = _gemini_models.get(key)
+        if model is None:
+            import google.generativeai as genai
+            if GEMINI_API_ENDPOINT:
+                genai.configure(api_key=api_key, transport="rest",
+                                client_options={"api_endpoint": GEMINI_API_ENDPOINT})
+            else:
+                genai.configure(api_key=api_key)
+            model = _gemini_models[key] = genai.GenerativeModel(model_name)
+        return model
+
+
+# --- Sync HTTP ---
+# Shared httpx.Client for REST calls that need a real request timeout (the Roboflow SDK
+# has none). httpx.Client is thread-safe, so every request thread uses the same pool.
+_http = None
+
+
+def get_http() -> "httpx.Client":
+    """Returns the shared sync HTTP client, creating it on first use."""
+    global _http
+    if _http is None:
+        with _lock:
+            if _http is None:
+                import httpx
+                _http = httpx.Client(timeout=None)  # Every request passes its own deadline
+    return _http
+
+
+def _roboflow_request(img_b64, model_id):
+    if not ROBOFLOW:
+        raise ValueError("ROBOFLOW API key is not configured.")
+    return {
+        "url": f"{ROBOFLOW_API_URL.rstrip('/')}/{model_id}",
+        "params": {"api_key": ROBOFLOW},
+        "content": img_b64,
+        "headers": {"Content-Type": "application/x-www-form-urlencoded"},
+    }
+
+
+def roboflow_infer(img_b64, model_id, timeout):
+    """
+    Calls the hosted Roboflow detect API (v0) with a base64 image and returns the parsed
+    response, giving up after `timeout` seconds (unlike the SDK).
+
+    Raises:
+        ValueError: If the ROBOFLOW API key isn't configured.
+        httpx.HTTPStatusError: On an error response.
+    """
+    response = get_http().post(**_roboflow_request(img_b64, model_id), timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+# --- Async Clients (asgi_app.py) ---
+# One httpx.AsyncClient carries every upstream call of the async app, so connections are
+# pooled across Roboflow, Groq and Gemini. These are only used from the event loop thread.
+_async_http = None
+_async_groq_clients = {}  # api key -> AsyncGroq
+
+
+def get_async_http() -> "httpx.AsyncClient":
+    """Returns the shared async HTTP client, creating it on first use."""
+    global _async_http
+    if _async_http is None:
+        import httpx
+        _async_http = httpx.AsyncClient(
+            limits=httpx.Limits(max_connections=ASYNC_MAX_CONNECTIONS,
+                                max_keepalive_connections=ASYNC_MAX_CONNECTIONS),
+            timeout=None,  # Every request passes its own deadline
+        )
+    return _async_http
+
+
+def get_async_groq_client(api_key: str) -> "AsyncGroq":
+    """Returns one AsyncGroq client per API key, sharing the async HTTP client's connection pool."""
+    client = _async_groq_clients.get(api_key)
+    if client is None:
+        from groq import AsyncGroq
+        client = _async_groq_clients[api_key] = AsyncGroq(
+            api_key=api_key, base_url=GROQ_BASE_URL or None, max_retries=0, http_client=get_async_http()
+        )
+    return client
+
+
+async def close_async_clients():
+    """Closes the shared async HTTP client (call when the event loop shuts down)."""
+    global _async_http
+    if _async_http is not None:
+        await _async_http.aclose()
+    _async_http = None
+    _async_groq_clients.clear()
+
+
+async def roboflow_infer_async(img_b64, model_id, timeout):
+    """
+    Calls the hosted Roboflow detect API (v0) with a base64 image and returns the parsed response.
+
+    Raises:
+        ValueError: If the ROBOFLOW API key isn't configured.
+        httpx.HTTPStatusError: On an error response.
+    """
+    response = await get_async_http().post(**_roboflow_request(img_b64, model_id), timeout=timeout)
+    response.raise_for_status()
+    return response.json()
+
+
+def _gemini_request(api_key, model_name, method, prompt):
+    if not api_key:
+        raise ValueError("GEMINI_API_KEY is required.")
+    url = f"{(GEMINI_API_ENDPOINT or GEMINI_DEFAULT_ENDPOINT).rstrip('/')}/v1beta/models/{model_name}:{method}"
+    return url, {"contents": [{"role": "user", "parts": [{"text": prompt}]}]}
+
+
+def _gemini_text(payload):
+    """Joins the text parts of the first candidate, like GenerateContentResponse.text."""
+    candidates = payload.get("candidates") or []
+    if not candidates:
+        raise ValueError(f"Gemini returned no candidates: {payload.get('promptFeedback')}")
+    parts = (candidates[0].get("content") or {}).get("parts") or []
+    return "".join(part.get("text", "") for part in parts)
+
+
+async def gemini_generate_async(api_key, prompt, timeout, model_name=GEMINI_MODEL_NAME):
+    """
+    Gemini generateContent over the shared async HTTP client; returns the response text.
+    (The SDK's async methods need the gRPC transport, so the REST API is called directly.)
+    """
+    url, body = _gemini_request(api_key, model_name, "generateContent", prompt)
+    response = await get_async_http().post(url, params={"key": api_key}, json=body, timeout=timeout)
+    response.raise_for_status()
+    return _gemini_text(response.json())
+
+
+async def gemini_stream_async(api_key, prompt, timeout, model_name=GEMINI_MODEL_NAME):
+    """Gemini streamGenerateContent (as Server-Sent Events); yields text fragments as they arrive."""
+    url, body = _gemini_request(api_key, model_name, "streamGenerateContent", prompt)
+    async with get_async_http().stream(
+        "POST", url, params={"key": api_key, "alt": "sse"}, json=body, timeout=timeout
+    ) as response:
+        response.raise_for_status()
+        async for line in response.aiter_lines():
+            if line.startswith("data:"):
+                text = _gemini_text(json.loads(line[5:]))
+                if text:
+                    yield text
+
+
+# --- Readiness ---
+def _configured_keys():
+    return {
+        "roboflow": ROBOFLOW,
+        "groq": os.environ.get("GROQ_API_KEY") or GROQ_API_KEY,
+        "gemini": os.environ.get("GEMINI_API_KEY") or GEMINI_API_KEY,
+    }
+
+
+def client_status():
+    """Returns {service: "ready" | "cold" | "not_configured"} without building anything."""
+    keys = _configured_keys()
+    built = {
+        "roboflow": _roboflow is not None,
+        "groq": keys["groq"] in _groq_clients,
+        "gemini": (keys["gemini"], GEMINI_MODEL_NAME) in _gemini_models,
+    }
+    return {
+        service: ("ready" if built[service] else "cold") if keys[service] else "not_configured"
+        for service in keys
+    }
+
+
+def warm_up():
+    """
+    Imports the SDKs and builds every configured client now, so the first real request
+    doesn't pay for it. Returns client_status(), with "error: ..." for clients that failed.
+    """
+    keys = _configured_keys()
+    builders = {
+        "roboflow": get_roboflow_client,
+        "groq": lambda: get_groq_client(keys["groq"]),
+        "gemini": lambda: get_gemini_model(keys["gemini"]),
+    }
+    status = {}
+    for service, build in builders.items():
+        if not keys[service]:
+            status[service] = "not_configured"
+            continue
+        try:
+            build()
+            status[service] = "ready"
+        except Exception as e:
+            status[service] = f"error: {e}"
+    return status
@@ -1 +1,170 @@
+# config.py - API keys and tunable settings
+# Values are read from the environment so secrets never need to be committed.
+import os
 
+# --- API Keys ---
+ROBOFLOW = os.environ.get("ROBOFLOW", "")
+GROQ_API_KEY = os.environ.get("GROQ_API_KEY", "")
+GEMINI_API_KEY = os.environ.get("GEMINI_API_KEY", "")
+
+# --- Service Endpoints ---
+# Override to point at a proxy or at the local stand-ins in benchmarks/stand_ins.py.
+# Roboflow's hosted detect API speaks protocol "v0"; self-hosted inference servers speak "v1".
+ROBOFLOW_API_URL = os.environ.get("ROBOFLOW_API_URL", "https://detect.roboflow.com")
+ROBOFLOW_API_VERSION = os.environ.get("ROBOFLOW_API_VERSION", "v0")
+# Empty means the SDK default. A custom Gemini endpoint is called over REST instead of gRPC.
+GROQ_BASE_URL = os.environ.get("GROQ_BASE_URL", "")
+GEMINI_API_ENDPOINT = os.environ.get("GEMINI_API_ENDPOINT", "")
+
+# --- Scan Inference Cache ---
+# In-memory LRU tier size and persistent (SQLite) tier size, in entries.
+SCAN_CACHE_MEMORY_ENTRIES = int(os.environ.get("SCAN_CACHE_MEMORY_ENTRIES", 256))
+SCAN_CACHE_DB_ENTRIES = int(os.environ.get("SCAN_CACHE_DB_ENTRIES", 5000))
+# Seconds before a cached inference result is considered stale (0 disables expiry).
+SCAN_CACHE_TTL_SECONDS = int(os.environ.get("SCAN_CACHE_TTL_SECONDS", 7 * 24 * 3600))
+
+# --- Batch Scan Processing ---
+# Concurrent inference calls per batch request, and the largest batch accepted.
+SCAN_BATCH_WORKERS = int(os.environ.get("SCAN_BATCH_WORKERS", 4))
+SCAN_BATCH_MAX_ITEMS = int(os.environ.get("SCAN_BATCH_MAX_ITEMS", 50))
+
+# --- Scan Job Queue ---
+# Worker threads running queued scans, maximum unfinished jobs, and the longest
+# a GET /api/scans/jobs/<id>?wait=N long-poll may block.
+SCAN_JOB_WORKERS = int(os.environ.get("SCAN_JOB_WORKERS", 2))
+SCAN_JOB_MAX_DEPTH = int(os.environ.get("SCAN_JOB_MAX_DEPTH", 100))
+SCAN_JOB_MAX_WAIT_SECONDS = float(os.environ.get("SCAN_JOB_MAX_WAIT_SECONDS", 30))
+# How often a process refreshes the heartbeat of the jobs it runs, how old a heartbeat may
+# get before another process takes the job over, and how long finished jobs are kept.
+SCAN_JOB_HEARTBEAT_SECONDS = float(os.environ.get("SCAN_JOB_HEARTBEAT_SECONDS", 10))
+SCAN_JOB_STALE_SECONDS = float(os.environ.get("SCAN_JOB_STALE_SECONDS", 60))
+SCAN_JOB_RESULT_TTL_SECONDS = int(os.environ.get("SCAN_JOB_RESULT_TTL_SECONDS", 24 * 3600))
+
+# --- Binary Scan Uploads ---
+# Largest accepted upload, and the size above which uploads are spooled to disk.
+SCAN_UPLOAD_MAX_BYTES = int(os.environ.get("SCAN_UPLOAD_MAX_BYTES", 25 * 1024 * 1024))
+SCAN_UPLOAD_SPOOL_BYTES = int(os.environ.get("SCAN_UPLOAD_SPOOL_BYTES", 1024 * 1024))
+
+# --- Scan Preprocessing ---
+# Images are oriented, converted and downscaled to the model input size before upload.
+SCAN_PREPROCESS_ENABLED = os.environ.get("SCAN_PREPROCESS_ENABLED", "1") == "1"
+SCAN_PREPROCESS_MAX_SIDE = int(os.environ.get("SCAN_PREPROCESS_MAX_SIDE", 640))
+SCAN_PREPROCESS_GRAYSCALE = os.environ.get("SCAN_PREPROCESS_GRAYSCALE", "1") == "1"
+SCAN_PREPROCESS_AUTOCONTRAST = os.environ.get("SCAN_PREPROCESS_AUTOCONTRAST", "0") == "1"
+SCAN_PREPROCESS_FORMAT = os.environ.get("SCAN_PREPROCESS_FORMAT", "jpeg")  # "jpeg" or "png"
+SCAN_PREPROCESS_QUALITY = int(os.environ.get("SCAN_PREPROCESS_QUALITY", 90))
+
+# --- Database ---
+# Per-connection page cache, durability level under WAL, and lock wait time.
+DB_CACHE_SIZE_KIB = int(os.environ.get("DB_CACHE_SIZE_KIB", 16 * 1024))
+DB_SYNCHRONOUS = os.environ.get("DB_SYNCHRONOUS", "NORMAL")  # OFF, NORMAL, FULL or EXTRA
+DB_BUSY_TIMEOUT_MS = int(os.environ.get("DB_BUSY_TIMEOUT_MS", 5000))
+# Predictions are always stored in the predictions table; this keeps the full model response
+# as well (zlib-compressed, for re-processing and audits). Set to false to drop it for new
+# scans; results already stored, including those migrated from result_json, are kept.
+SCAN_STORE_RAW_RESULTS = os.environ.get("SCAN_STORE_RAW_RESULTS", "true").lower() in ("1", "true", "yes")
+
+# --- Scan History API ---
+SCAN_HISTORY_PAGE_SIZE = int(os.environ.get("SCAN_HISTORY_PAGE_SIZE", 50))
+SCAN_HISTORY_MAX_PAGE_SIZE = int(os.environ.get("SCAN_HISTORY_MAX_PAGE_SIZE", 500))
+
+# --- Risk Assessment ---
+# Maximum concurrent LLM calls when mapping quiz answers to options.
+QUIZ_MAPPING_CONCURRENCY = int(os.environ.get("QUIZ_MAPPING_CONCURRENCY", 8))
+# Answers the local matcher resolves with at least this confidence (0-1) skip the LLM.
+QUIZ_LOCAL_MATCH_THRESHOLD = float(os.environ.get("QUIZ_LOCAL_MATCH_THRESHOLD", 0.85))
+# When Groq is unavailable, local matches below this confidence are scored "N/A" (0 points)
+# rather than guessed.
+QUIZ_FALLBACK_MIN_CONFIDENCE = float(os.environ.get("QUIZ_FALLBACK_MIN_CONFIDENCE", 0.6))
+
+# --- Risk Assessment Sessions ---
+# Threads that map session answers and run the speculative final summary, and how long
+# an idle session is kept (in memory and in the risk_sessions table).
+RISK_SESSION_WORKERS = int(os.environ.get("RISK_SESSION_WORKERS", 4))
+RISK_SESSION_TTL_SECONDS = int(os.environ.get("RISK_SESSION_TTL_SECONDS", 24 * 3600))
+
+# --- Chat Response Cache ---
+# Entry limit, lifetime, the TF-IDF cosine similarity (0-1) a paraphrase needs to reuse
+# a cached answer, and the SQLite file it persists to (empty keeps it in memory only).
+CHAT_CACHE_ENTRIES = int(os.environ.get("CHAT_CACHE_ENTRIES", 1000))
+CHAT_CACHE_TTL_SECONDS = int(os.environ.get("CHAT_CACHE_TTL_SECONDS", 24 * 3600))
+CHAT_CACHE_SIMILARITY = float(os.environ.get("CHAT_CACHE_SIMILARITY", 0.8))
+CHAT_CACHE_DB_PATH = os.environ.get("CHAT_CACHE_DB_PATH", "scans.db")
+
+# --- Chat Knowledge Base ---
+# breast_cancer.txt is indexed with BM25 at startup. The top passages are added to chat
+# prompts; a question is answered directly (without Gemini) when the best passage's heading
+# matches it, it covers at least the given share of the question's terms and it outscores
+# the runner-up by the given factor.
+KNOWLEDGE_BASE_PATH = os.environ.get("KNOWLEDGE_BASE_PATH", "breast_cancer.txt")
+CHAT_KB_TOP_K = int(os.environ.get("CHAT_KB_TOP_K", 3))
+CHAT_KB_DIRECT_MIN_COVERAGE = float(os.environ.get("CHAT_KB_DIRECT_MIN_COVERAGE", 0.8))
+CHAT_KB_DIRECT_MIN_MARGIN = float(os.environ.get("CHAT_KB_DIRECT_MIN_MARGIN", 1.5))
+# Seconds to wait for Gemini before answering from the knowledge base instead
+CHAT_GEMINI_TIMEOUT_SECONDS = float(os.environ.get("CHAT_GEMINI_TIMEOUT_SECONDS", 20))
+
+# --- Inference Backend ---
+# Which model runs scan detection: "roboflow" (hosted API), "onnx" (local CPU model via
+# onnxruntime) or "stub" (deterministic fake results for tests and load tests).
+INFERENCE_BACKEND = os.environ.get("INFERENCE_BACKEND", "roboflow").lower()
+ROBOFLOW_MODEL_ID = os.environ.get("ROBOFLOW_MODEL_ID", "early-detection-xvxmf/1")
+# ONNX export of the detection model, its class names (comma-separated, in class-id order),
+# input size, confidence/IoU thresholds, micro-batch size and how long (ms) a batch waits
+# to fill, and onnxruntime intra-op threads (0 lets onnxruntime decide).
+ONNX_MODEL_PATH = os.environ.get("ONNX_MODEL_PATH", "models/early-detection.onnx")
+ONNX_CLASS_NAMES = [name.strip() for name in os.environ.get("ONNX_CLASS_NAMES", "Breast-cancer").split(",") if name.strip()]
+ONNX_INPUT_SIZE = int(os.environ.get("ONNX_INPUT_SIZE", 640))
+ONNX_CONFIDENCE = float(os.environ.get("ONNX_CONFIDENCE", 0.4))
+ONNX_IOU = float(os.environ.get("ONNX_IOU", 0.5))
+ONNX_MAX_BATCH = int(os.environ.get("ONNX_MAX_BATCH", 8))
+ONNX_BATCH_WAIT_MS = float(os.environ.get("ONNX_BATCH_WAIT_MS", 5))
+ONNX_THREADS = int(os.environ.get("ONNX_THREADS", 0))
+
+# --- Observability ---
+# Print one JSON line per scan stage, LLM call and HTTP request, tagged with its request id.
+# Metrics are always collected and served at /metrics.
+STRUCTURED_LOGS = os.environ.get("STRUCTURED_LOGS", "true").lower() in ("1", "true", "yes")
+
+# --- Resilience (external calls) ---
+# Deadline in seconds for one Roboflow / Groq / Gemini call, including retries.
+ROBOFLOW_TIMEOUT_SECONDS = float(os.environ.get("ROBOFLOW_TIMEOUT_SECONDS", 15))
+GROQ_TIMEOUT_SECONDS = float(os.environ.get("GROQ_TIMEOUT_SECONDS", 10))
+GEMINI_TIMEOUT_SECONDS = float(os.environ.get("GEMINI_TIMEOUT_SECONDS", 30))
+# Retryable failures (timeouts, connection errors, 429, 5xx) are retried up to the given
+# number of attempts with jittered exponential backoff, while the per-service budget allows:
+# at most RETRY_BUDGET_RATIO retries per call, plus RETRY_BUDGET_MIN_PER_SECOND.
+RETRY_MAX_ATTEMPTS = int(os.environ.get("RETRY_MAX_ATTEMPTS", 3))
+RETRY_BUDGET_RATIO = float(os.environ.get("RETRY_BUDGET_RATIO", 0.2))
+RETRY_BUDGET_MIN_PER_SECOND = float(os.environ.get("RETRY_BUDGET_MIN_PER_SECOND", 1))
+RETRY_BACKOFF_BASE_MS = float(os.environ.get("RETRY_BACKOFF_BASE_MS", 100))
+RETRY_BACKOFF_MAX_MS = float(os.environ.get("RETRY_BACKOFF_MAX_MS", 2000))
+# Consecutive failures that open a service's circuit, and seconds before it is probed again.
+BREAKER_FAILURE_THRESHOLD = int(os.environ.get("BREAKER_FAILURE_THRESHOLD", 5))
+BREAKER_RESET_SECONDS = float(os.environ.get("BREAKER_RESET_SECONDS", 30))
+# Hedging is off by default: a hedged call sends a second, duplicate request (billed by paid
+# upstreams) when the first is slower than the HEDGE_QUANTILE of recent latencies (never
+# sooner than HEDGE_MIN_DELAY_MS). Turn it on per service with e.g. HEDGE_SERVICES=roboflow,groq.
+HEDGE_SERVICES = {name.strip() for name in os.environ.get("HEDGE_SERVICES", "").split(",") if name.strip()}
+HEDGE_QUANTILE = float(os.environ.get("HEDGE_QUANTILE", 0.95))
+HEDGE_MIN_DELAY_MS = float(os.environ.get("HEDGE_MIN_DELAY_MS", 50))
+# Threads per service that run upstream attempts (so callers can stop waiting at the
+# deadline). Calls to a service whose threads are all held by stalled attempts fail at once.
+RESILIENCE_MAX_THREADS = int(os.environ.get("RESILIENCE_MAX_THREADS", 32))
+
+# --- Async API (asgi_app.py) ---
+# Connections the shared async HTTP client keeps open across all upstreams, how many
+# scans of one batch run inference at the same time, and the worker threads that run
+# SQLite statements and image preprocessing off the event loop.
+ASYNC_MAX_CONNECTIONS = int(os.environ.get("ASYNC_MAX_CONNECTIONS", 200))
+ASYNC_BATCH_CONCURRENCY = int(os.environ.get("ASYNC_BATCH_CONCURRENCY", 16))
+ASYNC_WORKER_THREADS = int(os.environ.get("ASYNC_WORKER_THREADS", 32))
+# Requests in flight to any one upstream; the rest wait (within their deadline) for a slot,
+# so a slow service can't hold every pooled connection.
+ASYNC_MAX_CONCURRENT_PER_SERVICE = int(os.environ.get("ASYNC_MAX_CONCURRENT_PER_SERVICE", 64))
+
+# --- Offline Re-scoring (rescore.py) ---
+# Parallel inference calls, the most items started per second (0 = no limit, keep it under
+# the Roboflow plan's rate limit), and how many finished items are checkpointed per commit.
+RESCORE_WORKERS = int(os.environ.get("RESCORE_WORKERS", 4))
+RESCORE_RATE_PER_SECOND = float(os.environ.get("RESCORE_RATE_PER_SECOND", 0))
+RESCORE_CHECKPOINT_EVERY = int(os.environ.get("RESCORE_CHECKPOINT_EVERY", 50))
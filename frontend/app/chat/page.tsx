@@ -19,20 +19,62 @@ export default function ChatPage() {
     setInput("")
     setIsLoading(true)
 
+    // Append an empty AI message and grow it as tokens stream in
+    setMessages((prev) => [...prev, { sender: "ai", text: "" }])
+    const updateReply = (update: (text: string) => string) =>
+      setMessages((prev) => {
+        const next = [...prev]
+        next[next.length - 1] = { sender: "ai", text: update(next[next.length - 1].text) }
+        return next
+      })
+
     try {
-      const response = await fetch("/api/chat", {
+      const response = await fetch("/api/chat/stream", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
         body: JSON.stringify({ message: userMessage }),
       })
-      const data = await response.json()
-      if (data.response) {
-        setMessages((prev) => [...prev, { sender: "ai", text: data.response }])
-      } else {
-        setMessages((prev) => [...prev, { sender: "ai", text: "Sorry, no response from server." }])
+      if (!response.ok || !response.body) {
+        updateReply(() => "Sorry, no response from server.")
+        return
+      }
+
+      const reader = response.body.getReader()
+      const decoder = new TextDecoder()
+      let buffer = ""
+      let received = false
+      while (true) {
+        const { done, value } = await reader.read()
+        if (done) break
+        buffer += decoder.decode(value, { stream: true })
+        // Server-Sent Events are separated by a blank line
+        let boundary
+        while ((boundary = buffer.indexOf("\n\n")) !== -1) {
+          const rawEvent = buffer.slice(0, boundary)
+          buffer = buffer.slice(boundary + 2)
+          let event = "message"
+          let data = ""
+          for (const line of rawEvent.split("\n")) {
+            if (line.startsWith("event: ")) event = line.slice(7)
+            else if (line.startsWith("data: ")) data += line.slice(6)
+          }
+          if (!data) continue
+          const payload = JSON.parse(data)
+          if (event === "error") {
+            updateReply((text) => (text ? `${text}\n\n` : "") + payload.error)
+            received = true
+          } else if (event === "done") {
+            updateReply(() => payload.response)
+            received = true
+          } else if (payload.delta) {
+            updateReply((text) => text + payload.delta)
+            received = true
+          }
+        }
       }
+      if (!received) updateReply(() => "Sorry, no response from server.")
     } catch (error) {
-      setMessages((prev) => [...prev, { sender: "ai", text: "Error communicating with server." }])
+      updateReply(() => "Error communicating with server.")
     } finally {
       setIsLoading(false)
     }
@@ -86,7 +128,7 @@ export default function ChatPage() {
                     msg.sender === "user" ? "bg-pink-100 text-pink-900 self-end" : "bg-pink-200 text-pink-800"
                   }`}
                 >
-                  <p>{msg.text}</p>
+                  <p className="whitespace-pre-line">{msg.text || "…"}</p>
                 </div>
               ))}
             </div>
@@ -2,7 +2,7 @@
 "use client"
 
 import Link from "next/link"
-import { useState } from "react"
+import { useEffect, useRef, useState } from "react"
 import { Button } from "@/components/ui/button"
 import { ArrowLeft } from "lucide-react"
 import { Card, CardContent, CardDescription, CardHeader, CardTitle } from "@/components/ui/card"
@@ -85,11 +85,45 @@ export default function RiskAssessmentPage() {
   const [loading, setLoading] = useState(false)
   const [error, setError] = useState<string | null>(null)
   const [result, setResult] = useState<any>(null)
+  const [sessionId, setSessionId] = useState<string | null>(null)
+  const [progress, setProgress] = useState<{ answered: number; total_questions: number } | null>(null)
+  // Last answer sent to the session for each question, so unchanged answers aren't re-sent
+  const sentAnswers = useRef<Record<number, string>>({})
+
+  // Start a scoring session so each answer is scored as soon as it's entered.
+  // Without one (e.g. the request fails) the quiz still works: everything is scored on submit.
+  useEffect(() => {
+    fetch("/api/risk-sessions", { method: "POST", headers: { "Content-Type": "application/json" }, body: "{}" })
+      .then((response) => (response.ok ? response.json() : null))
+      .then((data) => {
+        if (data?.session_id) {
+          setSessionId(data.session_id)
+          setProgress(data)
+        }
+      })
+      .catch(() => setSessionId(null))
+  }, [])
 
   const handleInputChange = (questionId: number, value: string) => {
     setAnswers((prev) => ({ ...prev, [questionId]: value }))
   }
 
+  const handleAnswerDone = async (questionId: number) => {
+    const answer = answers[questionId] || ""
+    if (!sessionId || !answer || sentAnswers.current[questionId] === answer) return
+    sentAnswers.current[questionId] = answer
+    try {
+      const response = await fetch(`/api/risk-sessions/${sessionId}/answers`, {
+        method: "POST",
+        headers: { "Content-Type": "application/json" },
+        body: JSON.stringify({ question_id: questionId, answer }),
+      })
+      if (response.ok) setProgress(await response.json())
+    } catch {
+      delete sentAnswers.current[questionId] // Retried on the next blur, or scored on submit
+    }
+  }
+
   const handleSubmit = async (e: React.FormEvent) => {
     e.preventDefault()
     setLoading(true)
@@ -107,7 +141,7 @@ export default function RiskAssessmentPage() {
       const response = await fetch("/api/risk-assessment", {
         method: "POST",
         headers: { "Content-Type": "application/json" },
-        body: JSON.stringify({ conversation }),
+        body: JSON.stringify(sessionId ? { conversation, session_id: sessionId } : { conversation }),
       })
 
       if (!response.ok) {
@@ -168,11 +202,18 @@ export default function RiskAssessmentPage() {
                     className="w-full mt-1 px-3 py-2 border border-pink-200 rounded-md focus:outline-none focus:ring-2 focus:ring-pink-500"
                     value={answers[q.id] || ""}
                     onChange={(e) => handleInputChange(q.id, e.target.value)}
+                    onBlur={() => handleAnswerDone(q.id)}
                   />
                 </CardContent>
               </Card>
             ))}
 
+            {progress && progress.answered > 0 && (
+              <p className="text-sm text-pink-700">
+                {progress.answered} of {progress.total_questions} answers saved
+              </p>
+            )}
+
             <Button type="submit" className="w-full bg-pink-600 hover:bg-pink-700" disabled={loading}>
               {loading ? "Submitting..." : "Submit Answers"}
             </Button>
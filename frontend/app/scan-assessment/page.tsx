@@ -128,11 +128,11 @@ export default function ScanAssessmentPage() {
     const file = event.target.files?.[0] ?? null;
     if (file) {
       setSelectedFile(file);
-      const reader = new FileReader();
-      reader.onloadend = () => {
-        setPreviewUrl(reader.result as string);
-      };
-      reader.readAsDataURL(file);
+      // Object URLs reference the file directly instead of copying it into a data URL
+      setPreviewUrl((prev) => {
+        if (prev) URL.revokeObjectURL(prev);
+        return URL.createObjectURL(file);
+      });
       // Reset results when a new file is selected
       setResult(null);
       setError(null);
@@ -178,32 +178,16 @@ export default function ScanAssessmentPage() {
     setResult(null);
 
     try {
-      // 4. Convert file to base64
-      const base64 = await new Promise<string>((resolve, reject) => {
-        const reader = new FileReader();
-        reader.readAsDataURL(selectedFile);
-        // Ensure result is string and split correctly
-        reader.onload = () => {
-            const resultString = reader.result as string;
-            if (resultString && resultString.includes(',')) {
-                resolve(resultString.split(",")[1]);
-            } else {
-                reject(new Error("Failed to read file correctly."));
-            }
-        };
-        reader.onerror = (error) => reject(error);
-      });
+      // 4. Build a multipart body: the file is streamed as-is, no base64 conversion
+      const formData = new FormData();
+      formData.append("image", selectedFile);
+      Object.entries(generalInfo).forEach(([key, value]) => formData.append(key, value));
 
       // 5. Call backend API with both image and general info
-      const response = await fetch("/api/check_scan", {
+      // (the browser sets the multipart Content-Type and boundary itself)
+      const response = await fetch("/api/check_scan_upload", {
         method: "POST",
-        headers: {
-          "Content-Type": "application/json",
-        },
-        body: JSON.stringify({
-          image: base64, // The base64 image data
-          ...generalInfo, // Spread the collected general info
-        }),
+        body: formData,
       });
 
       // 6. Process the response
@@ -0,0 +1,423 @@
+# inference_backends.py - Pluggable scan inference: Roboflow API, in-process ONNX model, stub
+#
+# Every backend returns results in the Roboflow detection format the rest of the app
+# already stores and renders:
+#   {"predictions": [{"x", "y", "width", "height", "confidence", "class", "class_id"}, ...],
+#    "image": {"width", "height"}}
+# with box centres and sizes in original image pixels.
+import asyncio
+import base64
+import hashlib
+import os
+import queue
+import threading
+import time
+from concurrent.futures import Future
+
+from config import (
+    INFERENCE_BACKEND,
+    ROBOFLOW_MODEL_ID,
+    ROBOFLOW_API_VERSION,
+    SCAN_PREPROCESS_ENABLED,
+    ONNX_MODEL_PATH,
+    ONNX_CLASS_NAMES,
+    ONNX_INPUT_SIZE,
+    ONNX_CONFIDENCE,
+    ONNX_IOU,
+    ONNX_MAX_BATCH,
+    ONNX_BATCH_WAIT_MS,
+    ONNX_THREADS,
+)
+from clients import get_roboflow_client, roboflow_infer, roboflow_infer_async
+from preprocess import open_image, preprocess_image, preprocess_signature, map_to_original
+from resilience import ROBOFLOW_POLICY
+from uploads import read_image_header
+
+
+class InferenceBackend:
+    """
+    Base class for inference backends.
+
+    Subclasses implement infer(); load() does any one-off setup (model loading, client
+    creation, warm-up) and is called once before the backend is shared.
+    """
+
+    name = "base"
+
+    def load(self):
+        """Prepares the backend for use. Raises if it can't be used at all."""
+
+    def cache_namespace(self):
+        """
+        Identifies the model and settings that produce this backend's results. It is part
+        of the inference cache key, so results are never reused across models.
+        """
+        raise NotImplementedError
+
+    def infer(self, img_bytes, img_b64=None):
+        """
+        Runs detection on one encoded image.
+
+        Args:
+            img_bytes (bytes): The encoded image.
+            img_b64 (str, optional): Base64 form of the same image, if the caller already has it.
+
+        Returns:
+            dict: Result in Roboflow detection format.
+
+        Raises:
+            ValueError: If the image cannot be decoded.
+        """
+        raise NotImplementedError
+
+    async def infer_async(self, img_bytes, img_b64=None):
+        """
+        Coroutine version of infer() for the async app. By default infer() runs on a worker
+        thread (right for CPU-bound backends); remote backends override it with async I/O.
+        """
+        return await asyncio.to_thread(self.infer, img_bytes, img_b64)
+
+
+# --- Roboflow (remote) ---
+class RoboflowBackend(InferenceBackend):
+    """The hosted Roboflow model. Images are preprocessed (see preprocess.py) before upload."""
+
+    name = "roboflow"
+
+    def __init__(self, model_id=ROBOFLOW_MODEL_ID, preprocess=SCAN_PREPROCESS_ENABLED):
+        self.model_id = model_id
+        self.preprocess = preprocess
+
+    def load(self):
+        get_roboflow_client()
+
+    def cache_namespace(self):
+        if self.preprocess:
+            return f"{self.model_id}|{preprocess_signature()}"
+        return self.model_id
+
+    def _call(self, payload):
+        if ROBOFLOW_API_VERSION == "v1":
+            # The SDK has no request timeout; the policy stops waiting at the deadline instead
+            client = get_roboflow_client()
+            return ROBOFLOW_POLICY.call(lambda timeout: client.infer(payload, model_id=self.model_id))
+        # v0 over plain HTTP, so a stalled request ends at the deadline and frees its thread
+        return ROBOFLOW_POLICY.call(lambda timeout: roboflow_infer(payload, self.model_id, timeout))
+
+    def infer(self, img_bytes, img_b64=None):
+        if not self.preprocess:
+            return self._call(img_b64 or base64.b64encode(img_bytes).decode("ascii"))
+        # Downscale before upload, then map the boxes back to original image coordinates
+        prep = preprocess_image(img_bytes)
+        result = self._call(base64.b64encode(prep.data).decode("ascii"))
+        return map_to_original(result, prep)
+
+    async def infer_async(self, img_bytes, img_b64=None):
+        if ROBOFLOW_API_VERSION == "v1":
+            return await super().infer_async(img_bytes, img_b64)  # Only the v0 API has an async path
+        prep = None
+        if self.preprocess:
+            prep = await asyncio.to_thread(preprocess_image, img_bytes)
+            payload = base64.b64encode(prep.data).decode("ascii")
+        else:
+            payload = img_b64 or base64.b64encode(img_bytes).decode("ascii")
+        result = await ROBOFLOW_POLICY.call_async(
+            lambda timeout: roboflow_infer_async(payload, self.model_id, timeout)
+        )
+        return map_to_original(result, prep) if prep is not None else result
+
+
+# --- ONNX (in-process CPU) ---
+class _MicroBatcher:
+    """
+    Collects concurrent requests into batches for one model call.
+
+    A single thread takes the first waiting item, then keeps collecting for up to
+    `max_wait` seconds or until `max_batch` items are queued, and runs them together.
+    Under light load a request waits at most `max_wait`; under heavy load batches fill
+    immediately.
+    """
+
+    def __init__(self, run_batch, max_batch, max_wait, name="micro-batcher"):
+        self.run_batch = run_batch  # list of items -> list of results, same order
+        self.max_batch = max(1, max_batch)
+        self.max_wait = max_wait
+        self._queue = queue.Queue()
+        self._thread = threading.Thread(target=self._loop, name=name, daemon=True)
+        self._thread.start()
+
+    def submit(self, item):
+        """Queues one item and blocks until its result is ready (re-raising batch errors)."""
+        return self.submit_nowait(item).result()
+
+    def submit_nowait(self, item):
+        """Queues one item and returns the Future for its result."""
+        future = Future()
+        self._queue.put((item, future))
+        return future
+
+    def _loop(self):
+        while True:
+            batch = [self._queue.get()]
+            deadline = time.monotonic() + self.max_wait
+            while len(batch) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                try:
+                    batch.append(self._queue.get(timeout=remaining) if remaining > 0 else self._queue.get_nowait())
+                except queue.Empty:
+                    break
+            try:
+                results = self.run_batch([item for item, _ in batch])
+            except Exception as e:
+                for _, future in batch:
+                    future.set_exception(e)
+            else:
+                for (_, future), result in zip(batch, results):
+                    future.set_result(result)
+
+
+class OnnxBackend(InferenceBackend):
+    """
+    A YOLO-style detection model exported to ONNX, run in-process on the CPU with onnxruntime.
+
+    The session is created and warmed up once in load(). Images are decoded and letterboxed
+    on the calling thread; the model call itself is micro-batched across concurrent
+    requests when the exported model has a dynamic batch dimension. Both YOLOv8-style
+    outputs (4 + classes rows) and YOLOv5-style outputs (5 + classes columns, with an
+    objectness score) are supported.
+    """
+
+    name = "onnx"
+
+    def __init__(self, model_path=ONNX_MODEL_PATH, class_names=ONNX_CLASS_NAMES, input_size=ONNX_INPUT_SIZE,
+                 confidence=ONNX_CONFIDENCE, iou=ONNX_IOU, max_batch=ONNX_MAX_BATCH,
+                 batch_wait_ms=ONNX_BATCH_WAIT_MS, threads=ONNX_THREADS):
+        self.model_path = model_path
+        self.class_names = list(class_names)
+        self.input_size = input_size
+        self.confidence = confidence
+        self.iou = iou
+        self.max_batch = max_batch
+        self.batch_wait_ms = batch_wait_ms
+        self.threads = threads
+        self._session = None
+        self._input_name = None
+        self._batcher = None
+        self._load_lock = threading.Lock()
+
+    def load(self):
+        if self._batcher is not None:
+            return
+        with self._load_lock:
+            if self._batcher is None:
+                self._load()
+
+    def _load(self):
+        if not self.model_path or not os.path.exists(self.model_path):
+            raise ValueError(f"ONNX model not found: {self.model_path!r} (set ONNX_MODEL_PATH).")
+        import numpy as np
+        import onnxruntime as ort
+
+        options = ort.SessionOptions()
+        if self.threads:
+            options.intra_op_num_threads = self.threads
+        session = ort.InferenceSession(self.model_path, sess_options=options, providers=["CPUExecutionProvider"])
+        model_input = session.get_inputs()[0]
+        batch_dim, _, height, width = model_input.shape
+        if isinstance(height, int) and isinstance(width, int):
+            self.input_size = height  # The export fixes the input size; letterbox to match
+        if isinstance(batch_dim, int) and batch_dim == 1:
+            self.max_batch = 1  # Static batch of one: run requests individually
+        self._session = session
+        self._input_name = model_input.name
+        self._np = np
+
+        # Warm-up: the first run allocates buffers and picks kernels
+        start = time.perf_counter()
+        session.run(None, {self._input_name: np.zeros((1, 3, self.input_size, self.input_size), np.float32)})
+        print(f"ONNX model {self.model_path} loaded and warmed up in {(time.perf_counter() - start) * 1000:.0f} ms "
+              f"(batch up to {self.max_batch})")
+        self._batcher = _MicroBatcher(
+            self._run_batch, self.max_batch, self.batch_wait_ms / 1000, name="onnx-batcher"
+        )
+
+    def cache_namespace(self):
+        try:
+            stat = os.stat(self.model_path)
+            version = f"{stat.st_size}-{stat.st_mtime_ns}"
+        except OSError:
+            version = "missing"
+        return (f"onnx:{os.path.basename(self.model_path)}:{version}"
+                f"|{self.input_size}-c{self.confidence}-i{self.iou}")
+
+    def infer(self, img_bytes, img_b64=None):
+        self.load()
+        return self._batcher.submit(self._prepare(img_bytes))
+
+    async def infer_async(self, img_bytes, img_b64=None):
+        self.load()
+        item = await asyncio.to_thread(self._prepare, img_bytes)
+        # Awaiting the batch result holds no thread, so many requests can share one batch
+        return await asyncio.wrap_future(self._batcher.submit_nowait(item))
+
+    # --- Pre/post-processing ---
+    def _prepare(self, img_bytes):
+        """Decodes and letterboxes one image. Returns (CHW float32 tensor, letterbox info)."""
+        np = self._np
+        image, _ = open_image(img_bytes)
+        image = image.convert("RGB")
+        width, height = image.size
+        size = self.input_size
+        ratio = min(size / width, size / height)
+        resized = (max(1, round(width * ratio)), max(1, round(height * ratio)))
+        pad_x, pad_y = (size - resized[0]) // 2, (size - resized[1]) // 2
+
+        canvas = np.full((size, size, 3), 114, dtype=np.uint8)
+        canvas[pad_y:pad_y + resized[1], pad_x:pad_x + resized[0]] = np.asarray(image.resize(resized))
+        tensor = canvas.transpose(2, 0, 1).astype(np.float32) / 255.0
+        return tensor, (width, height, ratio, pad_x, pad_y)
+
+    def _run_batch(self, items):
+        np = self._np
+        batch = np.stack([tensor for tensor, _ in items])
+        outputs = self._session.run(None, {self._input_name: batch})[0]
+        return [self._postprocess(outputs[i], letterbox) for i, (_, letterbox) in enumerate(items)]
+
+    def _postprocess(self, output, letterbox):
+        np = self._np
+        classes = len(self.class_names)
+        if output.shape[0] == 4 + classes:      # YOLOv8: (4 + classes, anchors)
+            output = output.T
+            boxes, scores = output[:, :4], output[:, 4:]
+        elif output.shape[1] == 4 + classes:    # YOLOv8, already anchors-first
+            boxes, scores = output[:, :4], output[:, 4:]
+        elif output.shape[1] == 5 + classes:    # YOLOv5: (anchors, 5 + classes) with objectness
+            boxes, scores = output[:, :4], output[:, 5:] * output[:, 4:5]
+        else:
+            raise ValueError(f"Unexpected ONNX output shape {output.shape} for {classes} classes.")
+
+        class_ids = scores.argmax(axis=1)
+        confidences = scores[np.arange(len(scores)), class_ids]
+        keep = confidences >= self.confidence
+        boxes, class_ids, confidences = boxes[keep], class_ids[keep], confidences[keep]
+
+        width, height, ratio, pad_x, pad_y = letterbox
+        predictions = []
+        for i in self._nms(boxes, class_ids, confidences):
+            cx, cy, w, h = boxes[i]
+            predictions.append({
+                "x": float((cx - pad_x) / ratio),
+                "y": float((cy - pad_y) / ratio),
+                "width": float(w / ratio),
+                "height": float(h / ratio),
+                "confidence": float(confidences[i]),
+                "class": self.class_names[int(class_ids[i])],
+                "class_id": int(class_ids[i]),
+            })
+        return {"predictions": predictions, "image": {"width": width, "height": height}}
+
+    def _nms(self, boxes, class_ids, confidences):
+        """Greedy per-class non-maximum suppression on centre-format boxes. Returns kept indexes."""
+        np = self._np
+        if not len(boxes):
+            return []
+        # Offset each class into its own region so boxes of different classes never overlap
+        offset = class_ids[:, None] * (4 * self.input_size)
+        x1 = boxes[:, 0] - boxes[:, 2] / 2 + offset[:, 0]
+        y1 = boxes[:, 1] - boxes[:, 3] / 2 + offset[:, 0]
+        x2, y2 = x1 + boxes[:, 2], y1 + boxes[:, 3]
+        areas = boxes[:, 2] * boxes[:, 3]
+        order = confidences.argsort()[::-1]
+        kept = []
+        while order.size:
+            best, rest = order[0], order[1:]
+            kept.append(int(best))
+            overlap_w = np.clip(np.minimum(x2[best], x2[rest]) - np.maximum(x1[best], x1[rest]), 0, None)
+            overlap_h = np.clip(np.minimum(y2[best], y2[rest]) - np.maximum(y1[best], y1[rest]), 0, None)
+            intersection = overlap_w * overlap_h
+            iou = intersection / (areas[best] + areas[rest] - intersection + 1e-9)
+            order = rest[iou <= self.iou]
+        return kept
+
+
+# --- Stub (tests and load tests) ---
+class StubBackend(InferenceBackend):
+    """
+    Deterministic, dependency-free backend: the result is derived from a hash of the image
+    bytes, so the same image always gets the same prediction. No network or model needed.
+    """
+
+    name = "stub"
+
+    def __init__(self, class_names=ONNX_CLASS_NAMES):
+        self.class_names = list(class_names) or ["object"]
+
+    def cache_namespace(self):
+        return "stub"
+
+    def infer(self, img_bytes, img_b64=None):
+        try:
+            _, width, height = read_image_header(img_bytes)
+        except ValueError:
+            image, _ = open_image(img_bytes)  # Other formats; raises ValueError if undecodable
+            width, height = image.size
+
+        digest = hashlib.sha256(img_bytes).digest()
+        predictions = []
+        if digest[0] >= 64:  # About a quarter of images have no detection
+            box_w, box_h = width * (0.05 + digest[3] / 1275), height * (0.05 + digest[4] / 1275)
+            predictions.append({
+                "x": box_w / 2 + (width - box_w) * digest[5] / 255,
+                "y": box_h / 2 + (height - box_h) * digest[6] / 255,
+                "width": box_w,
+                "height": box_h,
+                "confidence": round(0.5 + digest[1] / 510, 3),
+                "class": self.class_names[digest[2] % len(self.class_names)],
+                "class_id": digest[2] % len(self.class_names),
+            })
+        return {"predictions": predictions, "image": {"width": width, "height": height}}
+
+
+BACKENDS = {
+    RoboflowBackend.name: RoboflowBackend,
+    OnnxBackend.name: OnnxBackend,
+    StubBackend.name: StubBackend,
+}
+
+
+def create_backend(name=INFERENCE_BACKEND):
+    """Builds (but doesn't load) a backend by name. Raises ValueError for unknown names."""
+    try:
+        return BACKENDS[name]()
+    except KeyError:
+        raise ValueError(f"Unknown inference backend {name!r} (expected one of: {', '.join(BACKENDS)}).") from None
+
+
+_backend = None
+_backend_lock = threading.Lock()
+
+
+def get_backend():
+    """
+    Returns the process-wide backend selected by INFERENCE_BACKEND, loading it on first use.
+    If loading fails the error is raised and the next call tries again.
+    """
+    global _backend
+    if _backend is not None:
+        return _backend
+    with _backend_lock:
+        if _backend is None:
+            backend = create_backend()
+            backend.load()
+            _backend = backend
+        return _backend
+
+
+def backend_loaded():
+    """True once get_backend() has loaded the backend (so calling it won't block)."""
+    return _backend is not None
+
+
+def backend_status():
+    """Returns {"name": ..., "state": "ready" | "cold"} without loading anything."""
+    return {"name": INFERENCE_BACKEND, "state": "ready" if _backend is not None else "cold"}
@@ -0,0 +1,234 @@
+# instrumentation.py - Metrics (Prometheus text format), request ids and structured log lines
+#
+# Deliberately dependency-free and cheap: recording a sample is a perf_counter() pair,
+# a bisect over the bucket bounds and a short locked update.
+import bisect
+import contextvars
+import json
+import threading
+import time
+import uuid
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import STRUCTURED_LOGS
+
+# Seconds; covers cache hits and DB statements (sub-ms) up to slow LLM calls
+DEFAULT_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\"", "\\\"").replace("\n", "\\n")
+
+
+def _format_labels(names, values, extra=None):
+    pairs = [f'{name}="{_escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class _Metric:
+    type = "untyped"
+
+    def __init__(self, name, help_text, labelnames=()):
+        self.name = name
+        self.help = help_text
+        self.labelnames = tuple(labelnames)
+        self._lock = threading.Lock()
+        self._series = {}  # label values tuple -> state
+
+    def _key(self, labels):
+        return tuple(labels.get(name, "") for name in self.labelnames)
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.type}"]
+        with self._lock:
+            series = sorted(self._series.items())
+            lines.extend(self._render_series(series))
+        return lines
+
+
+class Counter(_Metric):
+    """Monotonically increasing count, optionally split by labels."""
+
+    type = "counter"
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._series[key] = self._series.get(key, 0) + amount
+
+    def _render_series(self, series):
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in series]
+
+
+class Histogram(_Metric):
+    """Distribution of observed values (seconds, by default) in cumulative buckets."""
+
+    type = "histogram"
+
+    def __init__(self, name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+        super().__init__(name, help_text, labelnames)
+        self.buckets = tuple(sorted(buckets))
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        index = bisect.bisect_left(self.buckets, value)
+        with self._lock:
+            state = self._series.get(key)
+            if state is None:
+                state = self._series[key] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        """Observes the wall time of the enclosed block (also when it raises)."""
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - start, **labels)
+
+    def _render_series(self, series):
+        lines = []
+        for key, (counts, total) in series:
+            cumulative = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                cumulative += count
+                le = 'le="+Inf"' if bound == float("inf") else f'le="{bound!r}"'
+                lines.append(f"{self.name}_bucket{_format_labels(self.labelnames, key, le)} {cumulative}")
+            labels = _format_labels(self.labelnames, key)
+            lines.append(f"{self.name}_sum{labels} {total}")
+            lines.append(f"{self.name}_count{labels} {cumulative}")
+        return lines
+
+
+class CallbackMetric(_Metric):
+    """A counter or gauge whose values are read from a callback at scrape time."""
+
+    def __init__(self, name, help_text, metric_type, callback, labelnames=()):
+        super().__init__(name, help_text, labelnames)
+        self.type = metric_type
+        self.callback = callback  # () -> {label values tuple: value}
+
+    def _render_series(self, series):
+        try:
+            values = self.callback()
+        except Exception as e:
+            return [f"# {self.name} unavailable: {_escape(e)}"]
+        return [f"{self.name}{_format_labels(self.labelnames, key)} {value}" for key, value in sorted(values.items())]
+
+
+class Registry:
+    """Holds every metric; render() produces the Prometheus text exposition format."""
+
+    def __init__(self):
+        self._metrics = {}
+        self._lock = threading.Lock()
+
+    def register(self, metric):
+        with self._lock:
+            existing = self._metrics.get(metric.name)
+            if existing is not None:
+                return existing  # Re-imports (e.g. the Flask reloader) share the original
+            self._metrics[metric.name] = metric
+            return metric
+
+    def render(self):
+        with self._lock:
+            metrics = list(self._metrics.values())
+        lines = []
+        for metric in metrics:
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = Registry()
+
+
+def counter(name, help_text, labelnames=()):
+    return REGISTRY.register(Counter(name, help_text, labelnames))
+
+
+def histogram(name, help_text, labelnames=(), buckets=DEFAULT_BUCKETS):
+    return REGISTRY.register(Histogram(name, help_text, labelnames, buckets))
+
+
+def callback_metric(name, help_text, metric_type, callback, labelnames=()):
+    return REGISTRY.register(CallbackMetric(name, help_text, metric_type, callback, labelnames))
+
+
+# --- Shared Metrics ---
+HTTP_REQUEST_SECONDS = histogram(
+    "http_request_duration_seconds", "HTTP request latency by route and status.", ("method", "route", "status")
+)
+SCAN_STAGE_SECONDS = histogram(
+    "scan_stage_duration_seconds",
+    "Time spent in each scan processing stage (decode, infer, serialize, previous_lookup, insert).",
+    ("stage",)
+)
+LLM_REQUEST_SECONDS = histogram(
+    "llm_request_duration_seconds", "External LLM call latency.", ("service", "operation", "outcome")
+)
+CHAT_RESPONSE_SECONDS = histogram(
+    "chat_response_duration_seconds", "Chat answer latency by where the answer came from.", ("source",)
+)
+
+
+@contextmanager
+def llm_call(service, operation):
+    """Times one LLM call into LLM_REQUEST_SECONDS with outcome "ok" or "error"."""
+    start = time.perf_counter()
+    outcome = "error"
+    try:
+        yield
+        outcome = "ok"
+    finally:
+        elapsed = time.perf_counter() - start
+        LLM_REQUEST_SECONDS.observe(elapsed, service=service, operation=operation, outcome=outcome)
+        log_event("llm_call", service=service, operation=operation, outcome=outcome, duration_ms=elapsed * 1000)
+
+
+# --- Request Ids and Structured Logs ---
+_request_id = contextvars.ContextVar("request_id", default=None)
+
+
+def new_request_id():
+    return uuid.uuid4().hex[:16]
+
+
+def set_request_id(request_id):
+    """Sets the request id for the current context. Returns a token for reset_request_id()."""
+    return _request_id.set(request_id)
+
+
+def reset_request_id(token):
+    _request_id.reset(token)
+
+
+def get_request_id():
+    return _request_id.get()
+
+
+def bind_context(fn):
+    """
+    Wraps fn so it runs with the caller's context (request id) when executed on another
+    thread, e.g. in a ThreadPoolExecutor. Each call gets its own copy of the context.
+    """
+    context = contextvars.copy_context()
+    return lambda *args, **kwargs: context.copy().run(fn, *args, **kwargs)
+
+
+def log_event(event, **fields):
+    """Prints one JSON log line with a timestamp, the event name and the current request id."""
+    if not STRUCTURED_LOGS:
+        return
+    record = {"ts": datetime.utcnow().isoformat(timespec="milliseconds") + "Z", "event": event}
+    request_id = _request_id.get()
+    if request_id:
+        record["request_id"] = request_id
+    for key, value in fields.items():
+        record[key] = round(value, 3) if isinstance(value, float) else value
+    print(json.dumps(record, default=str), flush=True)
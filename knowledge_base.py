@@ -0,0 +1,138 @@
+# knowledge_base.py - BM25 retrieval over the curated breast_cancer.txt knowledge base
+import math
+import re
+from collections import Counter, namedtuple
+
+from chat_cache import normalize_query
+
+KNOWLEDGE_BASE_PATH = "breast_cancer.txt"
+
+Passage = namedtuple("Passage", ["title", "text"])
+SearchHit = namedtuple("SearchHit", ["passage", "score", "coverage", "title_match"])
+
+# Footnote markers glued to sentence ends in the source text ("...after the age of 50.1 For example")
+_CITATION = re.compile(r"(?<=[.,;:])\d{1,2}(?=\s+[A-Z]|\s*$)")
+_QUIZ_OPTION = re.compile(r"^[A-Z]\) ")
+_SENTENCE_END = re.compile(r"(?<=[.!?])\s+")
+_MIN_PARAGRAPH_CHARS = 120
+_END_MARKERS = ("Works cited",)
+
+
+def _clean(text):
+    return _CITATION.sub("", text).strip()
+
+
+def parse_passages(text):
+    """
+    Splits the knowledge base into passages: one per prose paragraph, titled with the
+    nearest preceding heading line. Quiz questions and options and the citation list are skipped.
+    """
+    passages = []
+    title = ""
+    for line in text.splitlines():
+        line = line.strip()
+        if not line or _QUIZ_OPTION.match(line) or "?" in line:
+            continue
+        if line in _END_MARKERS:
+            break
+        if len(line) >= _MIN_PARAGRAPH_CHARS:
+            passages.append(Passage(title, _clean(line)))
+        elif not line.endswith("."):
+            title = line
+    return passages
+
+
+def summarize(text, max_words=100):
+    """Trims a passage to whole sentences within max_words (at least one sentence)."""
+    sentences = _SENTENCE_END.split(text)
+    kept, words = [], 0
+    for sentence in sentences:
+        count = len(sentence.split())
+        if kept and words + count > max_words:
+            break
+        kept.append(sentence)
+        words += count
+    return " ".join(kept)
+
+
+class KnowledgeBase:
+    """
+    Okapi BM25 index over knowledge-base passages, built once and then read-only
+    (safe to share between request threads).
+
+    Each passage is indexed with its heading so "alcohol" finds the "Alcohol" section.
+    search() also reports the IDF-weighted share of the query terms a passage contains and
+    whether a distinctive query term appears in its heading, which callers use to decide
+    whether a passage answers the question on its own.
+    """
+
+    def __init__(self, passages, k1=1.5, b=0.75):
+        self.passages = list(passages)
+        self.k1 = k1
+        self.b = b
+        self._postings = {}  # token -> [(passage index, term frequency)]
+        self._lengths = []
+        self._titles = [set(normalize_query(passage.title)) for passage in self.passages]
+        for index, passage in enumerate(self.passages):
+            tokens = normalize_query(f"{passage.title} {passage.text}")
+            self._lengths.append(len(tokens))
+            for token, tf in Counter(tokens).items():
+                self._postings.setdefault(token, []).append((index, tf))
+        self._avg_length = (sum(self._lengths) / len(self._lengths)) if self._lengths else 0.0
+        count = len(self.passages)
+        self._idf = {
+            token: math.log(1 + (count - len(postings) + 0.5) / (len(postings) + 0.5))
+            for token, postings in self._postings.items()
+        }
+        # Query terms the corpus has never seen weigh as much as its rarest term
+        self._unknown_idf = math.log(1 + (count + 0.5) / 0.5)
+        # Terms in at least half the passages ("breast", "cancer", "risk") say nothing about the topic
+        self._common = {token for token, postings in self._postings.items() if len(postings) * 2 >= count}
+
+    @classmethod
+    def from_file(cls, path=KNOWLEDGE_BASE_PATH):
+        """Builds the index from a knowledge-base text file. Raises OSError if it can't be read."""
+        with open(path, "r", encoding="utf-8") as f:
+            return cls(parse_passages(f.read()))
+
+    def __len__(self):
+        return len(self.passages)
+
+    def search(self, query, k=3):
+        """
+        Returns up to k SearchHits for the query, best first.
+
+        coverage is the IDF-weighted fraction of the query's terms present in the passage;
+        title_match is True if a query term other than the corpus-wide common ones is in its heading.
+        """
+        tokens = set(normalize_query(query))
+        if not tokens or not self.passages:
+            return []
+        scores = Counter()
+        matched = {}
+        for token in tokens:
+            idf = self._idf.get(token)
+            if idf is None:
+                continue
+            for index, tf in self._postings[token]:
+                norm = self.k1 * (1 - self.b + self.b * self._lengths[index] / self._avg_length)
+                scores[index] += idf * tf * (self.k1 + 1) / (tf + norm)
+                matched[index] = matched.get(index, 0.0) + idf
+        query_weight = sum(self._idf.get(token, self._unknown_idf) for token in tokens)
+        distinctive = tokens - self._common
+        return [
+            SearchHit(self.passages[index], score, matched[index] / query_weight,
+                      bool(distinctive & self._titles[index]))
+            for index, score in scores.most_common(k)
+        ]
+
+
+def load_knowledge_base(path=KNOWLEDGE_BASE_PATH):
+    """Builds the KnowledgeBase, or an empty one (with a warning) if the file is missing."""
+    try:
+        kb = KnowledgeBase.from_file(path)
+    except OSError as e:
+        print(f"Warning: knowledge base {path} not loaded: {e}")
+        return KnowledgeBase([])
+    print(f"Loaded knowledge base: {len(kb)} passages from {path}")
+    return kb
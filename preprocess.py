@@ -0,0 +1,152 @@
+# preprocess.py - Image decoding and the preprocessing applied before remote inference
+import io
+from collections import namedtuple
+
+from PIL import Image, ImageOps
+
+from config import (
+    SCAN_PREPROCESS_MAX_SIDE,
+    SCAN_PREPROCESS_GRAYSCALE,
+    SCAN_PREPROCESS_AUTOCONTRAST,
+    SCAN_PREPROCESS_FORMAT,
+    SCAN_PREPROCESS_QUALITY,
+)
+
+PreprocessedImage = namedtuple(
+    "PreprocessedImage",
+    ["data", "original_size", "size", "scale_x", "scale_y"]
+)
+
+
+def preprocess_signature():
+    """
+    Returns a short string describing the active preprocessing settings.
+    It is part of the inference cache key, so changing a setting invalidates cached results.
+    """
+    return (
+        f"max{SCAN_PREPROCESS_MAX_SIDE}-{'gray' if SCAN_PREPROCESS_GRAYSCALE else 'rgb'}"
+        f"-{'ac' if SCAN_PREPROCESS_AUTOCONTRAST else 'raw'}-{SCAN_PREPROCESS_FORMAT}{SCAN_PREPROCESS_QUALITY}"
+    )
+
+
+def open_image(img_bytes):
+    """
+    Decodes an image, applies its EXIF orientation and rescales 16/32-bit grayscale to 8 bits.
+
+    Returns:
+        tuple: (PIL.Image, converted) where converted is True if the pixels differ from a
+        plain decode (rotated or rescaled).
+
+    Raises:
+        ValueError: If the bytes cannot be decoded as an image.
+    """
+    try:
+        image = Image.open(io.BytesIO(img_bytes))
+        image.load()
+    except Exception as e:
+        raise ValueError("Could not decode image data.") from e
+
+    converted = image.getexif().get(0x0112, 1) != 1  # EXIF Orientation tag
+    if converted:
+        image = ImageOps.exif_transpose(image)
+    if image.mode.startswith("I"):
+        # 16/32-bit grayscale (common for mammograms): rescale to 8 bits instead of clipping
+        image = image.convert("I").point(lambda v: v * (1 / 256)).convert("L")
+        converted = True
+    return image, converted
+
+
+def preprocess_image(img_bytes, max_side=SCAN_PREPROCESS_MAX_SIDE, grayscale=SCAN_PREPROCESS_GRAYSCALE,
+                     autocontrast=SCAN_PREPROCESS_AUTOCONTRAST, fmt=SCAN_PREPROCESS_FORMAT,
+                     quality=SCAN_PREPROCESS_QUALITY):
+    """
+    Prepares an image for the detection model: applies EXIF orientation, converts to
+    grayscale, optionally stretches contrast, downscales so the longest side is at most
+    `max_side` (never upscales) and re-encodes as JPEG or PNG.
+
+    Args:
+        img_bytes (bytes): Original encoded image.
+        max_side (int): Longest side of the output in pixels (the model input size).
+        grayscale (bool): Convert to single-channel grayscale.
+        autocontrast (bool): Normalise intensities to the full 0-255 range.
+        fmt (str): "jpeg" or "png".
+        quality (int): JPEG quality (ignored for PNG).
+
+    Returns:
+        PreprocessedImage: Encoded bytes plus the scale factors from the original
+        (EXIF-corrected) image to the preprocessed one.
+
+    Raises:
+        ValueError: If the bytes cannot be decoded as an image.
+    """
+    image, changed = open_image(img_bytes)
+    original_size = image.size
+
+    if grayscale and image.mode != "L":
+        image = image.convert("L")
+        changed = True
+    elif image.mode not in ("L", "RGB"):
+        image = image.convert("RGB")
+        changed = True
+    if autocontrast:
+        image = ImageOps.autocontrast(image)
+        changed = True
+
+    width, height = original_size
+    longest = max(width, height)
+    if max_side and longest > max_side:
+        ratio = max_side / longest
+        image = image.resize((max(1, round(width * ratio)), max(1, round(height * ratio))), Image.LANCZOS)
+        changed = True
+
+    out = io.BytesIO()
+    if fmt == "png":
+        image.save(out, format="PNG", optimize=True)
+    else:
+        image.save(out, format="JPEG", quality=quality, optimize=True)
+    data = out.getvalue()
+
+    # Nothing changed and re-encoding didn't help: send the original bytes untouched
+    if not changed and len(data) >= len(img_bytes):
+        data = img_bytes
+
+    return PreprocessedImage(
+        data=data,
+        original_size=original_size,
+        size=image.size,
+        scale_x=image.size[0] / width,
+        scale_y=image.size[1] / height,
+    )
+
+
+def map_to_original(result, prep):
+    """
+    Maps prediction coordinates from the preprocessed image back to the original one.
+
+    Handles Roboflow detection results (center x/y, width/height) and segmentation
+    points. Results without predictions are returned unchanged.
+
+    Args:
+        result (dict | list): Inference result for the preprocessed image.
+        prep (PreprocessedImage): The preprocessing that produced the inference input.
+
+    Returns:
+        The same result object with coordinates in original image space.
+    """
+    if not isinstance(result, dict) or (prep.scale_x == 1 and prep.scale_y == 1):
+        return result
+
+    inv_x, inv_y = 1 / prep.scale_x, 1 / prep.scale_y
+    for prediction in result.get("predictions") or []:
+        if not isinstance(prediction, dict):
+            continue
+        for key, factor in (("x", inv_x), ("width", inv_x), ("y", inv_y), ("height", inv_y)):
+            if isinstance(prediction.get(key), (int, float)):
+                prediction[key] = prediction[key] * factor
+        for point in prediction.get("points") or []:
+            if isinstance(point, dict):
+                point["x"] = point.get("x", 0) * inv_x
+                point["y"] = point.get("y", 0) * inv_y
+    if isinstance(result.get("image"), dict):
+        result["image"]["width"], result["image"]["height"] = prep.original_size
+    return result
@@ -0,0 +1,108 @@
+# quiz_model.py - Compiled, hot-reloadable view of breast_cancer_quiz.json
+import bisect
+import json
+import os
+import re
+import threading
+
+from answer_matcher import normalize, option_interval, question_units
+
+QUIZ_PATH = "breast_cancer_quiz.json"
+
+_QUESTION_PREFIX = re.compile(r"^\s*(?:q(?:uestion)?\s*\d+\s*[:.)-]\s*)", re.IGNORECASE)
+
+
+def render_options(options):
+    """Renders quiz options as the lettered list used in LLM mapping prompts."""
+    return "\n".join([
+        f"{chr(65+i)}: {opt['text']} - {opt['points']} points"
+        for i, opt in enumerate(options)
+    ])
+
+
+def parse_band(range_text):
+    """Parses a scoring range such as "0-10" or "21+" into (low, high)."""
+    range_text = range_text.strip()
+    if range_text.endswith("+"):
+        return int(range_text[:-1]), float("inf")
+    low, high = range_text.split("-")
+    return int(low), int(high)
+
+
+class CompiledQuiz:
+    """
+    The quiz with everything derived from it computed once: questions indexed by id and
+    by normalised text, pre-rendered option prompts and matcher inputs, and scoring
+    bands as sorted numeric intervals searched with bisect.
+
+    Compiled questions are plain dicts (the original keys plus derived ones), so code
+    written against the raw JSON keeps working.
+    """
+
+    def __init__(self, data):
+        self.data = data
+        self.questions = []
+        self.by_id = {}
+        self.by_text = {}
+        for raw in data["questions"]:
+            question = dict(raw)
+            question["normalized"] = normalize(raw["question"])
+            question["options_prompt"] = render_options(raw["options"])
+            question["options_normalized"] = [normalize(opt["text"]) for opt in raw["options"]]
+            question["option_intervals"] = [option_interval(opt["text"]) for opt in raw["options"]]
+            question["answer_units"] = question_units(raw["question"], [opt["text"] for opt in raw["options"]])
+            self.questions.append(question)
+            self.by_id[question["id"]] = question
+            self.by_text[question["normalized"]] = question
+
+        bands = sorted(
+            (parse_band(rule["range"]) + (rule["risk_level"], rule["interpretation"]) for rule in data["scoring"]),
+            key=lambda band: band[0]
+        )
+        self._band_lows = [band[0] for band in bands]
+        self._bands = bands
+
+    def risk_level(self, score):
+        """Returns (risk_level, interpretation) for a total score."""
+        index = bisect.bisect_right(self._band_lows, score) - 1
+        if index >= 0:
+            low, high, risk_level, interpretation = self._bands[index]
+            if score <= high:
+                return risk_level, interpretation
+        return "Unknown", "Unable to determine risk level."
+
+    def asks(self, question, message_content):
+        """True if an assistant message asks the given compiled question."""
+        # Fast path: the message is just the question, optionally prefixed with "Q3:" etc.
+        stripped = normalize(_QUESTION_PREFIX.sub("", message_content))
+        if self.by_text.get(stripped) is question:
+            return True
+        return question["question"] in message_content
+
+
+_cache_lock = threading.Lock()
+_cached = {}  # path -> (mtime_ns, CompiledQuiz)
+
+
+def get_quiz(path=QUIZ_PATH):
+    """
+    Returns the compiled quiz, rebuilding it only when the file's mtime changes.
+
+    Raises:
+        OSError: If the quiz file can't be read.
+        ValueError: If it isn't valid quiz JSON.
+    """
+    mtime = os.stat(path).st_mtime_ns
+    entry = _cached.get(path)
+    if entry and entry[0] == mtime:
+        return entry[1]
+    with _cache_lock:
+        entry = _cached.get(path)
+        if entry and entry[0] == mtime:
+            return entry[1]
+        with open(path, "r") as f:
+            quiz = CompiledQuiz(json.load(f))
+        _cached[path] = (mtime, quiz)
+        if entry:
+            print(f"Reloaded quiz from {path}")
+        return quiz
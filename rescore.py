@@ -0,0 +1,473 @@
+# rescore.py - Offline re-scoring of historical scans (resumable batch job)
+#
+# Usage (from the repository root):
+#   python rescore.py scans                               # re-extract every stored result
+#   python rescore.py images ./scan_images --workers 8 --rate 5
+#   python rescore.py resume <run id>                     # continue an interrupted run
+#   python rescore.py runs                                # list runs and their progress
+#   python rescore.py apply <run id>                      # write a finished run into scans
+#
+# The scans table keeps each scan's raw model response but not its image. `scans` runs
+# the current class extraction and prediction normalisation over the stored responses,
+# which is what a change to that logic needs. A different model (RF_MODEL_ID, or another
+# INFERENCE_BACKEND) needs the images again: `images` runs every image in a directory
+# through the inference backend, and files named <scan id>.<ext> are linked to that scan.
+#
+# Results are written to rescore_results under the run's version rather than into scans,
+# so a run can be checked (and compared with the previous_class it replaces) before
+# `apply` promotes it. Finished items are checkpointed every RESCORE_CHECKPOINT_EVERY
+# items; after an interruption (Ctrl-C, crash), `resume` skips everything already scored.
+import argparse
+import json
+import os
+import sqlite3
+import sys
+import threading
+import time
+import uuid
+from collections import Counter
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, ThreadPoolExecutor, wait
+from datetime import datetime
+
+from config import RESCORE_WORKERS, RESCORE_RATE_PER_SECOND, RESCORE_CHECKPOINT_EVERY
+from inference_backends import create_backend, get_backend
+from ML import DB_PATH, extract_primary_class
+from scan_repository import (SQL_INSERT_PREDICTION, compress_result, decompress_result, get_repository,
+                             normalize_predictions)
+
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".webp", ".tif", ".tiff")
+SCAN_PAGE_SIZE = 500  # Stored scans read per query
+STORED_VERSION = "stored-results"  # Default version of `scans` runs (same model, current extraction)
+
+
+def _now():
+    return datetime.utcnow().isoformat() + "Z"
+
+
+# --- Work Items ---
+# Module-level so they can run in a process pool (--processes).
+def _summarize(result, started):
+    """
+    Returns (primary_class, result_blob, predictions_json, seconds) for one model response.
+    result_blob follows SCAN_STORE_RAW_RESULTS (see compress_result()); the normalised
+    predictions are always kept, so apply() doesn't need the raw result.
+    """
+    blob = compress_result(json.dumps(result))
+    predictions_json = json.dumps(normalize_predictions(result))
+    return extract_primary_class(result), blob, predictions_json, time.perf_counter() - started
+
+
+def rescore_stored(result_blob):
+    """Re-extracts a stored scan's result with the current logic."""
+    started = time.perf_counter()
+    result = decompress_result(result_blob)
+    if result is None:
+        raise ValueError("Scan has no stored result (SCAN_STORE_RAW_RESULTS was off).")
+    return _summarize(result, started)
+
+
+def rescore_image(path):
+    """Runs one image file through the inference backend."""
+    started = time.perf_counter()
+    with open(path, "rb") as f:
+        img_bytes = f.read()
+    return _summarize(get_backend().infer(img_bytes), started)
+
+
+def _stored_scans(repository, done):
+    """Yields (item, scan_id, previous_class, result_blob) for every scan, in id order."""
+    conn = repository.connection()
+    last_id = 0
+    while True:
+        # Keyset pages, so no cursor stays open while results are written on this connection
+        rows = conn.execute(
+            "SELECT id, primary_class, result_blob FROM scans WHERE id > ? ORDER BY id LIMIT ?",
+            (last_id, SCAN_PAGE_SIZE)
+        ).fetchall()
+        if not rows:
+            return
+        for scan_id, previous_class, result_blob in rows:
+            if str(scan_id) not in done:
+                yield str(scan_id), scan_id, previous_class, result_blob
+        last_id = rows[-1][0]
+
+
+def _image_files(repository, directory, done):
+    """Yields (item, scan_id, previous_class, path) for every image under a directory."""
+    conn = repository.connection()
+    for root, dirs, files in os.walk(directory):
+        dirs.sort()
+        for name in sorted(files):
+            if not name.lower().endswith(IMAGE_EXTENSIONS):
+                continue
+            path = os.path.join(root, name)
+            item = os.path.relpath(path, directory).replace(os.sep, "/")
+            if item in done:
+                continue
+            scan_id = previous_class = None
+            stem = os.path.splitext(name)[0]
+            if stem.isdigit():
+                row = conn.execute("SELECT id, primary_class FROM scans WHERE id = ?", (int(stem),)).fetchone()
+                if row:
+                    scan_id, previous_class = row
+            yield item, scan_id, previous_class, path
+
+
+# --- Rate Limiting ---
+class _RateLimiter:
+    """Token bucket: acquire() blocks so that at most `rate` items start per second (0 = no limit)."""
+
+    def __init__(self, rate):
+        self.rate = rate
+        self._tokens = 1.0
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        with self._lock:
+            while True:
+                now = time.monotonic()
+                self._tokens = min(1.0, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= 1:
+                    self._tokens -= 1
+                    return
+                time.sleep((1 - self._tokens) / self.rate)
+
+
+# --- Throughput Report ---
+class _Report:
+    """Counts and per-item latencies of one invocation (a resumed run reports its own part)."""
+
+    def __init__(self, skipped):
+        self.started = time.perf_counter()
+        self.skipped = skipped
+        self.seconds = []
+        self.failed = 0
+        self.changed = 0
+        self.linked = 0
+        self.classes = Counter()
+
+    def record(self, scan_id, previous_class, primary_class, seconds):
+        self.seconds.append(seconds)
+        self.classes[primary_class] += 1
+        if scan_id is not None:
+            self.linked += 1
+            self.changed += primary_class != previous_class
+
+    def rate(self):
+        return len(self.seconds) / max(time.perf_counter() - self.started, 1e-9)
+
+    def progress(self):
+        return f"{len(self.seconds)} scored, {self.failed} failed, {self.rate():.1f} items/s"
+
+    def print(self, run_id, status):
+        elapsed = time.perf_counter() - self.started
+        ordered = sorted(self.seconds)
+
+        def percentile(q):
+            return ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000
+
+        print(f"\nRun {run_id} ({status}): {len(ordered)} scored, {self.failed} failed, "
+              f"{self.skipped} skipped (already checkpointed)")
+        print(f"Elapsed {elapsed:.1f} s, {self.rate():.1f} items/s")
+        if ordered:
+            print(f"Per-item latency: p50 {percentile(0.5):.1f} ms, p95 {percentile(0.95):.1f} ms, "
+                  f"p99 {percentile(0.99):.1f} ms, max {ordered[-1] * 1000:.1f} ms")
+            print(f"Primary class changed for {self.changed} of {self.linked} scans")
+            print("Classes: " + ", ".join(f"{name} {count}" for name, count in self.classes.most_common()))
+
+
+# --- Runs ---
+class Rescorer:
+    """Runs, checkpoints and applies re-scoring runs against one scans database."""
+
+    def __init__(self, repository):
+        self.repository = repository
+
+    def init_db(self):
+        """Migrates the scans schema and creates the rescore tables if they don't already exist."""
+        self.repository.migrate()
+        with self.repository.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rescore_runs (
+                    id TEXT PRIMARY KEY,
+                    source TEXT NOT NULL,
+                    version TEXT NOT NULL,
+                    status TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    settings_json TEXT NOT NULL
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS rescore_results (
+                    run_id TEXT NOT NULL REFERENCES rescore_runs (id) ON DELETE CASCADE,
+                    item TEXT NOT NULL,
+                    scan_id INTEGER,
+                    version TEXT NOT NULL,
+                    previous_class TEXT,
+                    primary_class TEXT,
+                    result_blob BLOB,
+                    predictions_json TEXT,
+                    error TEXT,
+                    seconds REAL,
+                    scored_at TEXT NOT NULL,
+                    PRIMARY KEY (run_id, item)
+                )
+            """)
+            # Tables created before predictions were stored with the results
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(rescore_results)")}
+            if "predictions_json" not in columns:
+                conn.execute("ALTER TABLE rescore_results ADD COLUMN predictions_json TEXT")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_rescore_results_scan ON rescore_results (scan_id, version)")
+
+    def create_run(self, source, version, settings):
+        """Records a new run and returns its id."""
+        run_id = uuid.uuid4().hex[:12]
+        now = _now()
+        with self.repository.transaction() as conn:
+            conn.execute(
+                """INSERT INTO rescore_runs (id, source, version, status, created_at, updated_at, settings_json)
+                   VALUES (?, ?, ?, 'running', ?, ?, ?)""",
+                (run_id, source, version, now, now, json.dumps(settings))
+            )
+        return run_id
+
+    def get_run(self, run_id):
+        """Returns a run as a dict (settings decoded), or None if it doesn't exist."""
+        row = self.repository.connection().execute(
+            "SELECT id, source, version, status, created_at, updated_at, settings_json FROM rescore_runs WHERE id = ?",
+            (run_id,)
+        ).fetchone()
+        if row is None:
+            return None
+        run = dict(zip(("id", "source", "version", "status", "created_at", "updated_at"), row[:6]))
+        run["settings"] = json.loads(row[6])
+        return run
+
+    def list_runs(self):
+        """Returns every run (newest first) with its scored and failed counts."""
+        rows = self.repository.connection().execute("""
+            SELECT r.id, r.source, r.version, r.status, r.created_at,
+                   COUNT(s.item) - COUNT(s.error), COUNT(s.error)
+            FROM rescore_runs r LEFT JOIN rescore_results s ON s.run_id = r.id
+            GROUP BY r.id ORDER BY r.created_at DESC
+        """).fetchall()
+        columns = ("id", "source", "version", "status", "created_at", "scored", "failed")
+        return [dict(zip(columns, row)) for row in rows]
+
+    def _set_status(self, run_id, status):
+        with self.repository.transaction() as conn:
+            conn.execute("UPDATE rescore_runs SET status = ?, updated_at = ? WHERE id = ?", (status, _now(), run_id))
+
+    def _checkpoint(self, run_id, version, finished):
+        """Writes finished items (successes and failures) in one transaction."""
+        if not finished:
+            return
+        scored_at = _now()
+        with self.repository.transaction() as conn:
+            # A failed item that succeeds on resume replaces its error row
+            conn.executemany(
+                """INSERT OR REPLACE INTO rescore_results
+                   (run_id, item, scan_id, version, previous_class, primary_class, result_blob, predictions_json,
+                    error, seconds, scored_at)
+                   VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)""",
+                [(run_id, item, scan_id, version, previous_class, primary_class, blob, predictions_json,
+                  error, seconds, scored_at)
+                 for item, scan_id, previous_class, primary_class, blob, predictions_json, error, seconds in finished]
+            )
+            conn.execute("UPDATE rescore_runs SET updated_at = ? WHERE id = ?", (scored_at, run_id))
+        finished.clear()
+
+    def run(self, run_id, workers=RESCORE_WORKERS, rate=RESCORE_RATE_PER_SECOND, processes=False,
+            checkpoint_every=RESCORE_CHECKPOINT_EVERY):
+        """
+        Scores every item of a run that hasn't been scored yet, then prints a throughput report.
+
+        Items are submitted to a thread pool (or a process pool, for CPU-bound backends)
+        with at most 2 * workers in flight, so memory use doesn't grow with the source.
+
+        Returns:
+            str: The run's status afterwards: "done", or "interrupted" after Ctrl-C.
+        """
+        run = self.get_run(run_id)
+        done = {row[0] for row in self.repository.connection().execute(
+            "SELECT item FROM rescore_results WHERE run_id = ? AND error IS NULL", (run_id,)
+        )}
+        if run["source"] == "scans":
+            items, work_fn = _stored_scans(self.repository, done), rescore_stored
+        else:
+            if not processes:
+                get_backend()  # Fail before the first item if the backend can't load
+            items, work_fn = _image_files(self.repository, run["source"], done), rescore_image
+
+        self._set_status(run_id, "running")
+        report = _Report(skipped=len(done))
+        limiter = _RateLimiter(rate)
+        executor = (ProcessPoolExecutor if processes else ThreadPoolExecutor)(max_workers=workers)
+        in_flight = {}
+        finished = []
+        status = "done"
+
+        def collect(futures):
+            for future in futures:
+                item, scan_id, previous_class = in_flight.pop(future)
+                try:
+                    primary_class, blob, predictions_json, seconds = future.result()
+                except Exception as e:
+                    report.failed += 1
+                    print(f"Re-scoring failed for {item}: {e}")
+                    finished.append((item, scan_id, previous_class, None, None, None, str(e), None))
+                else:
+                    report.record(scan_id, previous_class, primary_class, seconds)
+                    finished.append((item, scan_id, previous_class, primary_class, blob, predictions_json, None, seconds))
+            if len(finished) >= checkpoint_every:
+                self._checkpoint(run_id, run["version"], finished)
+                print(report.progress())
+
+        try:
+            for item, scan_id, previous_class, payload in items:
+                while len(in_flight) >= workers * 2:
+                    collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+                limiter.acquire()
+                in_flight[executor.submit(work_fn, payload)] = (item, scan_id, previous_class)
+            while in_flight:
+                collect(wait(in_flight, return_when=FIRST_COMPLETED).done)
+        except KeyboardInterrupt:
+            status = "interrupted"
+            # Keep what already finished; everything else is picked up again by `resume`
+            for future in [f for f in in_flight if f.done() and not f.cancelled() and f.exception() is None]:
+                item, scan_id, previous_class = in_flight.pop(future)
+                primary_class, blob, predictions_json, seconds = future.result()
+                report.record(scan_id, previous_class, primary_class, seconds)
+                finished.append((item, scan_id, previous_class, primary_class, blob, predictions_json, None, seconds))
+        finally:
+            executor.shutdown(wait=status == "done", cancel_futures=True)
+            self._checkpoint(run_id, run["version"], finished)
+            self._set_status(run_id, status)
+        report.print(run_id, status)
+        if status == "interrupted":
+            print(f"Resume with: python rescore.py resume {run_id}")
+        return status
+
+    def apply(self, run_id, batch_size=SCAN_PAGE_SIZE):
+        """
+        Replaces primary_class, result_blob and the predictions of every scan the run scored
+        with the run's results, one transaction per batch. Returns the number of scans updated.
+        """
+        updated, last_id = 0, 0
+        conn = self.repository.connection()
+        while True:
+            rows = conn.execute(
+                """SELECT scan_id, primary_class, result_blob, predictions_json FROM rescore_results
+                   WHERE run_id = ? AND error IS NULL AND scan_id > ? ORDER BY scan_id LIMIT ?""",
+                (run_id, last_id, batch_size)
+            ).fetchall()
+            if not rows:
+                break
+            with self.repository.transaction(immediate=True) as conn:
+                for scan_id, primary_class, blob, predictions_json in rows:
+                    # The blob is already in its stored form (compress_result()), so it's written as is
+                    cur = conn.execute("UPDATE scans SET primary_class = ?, result_blob = ? WHERE id = ?",
+                                       (primary_class, blob, scan_id))
+                    if cur.rowcount != 1:
+                        continue  # Scan deleted since the run
+                    if predictions_json is not None:
+                        predictions = json.loads(predictions_json)
+                    else:  # Scored before predictions were kept with the results
+                        predictions = normalize_predictions(decompress_result(blob))
+                    conn.execute("DELETE FROM predictions WHERE scan_id = ?", (scan_id,))
+                    conn.executemany(SQL_INSERT_PREDICTION, [(scan_id, *row) for row in predictions])
+                    updated += 1
+            last_id = rows[-1][0]
+        self._set_status(run_id, "applied")
+        return updated
+
+
+# --- Command Line ---
+def main():
+    parser = argparse.ArgumentParser(description="Re-score historical scans with the current model and logic.")
+    parser.add_argument("--db", default=DB_PATH, help=f"Scans database (default: {DB_PATH})")
+    commands = parser.add_subparsers(dest="command", required=True)
+
+    def add_run_options(command, defaults=True):
+        command.add_argument("--workers", type=int, default=RESCORE_WORKERS if defaults else None,
+                             help="Items scored in parallel")
+        command.add_argument("--rate", type=float, default=RESCORE_RATE_PER_SECOND if defaults else None,
+                             help="Most items started per second (0 = no limit)")
+        command.add_argument("--processes", action="store_true", default=None if not defaults else False,
+                             help="Use a process pool instead of threads (CPU-bound backends, e.g. onnx)")
+        command.add_argument("--checkpoint-every", type=int, default=RESCORE_CHECKPOINT_EVERY,
+                             help="Finished items written per checkpoint")
+
+    scans = commands.add_parser("scans", help="Re-extract every stored scan result with the current logic")
+    scans.add_argument("--version", default=STORED_VERSION, help="Version label stored with the results")
+    add_run_options(scans)
+    images = commands.add_parser("images", help="Run every image in a directory through the inference backend")
+    images.add_argument("directory", help="Images to score; files named <scan id>.<ext> are linked to that scan")
+    images.add_argument("--version", help="Version label (default: the backend's model and settings)")
+    add_run_options(images)
+    resume = commands.add_parser("resume", help="Continue an interrupted run (failed items are retried)")
+    resume.add_argument("run_id")
+    add_run_options(resume, defaults=False)
+    commands.add_parser("runs", help="List runs")
+    apply = commands.add_parser("apply", help="Write a finished run's results into the scans table")
+    apply.add_argument("run_id")
+    args = parser.parse_args()
+
+    rescorer = Rescorer(get_repository(args.db))
+    try:
+        rescorer.init_db()
+    except sqlite3.Error as e:
+        parser.error(f"Cannot open {args.db}: {e}")
+
+    if args.command == "runs":
+        for run in rescorer.list_runs():
+            print(f"{run['id']}  {run['status']:<12}{run['created_at']}  {run['scored']} scored, "
+                  f"{run['failed']} failed  {run['source']} ({run['version']})")
+        return 0
+
+    if args.command == "apply":
+        run = rescorer.get_run(args.run_id)
+        if run is None:
+            parser.error(f"No such run: {args.run_id}")
+        if run["status"] not in ("done", "applied"):
+            parser.error(f"Run {args.run_id} is {run['status']}; finish it with `resume` first.")
+        print(f"Updated {rescorer.apply(args.run_id)} scans from run {args.run_id} ({run['version']})")
+        return 0
+
+    if args.command == "resume":
+        run = rescorer.get_run(args.run_id)
+        if run is None:
+            parser.error(f"No such run: {args.run_id}")
+        if run["status"] == "applied":
+            parser.error(f"Run {args.run_id} has already been applied.")
+        settings = run["settings"]
+        for key in ("workers", "rate", "processes"):
+            if getattr(args, key) is None:
+                setattr(args, key, settings[key])
+        run_id = run["id"]
+        print(f"Resuming run {run_id}: {run['source']} ({run['version']})")
+    else:
+        if args.command == "images":
+            if not os.path.isdir(args.directory):
+                parser.error(f"Not a directory: {args.directory}")
+            source = os.path.abspath(args.directory)
+            version = args.version or create_backend().cache_namespace()
+        else:
+            source, version = "scans", args.version
+        settings = {"workers": args.workers, "rate": args.rate, "processes": args.processes}
+        run_id = rescorer.create_run(source, version, settings)
+        print(f"Started run {run_id}: {source} ({version}), {args.workers} "
+              f"{'processes' if args.processes else 'threads'}, rate limit {args.rate or 'none'}")
+
+    status = rescorer.run(run_id, workers=args.workers, rate=args.rate, processes=args.processes,
+                          checkpoint_every=args.checkpoint_every)
+    return 0 if status == "done" else 130
+
+
+if __name__ == "__main__":
+    sys.exit(main())
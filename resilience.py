@@ -0,0 +1,489 @@
+# resilience.py - Deadlines, retry budgets, circuit breakers and hedged requests for external calls
+#
+# Every call to Roboflow, Groq or Gemini goes through a CallPolicy:
+#   - each attempt runs on a worker thread and is abandoned when its deadline passes, so a
+#     stalled socket never holds the caller longer than the deadline (the attempt also gets
+#     the remaining time to pass to the SDK's own timeout, so the thread ends soon after).
+#     Each service has its own bounded set of threads: when a stalled upstream has used
+#     them all, its calls fail at once with ServiceSaturated instead of queueing, and the
+#     other services are unaffected;
+#   - retryable failures (timeouts, connection errors, 429 and 5xx) are retried with full
+#     jitter backoff, but only while the service's retry budget has tokens, so retries can't
+#     multiply load on an upstream that is already struggling;
+#   - a circuit breaker opens after consecutive failures and fails calls immediately with
+#     CircuitOpenError until a single probe call succeeds;
+#   - optionally, a second (hedged) attempt is started when the first is slower than the
+#     recent p95 latency, and whichever finishes first wins.
+# call_async() applies the same policy to coroutines, with attempts as event loop tasks.
+import asyncio
+import random
+import threading
+import time
+from collections import deque
+from concurrent.futures import FIRST_COMPLETED, ThreadPoolExecutor, wait
+
+from config import RESILIENCE_MAX_THREADS, RETRY_MAX_ATTEMPTS, RETRY_BUDGET_RATIO, RETRY_BUDGET_MIN_PER_SECOND
+from config import RETRY_BACKOFF_BASE_MS, RETRY_BACKOFF_MAX_MS, BREAKER_FAILURE_THRESHOLD, BREAKER_RESET_SECONDS
+from config import HEDGE_SERVICES, HEDGE_QUANTILE, HEDGE_MIN_DELAY_MS, ASYNC_MAX_CONCURRENT_PER_SERVICE
+from config import ROBOFLOW_TIMEOUT_SECONDS, GROQ_TIMEOUT_SECONDS, GEMINI_TIMEOUT_SECONDS
+from instrumentation import bind_context, callback_metric, counter, log_event
+
+
+class DeadlineExceeded(TimeoutError):
+    """Raised when a call (including its retries) doesn't finish before its deadline."""
+
+
+class CircuitOpenError(ConnectionError):
+    """Raised instead of calling a service whose circuit breaker is open."""
+
+
+class ServiceSaturated(ConnectionError):
+    """Raised when every attempt thread of a service is busy (its earlier calls are stalled)."""
+
+
+# --- Error Classification ---
+def _status_code(exc):
+    """Finds an HTTP status code on SDK exceptions (groq, inference_sdk, requests, google api_core)."""
+    for attribute in ("status_code", "code"):
+        value = getattr(exc, attribute, None)
+        if isinstance(value, int):
+            return value
+    response = getattr(exc, "response", None)
+    value = getattr(response, "status_code", None)
+    return value if isinstance(value, int) else None
+
+
+def is_retryable(exc):
+    """True for failures another attempt may fix: timeouts, connection errors, 429 and 5xx."""
+    if isinstance(exc, (CircuitOpenError, ServiceSaturated)):
+        return False
+    status = _status_code(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    if isinstance(exc, (TimeoutError, ConnectionError)):
+        return True
+    # SDK-specific transport errors that don't subclass the builtins
+    return type(exc).__name__ in ("APIConnectionError", "APITimeoutError", "ConnectTimeout", "ReadTimeout",
+                                  "ConnectError", "ServiceUnavailable", "DeadlineExceeded", "RetryError",
+                                  "ReadError", "WriteError", "WriteTimeout", "PoolTimeout", "RemoteProtocolError")
+
+
+def is_service_failure(exc):
+    """True when the error says the service is unhealthy, as opposed to a bad request."""
+    status = _status_code(exc)
+    if status is not None:
+        return status == 429 or status >= 500
+    return not isinstance(exc, (ValueError, TypeError, KeyError))
+
+
+# --- Retry Budget ---
+class RetryBudget:
+    """
+    Token bucket that caps retries at a fraction of first attempts.
+
+    Every first attempt deposits `ratio` tokens and every retry withdraws one, so over
+    time at most `ratio` retries are made per call. `min_per_second` retries are always
+    allowed so a quiet service can still retry. Tokens are capped at 10 seconds' worth.
+    """
+
+    def __init__(self, ratio=RETRY_BUDGET_RATIO, min_per_second=RETRY_BUDGET_MIN_PER_SECOND):
+        self.ratio = ratio
+        self.min_per_second = min_per_second
+        self._cap = max(10.0 * min_per_second, 1.0)
+        self._tokens = float(min_per_second)
+        self._refilled = time.monotonic()
+        self._lock = threading.Lock()
+
+    def _refill(self, now):
+        self._tokens = min(self._cap, self._tokens + (now - self._refilled) * self.min_per_second)
+        self._refilled = now
+
+    def deposit(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            self._tokens = min(self._cap, self._tokens + self.ratio)
+
+    def try_withdraw(self):
+        with self._lock:
+            self._refill(time.monotonic())
+            if self._tokens >= 1.0:
+                self._tokens -= 1.0
+                return True
+            return False
+
+
+# --- Circuit Breaker ---
+class CircuitBreaker:
+    """
+    Closed -> open after `failure_threshold` consecutive service failures. While open,
+    calls fail immediately; after `reset_seconds` one probe call is let through
+    (half-open), and its outcome closes or re-opens the circuit.
+    """
+
+    CLOSED, OPEN, HALF_OPEN = "closed", "open", "half_open"
+
+    def __init__(self, failure_threshold=BREAKER_FAILURE_THRESHOLD, reset_seconds=BREAKER_RESET_SECONDS):
+        self.failure_threshold = max(1, failure_threshold)
+        self.reset_seconds = reset_seconds
+        self.state = self.CLOSED
+        self._failures = 0
+        self._opened_at = 0.0
+        self._probing = False
+        self._lock = threading.Lock()
+
+    def allow(self):
+        """Returns True if a call may proceed now."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return True
+            if self.state == self.OPEN and time.monotonic() - self._opened_at >= self.reset_seconds:
+                self.state = self.HALF_OPEN
+                self._probing = False
+            if self.state == self.HALF_OPEN and not self._probing:
+                self._probing = True
+                return True
+            return False
+
+    def retry_after(self):
+        """Seconds until the breaker will let a probe through (0 when closed)."""
+        with self._lock:
+            if self.state == self.CLOSED:
+                return 0.0
+            return max(0.0, self.reset_seconds - (time.monotonic() - self._opened_at))
+
+    def record_success(self):
+        with self._lock:
+            self.state = self.CLOSED
+            self._failures = 0
+            self._probing = False
+
+    def record_failure(self):
+        """Returns True if this failure opened the circuit."""
+        with self._lock:
+            self._failures += 1
+            if self.state == self.HALF_OPEN or self._failures >= self.failure_threshold:
+                opened = self.state != self.OPEN
+                self.state = self.OPEN
+                self._opened_at = time.monotonic()
+                self._probing = False
+                return opened
+            return False
+
+
+# --- Latency Tracking (hedge delay) ---
+class LatencyWindow:
+    """Recent successful call latencies; quantile() drives the hedge delay."""
+
+    def __init__(self, size=200):
+        self._samples = deque(maxlen=size)
+        self._lock = threading.Lock()
+
+    def add(self, seconds):
+        with self._lock:
+            self._samples.append(seconds)
+
+    def quantile(self, q):
+        with self._lock:
+            samples = sorted(self._samples)
+        if len(samples) < 20:
+            return None  # Not enough data to hedge sensibly yet
+        return samples[min(len(samples) - 1, int(q * len(samples)))]
+
+
+# --- Metrics ---
+RESILIENCE_EVENTS = counter(
+    "resilience_events_total",
+    "Retries, hedges, deadline expiries, budget exhaustion and short-circuited calls per service.",
+    ("service", "event")
+)
+_POLICIES = {}
+callback_metric(
+    "circuit_breaker_open", "1 while a service's circuit breaker is open or half-open.", "gauge",
+    lambda: {(name,): int(policy.breaker.state != CircuitBreaker.CLOSED) for name, policy in _POLICIES.items()},
+    ("service",)
+)
+
+# --- Call Policy ---
+class CallPolicy:
+    """
+    Runs calls to one external service with a deadline, budgeted retries, a circuit
+    breaker and optional hedging. See the module comment.
+
+    Args:
+        service (str): Name used in errors, logs and metrics.
+        timeout (float): Default per-call deadline in seconds (covers all attempts).
+        max_attempts (int): Upper bound on attempts per call, budget permitting.
+        hedge (bool): Start a second attempt when the first exceeds the p95 latency.
+            Only for idempotent calls.
+        max_threads (int): Attempts of this service running at once, abandoned ones included.
+    """
+
+    def __init__(self, service, timeout, max_attempts=RETRY_MAX_ATTEMPTS, hedge=None,
+                 budget=None, breaker=None, backoff_base=RETRY_BACKOFF_BASE_MS / 1000,
+                 backoff_max=RETRY_BACKOFF_MAX_MS / 1000, max_threads=RESILIENCE_MAX_THREADS):
+        self.service = service
+        self.timeout = timeout
+        self.max_attempts = max(1, max_attempts)
+        self.hedge = service in HEDGE_SERVICES if hedge is None else hedge
+        self.budget = budget or RetryBudget()
+        self.breaker = breaker or CircuitBreaker()
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.latency = LatencyWindow()
+        self._slots = None  # asyncio.Semaphore, created on the event loop that first uses it
+        # Attempts run here so the caller can stop waiting at the deadline; abandoned attempts
+        # finish (or time out in the client) in the background, holding their thread until then.
+        self._pool = ThreadPoolExecutor(max_workers=max_threads, thread_name_prefix=f"upstream-{service}")
+        self._threads = threading.BoundedSemaphore(max_threads)
+        _POLICIES[service] = self
+
+    def _event(self, event, **fields):
+        RESILIENCE_EVENTS.inc(service=self.service, event=event)
+        log_event(f"upstream_{event}", service=self.service, **fields)
+
+    def _check_breaker(self):
+        if not self.breaker.allow():
+            self._event("short_circuit")
+            raise CircuitOpenError(
+                f"{self.service} is unavailable (circuit open after repeated failures); "
+                f"retry in {self.breaker.retry_after():.0f}s."
+            )
+
+    def _record(self, exc):
+        if exc is None or not is_service_failure(exc):
+            self.breaker.record_success()  # A rejected request still means the service answered
+        elif self.breaker.record_failure():
+            self._event("circuit_opened", error=str(exc))
+
+    def _hedge_delay(self):
+        if not self.hedge:
+            return None
+        p = self.latency.quantile(HEDGE_QUANTILE)
+        return None if p is None else max(p, HEDGE_MIN_DELAY_MS / 1000)
+
+    def _submit(self, run, required=True):
+        """
+        Starts run() on one of the service's threads. When all are busy, raises
+        ServiceSaturated (or returns None if required is False, for hedges).
+        """
+        if not self._threads.acquire(blocking=False):
+            if not required:
+                return None
+            self._event("saturated")
+            raise ServiceSaturated(f"{self.service} is not responding (all {self.service} calls are stalled).")
+
+        try:
+            future = self._pool.submit(run)
+        except BaseException:
+            self._threads.release()
+            raise
+        future.add_done_callback(lambda _: self._threads.release())  # Also runs if cancelled before starting
+        return future
+
+    def _attempt(self, fn, deadline):
+        """One attempt, plus a hedged duplicate if it runs past the hedge delay. Returns the result."""
+        def run():
+            started = time.monotonic()
+            result = fn(max(0.001, deadline - started))
+            self.latency.add(time.monotonic() - started)
+            return result
+
+        run = bind_context(run)
+        futures = [self._submit(run)]
+        hedge_delay = self._hedge_delay()
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded(f"{self.service} call exceeded its deadline.")
+                wait_for = remaining
+                if hedge_delay is not None and len(futures) == 1:
+                    wait_for = min(remaining, hedge_delay)
+                done, _ = wait(futures, timeout=wait_for, return_when=FIRST_COMPLETED)
+                if not done:
+                    if hedge_delay is not None and len(futures) == 1 and deadline - time.monotonic() > 0:
+                        hedge = self._submit(run, required=False)
+                        if hedge is None:
+                            hedge_delay = None  # No thread free: don't hedge this attempt
+                        else:
+                            self._event("hedge", delay_ms=hedge_delay * 1000)
+                            futures.append(hedge)
+                    continue
+                future = done.pop()
+                error = future.exception()
+                if error is None:
+                    if len(futures) > 1 and future is futures[1]:
+                        self._event("hedge_won")
+                    return future.result()
+                futures.remove(future)
+                if not futures:
+                    raise error
+                # The other attempt is still running; give it the rest of the deadline
+        finally:
+            for future in futures:
+                future.cancel()  # Nothing queues (see _submit); running attempts are abandoned
+
+    def call(self, fn, timeout=None):
+        """
+        Calls fn(remaining_seconds) under this policy and returns its result.
+
+        Args:
+            fn (callable): Makes one request. It receives the seconds left before the
+                deadline and should pass them to the SDK's own timeout where possible.
+            timeout (float, optional): Deadline for this call, overriding the default.
+
+        Raises:
+            CircuitOpenError: If the circuit is open (nothing is sent).
+            DeadlineExceeded: If no attempt succeeded before the deadline.
+            Exception: The last attempt's error for non-retryable failures, or once
+                attempts or the retry budget run out.
+        """
+        self._check_breaker()
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self.budget.deposit()
+        attempt = 1
+        while True:
+            try:
+                result = self._attempt(fn, deadline)
+            except Exception as e:
+                time.sleep(self._backoff_or_raise(e, attempt, deadline))
+                attempt += 1
+                self._check_breaker()
+                continue
+            self._record(None)
+            return result
+
+    def _backoff_or_raise(self, error, attempt, deadline):
+        """
+        Records a failed attempt and returns how long to sleep before retrying it.
+        Re-raises `error` (from the caller's except block) when it shouldn't be retried.
+        """
+        self._record(error)
+        if isinstance(error, DeadlineExceeded):
+            self._event("deadline_exceeded", attempt=attempt)
+            raise error
+        if not is_retryable(error) or attempt >= self.max_attempts:
+            raise error
+        if not self.budget.try_withdraw():
+            self._event("budget_exhausted", error=str(error))
+            raise error
+        backoff = random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+        if time.monotonic() + backoff >= deadline:
+            raise error
+        self._event("retry", attempt=attempt, error=str(error), backoff_ms=backoff * 1000)
+        return backoff
+
+    # --- Async (asgi_app.py) ---
+    def _async_slots(self):
+        """
+        Per-service cap on attempts in flight (the async counterpart of the thread pool), so one
+        slow upstream can't take every connection of the shared async HTTP client.
+        """
+        if self._slots is None:
+            self._slots = asyncio.Semaphore(ASYNC_MAX_CONCURRENT_PER_SERVICE)
+        return self._slots
+
+    async def _attempt_async(self, fn, deadline):
+        """Coroutine version of _attempt(): attempts are tasks on the running event loop."""
+        async def run():
+            async with self._async_slots():
+                started = time.monotonic()
+                result = await fn(max(0.001, deadline - started))
+                self.latency.add(time.monotonic() - started)
+                return result
+
+        def start():
+            task = asyncio.ensure_future(run())
+            task.add_done_callback(_consume_error)  # Losing attempts' errors are expected
+            return task
+
+        tasks = [start()]
+        hedge_delay = self._hedge_delay()
+        try:
+            while True:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise DeadlineExceeded(f"{self.service} call exceeded its deadline.")
+                wait_for = remaining
+                if hedge_delay is not None and len(tasks) == 1:
+                    wait_for = min(remaining, hedge_delay)
+                done, _ = await asyncio.wait(tasks, timeout=wait_for, return_when=asyncio.FIRST_COMPLETED)
+                if not done:
+                    if hedge_delay is not None and len(tasks) == 1 and deadline - time.monotonic() > 0:
+                        self._event("hedge", delay_ms=hedge_delay * 1000)
+                        tasks.append(start())
+                    continue
+                task = done.pop()
+                error = task.exception()
+                if error is None:
+                    if len(tasks) > 1 and task is tasks[1]:
+                        self._event("hedge_won")
+                    return task.result()
+                tasks.remove(task)
+                if not tasks:
+                    raise error
+        finally:
+            for task in tasks:
+                task.cancel()  # Unlike threads, abandoned attempts really stop
+
+    async def call_async(self, fn, timeout=None):
+        """
+        Same as call(), for coroutines: fn(remaining_seconds) returns an awaitable. Attempts
+        run on the event loop instead of worker threads and are cancelled at the deadline.
+        """
+        self._check_breaker()
+        deadline = time.monotonic() + (timeout or self.timeout)
+        self.budget.deposit()
+        attempt = 1
+        while True:
+            try:
+                result = await self._attempt_async(fn, deadline)
+            except Exception as e:
+                await asyncio.sleep(self._backoff_or_raise(e, attempt, deadline))
+                attempt += 1
+                self._check_breaker()
+                continue
+            self._record(None)
+            return result
+
+    def guard(self):
+        """
+        Breaker bookkeeping for calls that can't be retried or run on another thread
+        (e.g. a response that is streamed to the client as it arrives).
+        Raises CircuitOpenError up front if the circuit is open.
+        """
+        self._check_breaker()
+        return _Guard(self)
+
+    def status(self):
+        return {"state": self.breaker.state, "retry_after_seconds": round(self.breaker.retry_after(), 1)}
+
+
+def _consume_error(task):
+    if not task.cancelled():
+        task.exception()
+
+
+class _Guard:
+    def __init__(self, policy):
+        self.policy = policy
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is not None and issubclass(exc_type, (GeneratorExit, asyncio.CancelledError)):
+            return False  # The client went away; says nothing about the service
+        self.policy._record(exc)
+        return False
+
+
+# --- Service Policies ---
+ROBOFLOW_POLICY = CallPolicy("roboflow", ROBOFLOW_TIMEOUT_SECONDS)
+GROQ_POLICY = CallPolicy("groq", GROQ_TIMEOUT_SECONDS)
+GEMINI_POLICY = CallPolicy("gemini", GEMINI_TIMEOUT_SECONDS)
+
+
+def breaker_status():
+    """Returns {service: {"state", "retry_after_seconds"}} for every policy."""
+    return {name: policy.status() for name, policy in _POLICIES.items()}
@@ -1,29 +1,49 @@
+import asyncio
 import json
 import os
-from groq import Groq
-from config import GROQ_API_KEY, GEMINI_API_KEY
-import google.generativeai as genai
+from concurrent.futures import ThreadPoolExecutor
+from config import GROQ_API_KEY, GEMINI_API_KEY, QUIZ_MAPPING_CONCURRENCY, QUIZ_LOCAL_MATCH_THRESHOLD
+from config import QUIZ_FALLBACK_MIN_CONFIDENCE
+from answer_matcher import match_answer, record_resolution
+from quiz_model import get_quiz, render_options
+from clients import get_groq_client, get_gemini_model  # Shared clients, created on first use
+from clients import get_async_groq_client, gemini_generate_async
+from instrumentation import bind_context, llm_call
+from resilience import GROQ_POLICY, GEMINI_POLICY
 
 # ------------------------------
 # LLM Chat Completion (Groq)
 # ------------------------------
+GROQ_MODEL = "llama-3.1-8b-instant"
+
 def groq_chat_completion(prompt: str, api_key: str) -> str:
-    client = Groq(api_key=api_key)
-    response = client.chat.completions.create(
-        model="llama-3.1-8b-instant",
-        messages=[{"role": "user", "content": prompt}],
-        stream=False
-    )
+    client = get_groq_client(api_key)
+    with llm_call("groq", "map_answer"):
+        response = GROQ_POLICY.call(lambda timeout: client.chat.completions.create(
+            model=GROQ_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            stream=False,
+            timeout=timeout
+        ))
+    return response.choices[0].message.content.strip()
+
+async def groq_chat_completion_async(prompt: str, api_key: str) -> str:
+    client = get_async_groq_client(api_key)
+    with llm_call("groq", "map_answer"):
+        response = await GROQ_POLICY.call_async(lambda timeout: client.chat.completions.create(
+            model=GROQ_MODEL,
+            messages=[{"role": "user", "content": prompt}],
+            stream=False,
+            timeout=timeout
+        ))
     return response.choices[0].message.content.strip()
 
 # ------------------------------
 # Prompt Generator for Groq Mapping
 # ------------------------------
-def generate_prompt(question: str, options: list, user_response: str) -> str:
-    options_text = "\n".join([
-        f"{chr(65+i)}: {opt['text']} - {opt['points']} points"
-        for i, opt in enumerate(options)
-    ])
+def generate_prompt(question: str, options: list, user_response: str, options_text: str = None) -> str:
+    # Compiled quiz questions carry pre-rendered options; render them here otherwise
+    options_text = options_text or render_options(options)
     prompt = f"""
 You are a helpful assistant categorizing health quiz answers.
 
@@ -43,20 +63,11 @@ User response: "{user_response}"
     print(prompt)
     return prompt
 
-# ------------------------------
-# Risk Level Evaluation
-# ------------------------------
-def get_risk_level(score, scoring_rules):
-    for rule in scoring_rules:
-        # Allow for ranges like "21+" by replacing '+' with '-999'
-        min_score, max_score = map(int, rule["range"].replace("+", "-999").split("-"))
-        if min_score <= score <= max_score:
-            return rule["risk_level"], rule["interpretation"]
-    return "Unknown", "Unable to determine risk level."
-
 # ------------------------------
 # Gemini Final Call Function (Structured JSON Output)
 # ------------------------------
+GEMINI_FAILURE_PREFIX = "⚠️ Gemini API call failed"
+
 def gemini_final_call(
     score: int,
     risk_level: str,
@@ -75,10 +86,37 @@ def gemini_final_call(
       "motivational_note": "<motivational closing message with signature>"
     }
     """
-    # Configure Gemini
-    genai.configure(api_key=api_key)
-    model = genai.GenerativeModel("gemini-2.0-flash")
-    
+    try:
+        # Shared Gemini model (configured once per process); raises ValueError without a key
+        model = get_gemini_model(api_key)
+        prompt = build_final_prompt(score, risk_level, interpretation, answers, user_name)
+        with llm_call("gemini", "risk_summary"):
+            response = GEMINI_POLICY.call(
+                lambda timeout: model.generate_content(prompt, request_options={"timeout": timeout})
+            )
+            return response.text.strip()
+    except Exception as e:
+        return f"{GEMINI_FAILURE_PREFIX}: {e}"
+
+async def gemini_final_call_async(
+    score: int,
+    risk_level: str,
+    interpretation: str,
+    answers: list,
+    user_name: str,
+    api_key: str
+) -> str:
+    """Coroutine version of gemini_final_call() over the shared async HTTP client."""
+    try:
+        prompt = build_final_prompt(score, risk_level, interpretation, answers, user_name)
+        with llm_call("gemini", "risk_summary"):
+            text = await GEMINI_POLICY.call_async(lambda timeout: gemini_generate_async(api_key, prompt, timeout))
+            return text.strip()
+    except Exception as e:
+        return f"{GEMINI_FAILURE_PREFIX}: {e}"
+
+def build_final_prompt(score: int, risk_level: str, interpretation: str, answers: list, user_name: str) -> str:
+    """Prompt for the final Gemini summary (see gemini_final_call for the expected JSON)."""
     # Build the answer summary
     answer_summary = "\n".join([
         f"{i+1}. {a['question']}\n   → You answered: {a['user_answer']}\n   → Mapped to: {a['matched_option']} (Score: {a['score']})"
@@ -108,11 +146,7 @@ Based on this, please produce a structured JSON output that strictly follows thi
 
 Please make sure your output adheres exactly to this JSON structure. Do not include any extra text or keys.
 """
-    try:
-        response = model.generate_content(prompt)
-        return response.text.strip()
-    except Exception as e:
-        return f"⚠️ Gemini API call failed: {e}"
+    return prompt
 
 # ------------------------------
 # Helper: Parse Gemini Structured Response
@@ -138,17 +172,143 @@ def parse_gemini_response(gemini_output: str) -> dict:
         print(f"Error parsing Gemini output: {e}")
         return {}
 
+# ------------------------------
+# Answer Mapping
+# ------------------------------
+def pair_answers(conversation: list, quiz) -> list:
+    """
+    Walks the conversation and pairs each quiz question (asked by the assistant, in order)
+    with the user's reply that follows it. Returns a list of (question_obj, user_answer).
+    """
+    questions = quiz.questions
+    pairs = []
+    q_index = 0
+    i = 0
+    while q_index < len(questions) and i < len(conversation) - 1:
+        assistant_msg = conversation[i]
+        next_msg = conversation[i + 1]
+
+        if assistant_msg["role"] == "assistant" and quiz.asks(questions[q_index], assistant_msg["content"]):
+            if next_msg["role"] == "user":
+                pairs.append((questions[q_index], next_msg["content"]))
+                q_index += 1
+                i += 1  # skip next_msg too (user answer)
+        i += 1
+    return pairs
+
+def _local_result(question_obj: dict, user_answer: str, match, resolved_by: str) -> dict:
+    """Scored result for an answer resolved by the local matcher (or "N/A" without a match)."""
+    return {
+        "question": question_obj["question"],
+        "user_answer": user_answer,
+        "matched_option": chr(65 + match.option_index) if match else "N/A",
+        "score": question_obj["options"][match.option_index]["points"] if match else 0,
+        "resolved_by": resolved_by
+    }
+
+def _fallback_result(question_obj: dict, user_answer: str, match) -> dict:
+    """Scored result when Groq failed: the local match if it's confident enough, else "N/A" (0 points)."""
+    if match and match.confidence < QUIZ_FALLBACK_MIN_CONFIDENCE:
+        match = None
+    return _local_result(question_obj, user_answer, match, "local_fallback")
+
+def _mapping_prompt(question_obj: dict, user_answer: str) -> str:
+    return generate_prompt(
+        question_obj["question"], question_obj["options"], user_answer, question_obj.get("options_prompt")
+    )
+
+def _llm_result(question_obj: dict, user_answer: str, llm_output: str) -> dict:
+    """Scored result from the LLM's JSON answer."""
+    try:
+        parsed = json.loads(llm_output)
+        selected_option = parsed.get("selected_option", "N/A")
+        score = parsed.get("score", 0)
+    except Exception as e:
+        print(f"⚠️ Couldn't parse Groq output: {e}")
+        selected_option = "N/A"
+        score = 0
+
+    return {
+        "question": question_obj["question"],
+        "user_answer": user_answer,
+        "matched_option": selected_option,
+        "score": score,
+        "resolved_by": "llm"
+    }
+
+def map_answer(question_obj: dict, user_answer: str, groq_api_key: str) -> dict:
+    """
+    Maps one free-text answer to a quiz option and returns the scored result.
+    Obvious answers are matched locally; the LLM is only called when the local
+    matcher's confidence is below QUIZ_LOCAL_MATCH_THRESHOLD.
+    """
+    match = match_answer(question_obj, user_answer)
+    if match and match.confidence >= QUIZ_LOCAL_MATCH_THRESHOLD:
+        record_resolution("local")
+        return _local_result(question_obj, user_answer, match, "local")
+
+    record_resolution("llm")
+    try:
+        llm_output = groq_chat_completion(_mapping_prompt(question_obj, user_answer), groq_api_key)
+    except Exception as e:
+        # Groq is down or too slow: fall back to the local matcher's match, if it's confident enough
+        print(f"⚠️ Groq mapping failed, using local match: {e}")
+        return _fallback_result(question_obj, user_answer, match)
+    return _llm_result(question_obj, user_answer, llm_output)
+
+async def map_answer_async(question_obj: dict, user_answer: str, groq_api_key: str) -> dict:
+    """Coroutine version of map_answer()."""
+    match = match_answer(question_obj, user_answer)
+    if match and match.confidence >= QUIZ_LOCAL_MATCH_THRESHOLD:
+        record_resolution("local")
+        return _local_result(question_obj, user_answer, match, "local")
+
+    record_resolution("llm")
+    try:
+        llm_output = await groq_chat_completion_async(_mapping_prompt(question_obj, user_answer), groq_api_key)
+    except Exception as e:
+        print(f"⚠️ Groq mapping failed, using local match: {e}")
+        return _fallback_result(question_obj, user_answer, match)
+    return _llm_result(question_obj, user_answer, llm_output)
+
+def map_answers(pairs: list, groq_api_key: str, max_workers: int = QUIZ_MAPPING_CONCURRENCY) -> list:
+    """
+    Maps every (question_obj, user_answer) pair concurrently, at most `max_workers` LLM
+    calls at a time. Results are returned in question order, same as mapping them one by one.
+    """
+    if not pairs:
+        return []
+    with ThreadPoolExecutor(max_workers=max(1, min(max_workers, len(pairs)))) as pool:
+        map_pair = bind_context(lambda pair: map_answer(pair[0], pair[1], groq_api_key))
+        return list(pool.map(map_pair, pairs))
+
+async def map_answers_async(pairs: list, groq_api_key: str, max_concurrency: int = QUIZ_MAPPING_CONCURRENCY) -> list:
+    """Coroutine version of map_answers(): at most `max_concurrency` LLM calls in flight, results in order."""
+    limit = asyncio.Semaphore(max(1, max_concurrency))
+
+    async def map_pair(question_obj, user_answer):
+        async with limit:
+            return await map_answer_async(question_obj, user_answer, groq_api_key)
+
+    return list(await asyncio.gather(*(map_pair(question_obj, answer) for question_obj, answer in pairs)))
+
 # ------------------------------
 # Quiz Engine
 # ------------------------------
-def run_quiz_from_conversation(conversation: list, api=GROQ_API_KEY):
-    # Load quiz and API key
+def resolve_groq_key(api: str = GROQ_API_KEY) -> str:
+    """Returns the Groq API key to use, raising ValueError if it's missing or malformed."""
     groq_api_key = os.getenv("GROQ_API_KEY") or api
     if not groq_api_key.startswith("gsk_"):
         raise ValueError("Missing or invalid Groq API key.")
+    return groq_api_key
 
-    with open("breast_cancer_quiz.json", "r") as f:
-        quiz_data = json.load(f)
+def start_quiz(conversation: list, api: str):
+    """Validates the Groq key and pairs questions with answers. Returns (groq_api_key, quiz, user_name, pairs)."""
+    # Load quiz and API key
+    groq_api_key = resolve_groq_key(api)
+
+    # Compiled once and rebuilt only when breast_cancer_quiz.json changes
+    quiz = get_quiz()
 
     # Try extracting user name from the conversation
     user_name = "User"
@@ -157,70 +317,80 @@ def run_quiz_from_conversation(conversation: list, api=GROQ_API_KEY):
             user_name = msg["content"].split("name is")[-1].strip().strip(".!")
             break
 
-    total_score = 0
-    detailed_results = []
-
     # --- Match assistant question -> next user response ---
-    q_index = 0
-    i = 0
-    while q_index < len(quiz_data["questions"]) and i < len(conversation) - 1:
-        assistant_msg = conversation[i]
-        next_msg = conversation[i + 1]
-
-        if assistant_msg["role"] == "assistant" and quiz_data["questions"][q_index]["question"] in assistant_msg["content"]:
-            if next_msg["role"] == "user":
-                question_obj = quiz_data["questions"][q_index]
-                user_answer = next_msg["content"]
-
-                prompt = generate_prompt(question_obj["question"], question_obj["options"], user_answer)
-                llm_output = groq_chat_completion(prompt, groq_api_key)
-
-                try:
-                    parsed = json.loads(llm_output)
-                    selected_option = parsed.get("selected_option", "N/A")
-                    score = parsed.get("score", 0)
-                except Exception as e:
-                    print(f"⚠️ Couldn't parse Groq output: {e}")
-                    selected_option = "N/A"
-                    score = 0
-
-                total_score += score
-                detailed_results.append({
-                    "question": question_obj["question"],
-                    "user_answer": user_answer,
-                    "matched_option": selected_option,
-                    "score": score
-                })
-                q_index += 1
-                i += 1  # skip next_msg too (user answer)
-        i += 1
+    return groq_api_key, quiz, user_name, pair_answers(conversation, quiz)
 
-    # ------------------------------
-    # Final Summary and Risk Evaluation
-    # ------------------------------
-    risk_level, interpretation = get_risk_level(total_score, quiz_data["scoring"])
+def score_quiz(quiz, detailed_results: list) -> dict:
+    """Totals the mapped answers and looks up the risk level."""
+    total_score = sum(result["score"] for result in detailed_results)
+    mapping_stats = {
+        "local": sum(result["resolved_by"] == "local" for result in detailed_results),
+        "llm": sum(result["resolved_by"] == "llm" for result in detailed_results),
+        # Groq failed: scored from a confident local match, or "N/A"
+        "fallback": sum(result["resolved_by"] == "local_fallback" for result in detailed_results),
+    }
+    print(f"Quiz answers resolved locally: {mapping_stats['local']}, via LLM: {mapping_stats['llm']}, "
+          f"fallback after LLM failure: {mapping_stats['fallback']}")
+    risk_level, interpretation = quiz.risk_level(total_score)
+    return {
+        "total_score": total_score,
+        "risk_level": risk_level,
+        "interpretation": interpretation,
+        "mapping_stats": mapping_stats,
+    }
 
-    gemini_output = gemini_final_call(
-        score=total_score,
-        risk_level=risk_level,
-        interpretation=interpretation,
-        answers=detailed_results,
-        user_name=user_name,
-        api_key=GEMINI_API_KEY
-    )
+def finish_quiz(user_name: str, scored: dict, detailed_results: list, gemini_output: str) -> dict:
     print(gemini_output)
-
     insights = parse_gemini_response(gemini_output)
     print(insights)
     return {
         "user_name": user_name,
-        "total_score": total_score,
-        "risk_level": risk_level,
-        "interpretation": interpretation,
+        "total_score": scored["total_score"],
+        "risk_level": scored["risk_level"],
+        "interpretation": scored["interpretation"],
         "detailed_results": detailed_results,
+        "mapping_stats": scored["mapping_stats"],
         "gemini_insights": insights
     }
 
+def final_summary(user_name: str, scored: dict, detailed_results: list) -> str:
+    """Gemini's final summary for a scored quiz (a GEMINI_FAILURE_PREFIX message if the call failed)."""
+    return gemini_final_call(
+        score=scored["total_score"],
+        risk_level=scored["risk_level"],
+        interpretation=scored["interpretation"],
+        answers=detailed_results,
+        user_name=user_name,
+        api_key=GEMINI_API_KEY
+    )
+
+def run_quiz_from_conversation(conversation: list, api=GROQ_API_KEY):
+    groq_api_key, quiz, user_name, pairs = start_quiz(conversation, api)
+    # Map all answers at once
+    detailed_results = map_answers(pairs, groq_api_key)
+    scored = score_quiz(quiz, detailed_results)
+
+    # ------------------------------
+    # Final Summary and Risk Evaluation
+    # ------------------------------
+    gemini_output = final_summary(user_name, scored, detailed_results)
+    return finish_quiz(user_name, scored, detailed_results, gemini_output)
+
+async def run_quiz_from_conversation_async(conversation: list, api=GROQ_API_KEY):
+    """Coroutine version of run_quiz_from_conversation() for the async app."""
+    groq_api_key, quiz, user_name, pairs = start_quiz(conversation, api)
+    detailed_results = await map_answers_async(pairs, groq_api_key)
+    scored = score_quiz(quiz, detailed_results)
+    gemini_output = await gemini_final_call_async(
+        score=scored["total_score"],
+        risk_level=scored["risk_level"],
+        interpretation=scored["interpretation"],
+        answers=detailed_results,
+        user_name=user_name,
+        api_key=GEMINI_API_KEY
+    )
+    return finish_quiz(user_name, scored, detailed_results, gemini_output)
+
 # ------------------------------
 # Run the Quiz
 # ------------------------------
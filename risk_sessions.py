@@ -0,0 +1,337 @@
+# risk_sessions.py - Incremental risk assessment: answers are scored as they are given
+#
+# The risk-assessment page posts each answer to a session as soon as it is entered. The
+# answer is mapped to a quiz option on a background thread and the session keeps the
+# running total. Once every question has a scored answer, Gemini's final summary is
+# requested speculatively, so by the time the user submits, POST /api/risk-assessment
+# (with the session id) only has to check the conversation against the session.
+#
+# Sessions live in memory and are written through to the risk_sessions table, so a
+# restarted process (or another one sharing the database) can still reuse them. Each
+# scored answer is stored with the time it was given: a process re-reads a session whose
+# row changed since it last saw it, and writes merge per question, newest answer winning.
+import hashlib
+import json
+import threading
+import time
+import uuid
+from concurrent.futures import Future, ThreadPoolExecutor, wait
+
+from config import GROQ_API_KEY
+from quiz_model import get_quiz
+from risk_assessment import (GEMINI_FAILURE_PREFIX, final_summary, finish_quiz, map_answer, map_answers,
+                             resolve_groq_key, score_quiz, start_quiz)
+from instrumentation import bind_context, counter, log_event
+
+RISK_SESSION_EVENTS = counter(
+    "risk_session_events_total",
+    "Risk session answers and final summaries by whether the final request reused them.",
+    ("kind", "outcome")
+)
+
+
+class _Session:
+    def __init__(self, session_id, user_name, created_at, updated_at):
+        self.id = session_id
+        self.user_name = user_name
+        self.created_at = created_at
+        self.updated_at = updated_at
+        self.synced_at = updated_at  # updated_at of the row as last read or written
+        self.lock = threading.Lock()
+        self.answers = {}   # question id -> latest answer text
+        self.answered_at = {}  # question id -> when the latest answer was given
+        self.results = {}   # question id -> (answer text, scored result)
+        self.pending = {}   # question id -> (answer text, Future of the scored result)
+        self.summary = None  # (fingerprint, Future of Gemini's output)
+
+
+def _fingerprint(user_name, detailed_results):
+    """Identifies the inputs of a final summary; a changed answer or score changes it."""
+    key = [user_name] + [[r["question"], r["user_answer"], r["matched_option"], r["score"]] for r in detailed_results]
+    return hashlib.sha256(json.dumps(key).encode("utf-8")).hexdigest()
+
+
+def _current_fingerprint(session):
+    """Fingerprint of the session's scored answers, or None until every question is scored."""
+    quiz = get_quiz()
+    if any(q["id"] not in session.results for q in quiz.questions):
+        return None
+    return _fingerprint(session.user_name or "User", [session.results[q["id"]][1] for q in quiz.questions])
+
+
+def _done(value):
+    future = Future()
+    future.set_result(value)
+    return future
+
+
+class RiskSessionStore:
+    """
+    Server-side quiz sessions with background answer mapping and a speculative final summary.
+    All methods are thread-safe; mapping and Gemini calls run on the store's own pool.
+    """
+
+    def __init__(self, repository, workers=4, ttl_seconds=24 * 3600):
+        self.repository = repository
+        self.ttl_seconds = ttl_seconds
+        self._pool = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="risk-session")
+        self._sessions = {}
+        self._lock = threading.Lock()
+
+    # --- Storage ---
+    def init_db(self):
+        """Creates the risk_sessions table if it doesn't already exist."""
+        with self.repository.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS risk_sessions (
+                    id TEXT PRIMARY KEY,
+                    user_name TEXT,
+                    created_at REAL NOT NULL,
+                    updated_at REAL NOT NULL,
+                    results_json TEXT NOT NULL DEFAULT '{}',
+                    summary_json TEXT
+                )
+            """)
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_risk_sessions_updated ON risk_sessions (updated_at)")
+
+    @staticmethod
+    def _merge(session, results_json, summary_json, updated_at):
+        """Takes answers from a stored row that are newer than this process's (caller holds session.lock)."""
+        for qid, entry in json.loads(results_json).items():
+            qid = int(qid)
+            if entry.get("at", 0) > session.answered_at.get(qid, -1):
+                session.answers[qid] = entry["answer"]
+                session.answered_at[qid] = entry.get("at", 0)
+                session.results[qid] = (entry["answer"], entry["result"])
+                session.pending.pop(qid, None)  # Its mapping sees the newer answer and is dropped
+        if summary_json:
+            summary = json.loads(summary_json)
+            if session.summary is None or session.summary[0] != summary["fingerprint"] and (
+                    summary["fingerprint"] == _current_fingerprint(session)):
+                session.summary = (summary["fingerprint"], _done(summary["output"]))
+        session.synced_at = max(session.synced_at, updated_at)
+
+    def _save(self, session):
+        """
+        Writes a session's scored answers and final summary through to SQLite, merged per
+        question with what other processes have written meanwhile.
+        """
+        with self.repository.transaction(immediate=True) as conn:
+            row = conn.execute(
+                "SELECT results_json, summary_json, updated_at FROM risk_sessions WHERE id = ?", (session.id,)
+            ).fetchone()
+            if row is None:
+                return  # Expired
+            with session.lock:
+                self._merge(session, *row)
+                results = {str(qid): {"answer": answer, "result": result, "at": session.answered_at.get(qid, 0)}
+                           for qid, (answer, result) in session.results.items()}
+                summary_json = row[1]
+                if session.summary and session.summary[1].done() and not session.summary[1].exception():
+                    output = session.summary[1].result()
+                    if not output.startswith(GEMINI_FAILURE_PREFIX):
+                        summary_json = json.dumps({"fingerprint": session.summary[0], "output": output})
+                session.updated_at = max(time.time(), row[2])
+                session.synced_at = session.updated_at
+                values = (json.dumps(results), summary_json, session.updated_at, session.id)
+            conn.execute("UPDATE risk_sessions SET results_json = ?, summary_json = ?, updated_at = ? WHERE id = ?",
+                         values)
+
+    def _load(self, session_id):
+        """
+        Returns the live session, reading it from SQLite if this process doesn't hold it,
+        and merging in answers other processes saved since this process last saw it.
+        """
+        row = self.repository.connection().execute(
+            "SELECT user_name, created_at, updated_at, results_json, summary_json FROM risk_sessions WHERE id = ?",
+            (session_id,)
+        ).fetchone()
+        if row is None:
+            with self._lock:
+                self._sessions.pop(session_id, None)  # Expired by another process
+            return None
+        user_name, created_at, updated_at, results_json, summary_json = row
+        with self._lock:
+            session = self._sessions.get(session_id)
+            if session is None:
+                session = self._sessions[session_id] = _Session(session_id, user_name, created_at, updated_at)
+                session.synced_at = -1  # Nothing read yet
+        with session.lock:
+            if updated_at > session.synced_at:
+                self._merge(session, results_json, summary_json, updated_at)
+                session.updated_at = max(session.updated_at, updated_at)
+        if time.time() - session.updated_at > self.ttl_seconds:
+            return None
+        return session
+
+    def _expire(self):
+        """Drops sessions idle for longer than ttl_seconds, in memory and on disk."""
+        cutoff = time.time() - self.ttl_seconds
+        with self._lock:
+            for session_id in [sid for sid, s in self._sessions.items() if s.updated_at < cutoff]:
+                del self._sessions[session_id]
+        with self.repository.transaction() as conn:
+            conn.execute("DELETE FROM risk_sessions WHERE updated_at < ?", (cutoff,))
+
+    # --- Background Work ---
+    def _map(self, session, question, answer):
+        """Maps one answer to an option (runs on the pool) and stores it if it's still current."""
+        try:
+            result = map_answer(question, answer, resolve_groq_key())
+        except Exception as e:
+            print(f"Risk session answer mapping failed: {e}")
+            with session.lock:
+                if session.pending.get(question["id"], (None,))[0] == answer:
+                    del session.pending[question["id"]]  # finish() maps it again
+            raise
+        with session.lock:
+            if session.answers.get(question["id"]) != answer:
+                return result  # Answer changed meanwhile; its own mapping is already queued
+            session.results[question["id"]] = (answer, result)
+            if session.pending.get(question["id"], (None,))[0] == answer:
+                del session.pending[question["id"]]
+        self._save(session)
+        self._maybe_summarize(session)
+        return result
+
+    def _maybe_summarize(self, session):
+        """Starts Gemini's final summary once every question has a current, scored answer."""
+        quiz = get_quiz()
+        with session.lock:
+            if session.pending or any(q["id"] not in session.results for q in quiz.questions):
+                return
+            detailed_results = [session.results[q["id"]][1] for q in quiz.questions]
+            user_name = session.user_name or "User"
+            fingerprint = _current_fingerprint(session)
+            if session.summary and session.summary[0] == fingerprint:
+                return
+            scored = score_quiz(quiz, detailed_results)
+            future = self._pool.submit(bind_context(final_summary), user_name, scored, detailed_results)
+            session.summary = (fingerprint, future)
+        future.add_done_callback(lambda _: self._save(session))
+        log_event("risk_session_summary_started", session_id=session.id)
+
+    # --- Public API ---
+    def create(self, user_name=None):
+        """Starts a session and returns its id."""
+        self._expire()
+        now = time.time()
+        session = _Session(uuid.uuid4().hex, user_name, now, now)
+        with self.repository.transaction() as conn:
+            conn.execute("INSERT INTO risk_sessions (id, user_name, created_at, updated_at) VALUES (?, ?, ?, ?)",
+                         (session.id, user_name, now, now))
+        with self._lock:
+            self._sessions[session.id] = session
+        return session.id
+
+    def answer(self, session_id, question_id, answer):
+        """
+        Records an answer and queues it for mapping; resubmitting the same answer is a no-op.
+
+        Returns:
+            dict: The session state (see get()), or None if the session doesn't exist.
+
+        Raises:
+            ValueError: If question_id isn't a quiz question.
+        """
+        session = self._load(session_id)
+        if session is None:
+            return None
+        question = get_quiz().by_id.get(question_id)
+        if question is None:
+            raise ValueError(f"Unknown question id: {question_id!r}")
+        with session.lock:
+            if session.answers.get(question_id) != answer or (
+                    question_id not in session.results and question_id not in session.pending):
+                session.answers[question_id] = answer
+                session.answered_at[question_id] = time.time()
+                session.results.pop(question_id, None)
+                future = self._pool.submit(bind_context(self._map), session, question, answer)
+                session.pending[question_id] = (answer, future)
+        return self.get(session_id)
+
+    def get(self, session_id):
+        """Returns a session's progress and running score, or None if it doesn't exist."""
+        session = self._load(session_id)
+        if session is None:
+            return None
+        quiz = get_quiz()
+        with session.lock:
+            scored = {qid: result for qid, (answer, result) in session.results.items()}
+            pending = sorted(session.pending)
+            summary = session.summary[1] if session.summary else None
+        total_score = sum(result["score"] for result in scored.values())
+        complete = len(scored) == len(quiz.questions)
+        state = {
+            "session_id": session.id,
+            "answered": len(scored) + len(pending),
+            "scored": len(scored),
+            "pending": pending,
+            "total_questions": len(quiz.questions),
+            "total_score": total_score,
+            "summary": "none" if summary is None else "ready" if summary.done() else "running",
+        }
+        if complete:
+            state["risk_level"] = quiz.risk_level(total_score)[0]
+        return state
+
+    def finish(self, session_id, conversation, api=GROQ_API_KEY):
+        """
+        Same result as risk_assessment.run_quiz_from_conversation(conversation), reusing the
+        session's scored answers and speculative summary wherever they match the conversation.
+        Returns None if the session doesn't exist (the caller then scores from scratch).
+        """
+        session = self._load(session_id)
+        if session is None:
+            return None
+        groq_api_key, quiz, user_name, pairs = start_quiz(conversation, api)
+        if user_name == "User" and session.user_name:
+            user_name = session.user_name
+
+        detailed_results = [None] * len(pairs)
+        waiting, missing = {}, []
+        with session.lock:
+            for index, (question, answer) in enumerate(pairs):
+                scored = session.results.get(question["id"])
+                in_flight = session.pending.get(question["id"])
+                if scored and scored[0] == answer:
+                    detailed_results[index] = scored[1]
+                elif in_flight and in_flight[0] == answer:
+                    waiting[index] = in_flight[1]
+                else:
+                    missing.append(index)
+        RISK_SESSION_EVENTS.inc(len(pairs) - len(missing) - len(waiting), kind="answer", outcome="reused")
+        RISK_SESSION_EVENTS.inc(len(waiting), kind="answer", outcome="waited")
+        RISK_SESSION_EVENTS.inc(len(missing), kind="answer", outcome="computed")
+
+        # Anything not yet mapped is mapped now, alongside the mappings still running
+        mapped = map_answers([pairs[index] for index in missing], groq_api_key)
+        for index, result in zip(missing, mapped):
+            detailed_results[index] = result
+        wait(list(waiting.values()))
+        for index, future in waiting.items():
+            try:
+                detailed_results[index] = future.result()
+            except Exception as e:
+                print(f"Background mapping failed, mapping again: {e}")
+                detailed_results[index] = map_answer(*pairs[index], groq_api_key)
+
+        scored = score_quiz(quiz, detailed_results)
+        fingerprint = _fingerprint(user_name, detailed_results)
+        with session.lock:
+            summary = session.summary if session.summary and session.summary[0] == fingerprint else None
+        gemini_output, reused_summary = None, False
+        if summary is not None:
+            try:
+                gemini_output = summary[1].result()
+            except Exception as e:
+                print(f"Speculative summary failed: {e}")
+        if gemini_output is None or gemini_output.startswith(GEMINI_FAILURE_PREFIX):
+            RISK_SESSION_EVENTS.inc(kind="summary", outcome="computed")
+            gemini_output = final_summary(user_name, scored, detailed_results)
+        else:
+            RISK_SESSION_EVENTS.inc(kind="summary", outcome="reused")
+            reused_summary = True
+        log_event("risk_session_finished", session_id=session.id, reused_answers=len(pairs) - len(missing),
+                  reused_summary=reused_summary)
+        return finish_quiz(user_name, scored, detailed_results, gemini_output)
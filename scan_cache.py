@@ -0,0 +1,248 @@
+# scan_cache.py - Content-addressed cache for scan inference results
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+
+class _Flight:
+    """An in-progress inference that concurrent identical requests wait on."""
+
+    def __init__(self):
+        self.event = threading.Event()
+        self.result_json = None
+        self.error = None
+
+
+class InferenceCache:
+    """
+    Two-tier cache (in-memory LRU + SQLite) for inference results, keyed by a hash
+    of the decoded image bytes and the model id.
+
+    Concurrent lookups for the same key are collapsed into a single upstream call:
+    the first caller runs the inference while the others wait for its result.
+    Results are stored as JSON strings so every caller gets its own copy.
+    """
+
+    def __init__(self, repository, memory_entries=256, db_entries=5000, ttl_seconds=0):
+        self.repository = repository
+        self.memory_entries = memory_entries
+        self.db_entries = db_entries
+        self.ttl_seconds = ttl_seconds
+        self._memory = OrderedDict()  # key -> (stored_at, result_json)
+        self._inflight = {}           # key -> _Flight
+        self._async_inflight = {}     # key -> asyncio.Future of the result JSON (async app)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.coalesced = 0
+
+    @staticmethod
+    def make_key(img_bytes, model_id):
+        """Returns the cache key for an image under a given model."""
+        digest = hashlib.sha256()
+        digest.update(str(model_id).encode("utf-8"))
+        digest.update(b"\0")
+        digest.update(img_bytes)
+        return digest.hexdigest()
+
+    # --- Persistent Tier ---
+    def init_db(self):
+        """Creates the inference_cache table if it doesn't already exist."""
+        with self.repository.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS inference_cache (
+                    cache_key TEXT PRIMARY KEY,
+                    created_at REAL NOT NULL,
+                    last_used REAL NOT NULL,
+                    result_json TEXT NOT NULL
+                )
+            """)
+            conn.execute(
+                "CREATE INDEX IF NOT EXISTS idx_inference_cache_last_used ON inference_cache (last_used)"
+            )
+
+    def _db_get(self, key):
+        try:
+            with self.repository.transaction() as conn:
+                row = conn.execute(
+                    "SELECT created_at, result_json FROM inference_cache WHERE cache_key = ?",
+                    (key,)
+                ).fetchone()
+                if not row:
+                    return None
+                created_at, result_json = row
+                if self._expired(created_at):
+                    conn.execute("DELETE FROM inference_cache WHERE cache_key = ?", (key,))
+                    return None
+                conn.execute(
+                    "UPDATE inference_cache SET last_used = ? WHERE cache_key = ?",
+                    (time.time(), key)
+                )
+                return created_at, result_json
+        except sqlite3.Error as e:
+            print(f"Inference cache read failed, falling back to inference: {e}")
+            return None
+
+    def _db_put(self, key, stored_at, result_json):
+        try:
+            with self.repository.transaction() as conn:
+                conn.execute(
+                    """INSERT OR REPLACE INTO inference_cache
+                       (cache_key, created_at, last_used, result_json)
+                       VALUES (?, ?, ?, ?)""",
+                    (key, stored_at, stored_at, result_json)
+                )
+                # Evict least recently used rows beyond the size limit
+                conn.execute(
+                    """DELETE FROM inference_cache WHERE cache_key IN (
+                           SELECT cache_key FROM inference_cache
+                           ORDER BY last_used DESC LIMIT -1 OFFSET ?
+                       )""",
+                    (self.db_entries,)
+                )
+        except sqlite3.Error as e:
+            print(f"Inference cache write failed: {e}")
+
+    # --- In-Memory Tier ---
+    def _expired(self, stored_at):
+        return bool(self.ttl_seconds) and time.time() - stored_at > self.ttl_seconds
+
+    def _memory_get(self, key):
+        """Must be called with self._lock held."""
+        entry = self._memory.get(key)
+        if entry is None:
+            return None
+        if self._expired(entry[0]):
+            del self._memory[key]
+            return None
+        self._memory.move_to_end(key)
+        return entry[1]
+
+    def _memory_put(self, key, stored_at, result_json):
+        """Must be called with self._lock held."""
+        self._memory[key] = (stored_at, result_json)
+        self._memory.move_to_end(key)
+        while len(self._memory) > self.memory_entries:
+            self._memory.popitem(last=False)
+
+    # --- Public API ---
+    def get_or_compute(self, key, compute):
+        """
+        Returns the cached result for `key`, or runs `compute()` once and caches it.
+
+        Args:
+            key (str): Cache key from make_key().
+            compute (callable): Runs the upstream inference and returns a JSON-serializable result.
+
+        Returns:
+            The inference result (a fresh copy for each caller).
+
+        Raises:
+            Whatever `compute()` raises. Failed inferences are never cached, and
+            callers waiting on a failed inference receive the same exception.
+        """
+        with self._lock:
+            result_json = self._memory_get(key)
+            if result_json is not None:
+                self.hits += 1
+                return json.loads(result_json)
+            flight = self._inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = _Flight()
+                self._inflight[key] = flight
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            flight.event.wait()
+            if flight.error is not None:
+                raise flight.error
+            if flight.result_json is None:
+                raise ConnectionError("Shared inference was interrupted.")
+            return json.loads(flight.result_json)
+
+        try:
+            cached = self._db_get(key)
+            if cached is not None:
+                stored_at, result_json = cached
+                with self._lock:
+                    self.hits += 1
+                    self._memory_put(key, stored_at, result_json)
+            else:
+                result_json = json.dumps(compute())
+                stored_at = time.time()
+                self._db_put(key, stored_at, result_json)
+                with self._lock:
+                    self.misses += 1
+                    self._memory_put(key, stored_at, result_json)
+            flight.result_json = result_json
+            return json.loads(result_json)
+        except Exception as e:
+            flight.error = e
+            raise
+        finally:
+            with self._lock:
+                self._inflight.pop(key, None)
+            flight.event.set()
+
+    async def get_or_compute_async(self, key, compute):
+        """
+        Coroutine version of get_or_compute() for the async app: `compute` is a coroutine
+        function, the SQLite tier is read and written on a worker thread, and concurrent
+        requests on the event loop for the same key share one computation.
+        """
+        with self._lock:
+            result_json = self._memory_get(key)
+            if result_json is not None:
+                self.hits += 1
+                return json.loads(result_json)
+            flight = self._async_inflight.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._async_inflight[key] = asyncio.get_running_loop().create_future()
+                # Failures nobody else waited for shouldn't be logged as "never retrieved"
+                flight.add_done_callback(lambda f: f.cancelled() or f.exception())
+            else:
+                self.coalesced += 1
+
+        if not leader:
+            # shield(): a cancelled follower mustn't cancel the shared computation
+            return json.loads(await asyncio.shield(flight))
+
+        try:
+            cached = await asyncio.to_thread(self._db_get, key)
+            if cached is not None:
+                stored_at, result_json = cached
+                with self._lock:
+                    self.hits += 1
+                    self._memory_put(key, stored_at, result_json)
+            else:
+                result_json = json.dumps(await compute())
+                stored_at = time.time()
+                await asyncio.to_thread(self._db_put, key, stored_at, result_json)
+                with self._lock:
+                    self.misses += 1
+                    self._memory_put(key, stored_at, result_json)
+            flight.set_result(result_json)
+            return json.loads(result_json)
+        except BaseException as e:
+            flight.set_exception(e if isinstance(e, Exception) else ConnectionError("Shared inference was interrupted."))
+            raise
+        finally:
+            with self._lock:
+                self._async_inflight.pop(key, None)
+
+    def stats(self):
+        """Returns hit/miss counters and current tier sizes."""
+        with self._lock:
+            return {
+                "hits": self.hits,
+                "misses": self.misses,
+                "coalesced": self.coalesced,
+                "memory_entries": len(self._memory),
+            }
@@ -0,0 +1,262 @@
+# scan_jobs.py - Asynchronous scan job queue backed by SQLite
+import json
+import os
+import queue
+import socket
+import threading
+import time
+import uuid
+from datetime import datetime
+
+from instrumentation import log_event, reset_request_id, set_request_id
+
+TERMINAL_STATUSES = ("done", "failed")
+
+
+class QueueFullError(RuntimeError):
+    """Raised when a job is submitted while the queue is at its depth limit."""
+
+
+class ScanJobQueue:
+    """
+    Runs scan processing on a local worker pool so HTTP workers never block on inference.
+
+    Every job is written to the scan_jobs table before it is queued, so work that was
+    queued (or interrupted mid-run) when the process stopped is picked up again on start().
+    Workers claim jobs with a conditional UPDATE, so a job is never run twice.
+
+    Several processes may share the database (e.g. gunicorn workers). A claimed job
+    records its owner, and the owner refreshes the job's heartbeat while it runs; a
+    running job is only taken over once its heartbeat is stale_seconds old, i.e. its
+    process has died. Finished jobs (and their results) are deleted after result_ttl_seconds.
+    """
+
+    def __init__(self, repository, process_fn, workers=2, max_depth=100, heartbeat_seconds=10,
+                 stale_seconds=60, result_ttl_seconds=24 * 3600):
+        self.repository = repository
+        self.process_fn = process_fn  # Called as process_fn(img_b64, user_info)
+        self.workers = workers
+        self.max_depth = max_depth
+        self.heartbeat_seconds = heartbeat_seconds
+        self.stale_seconds = stale_seconds
+        self.result_ttl_seconds = result_ttl_seconds
+        self.owner = f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self._queue = queue.Queue()
+        self._pending = 0              # Jobs queued or running in this process
+        self._lock = threading.Lock()
+        self._changed = threading.Condition(self._lock)
+        self._threads = []
+
+    # --- Storage ---
+    def init_db(self):
+        """Creates the scan_jobs table if it doesn't already exist."""
+        with self.repository.transaction() as conn:
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS scan_jobs (
+                    id TEXT PRIMARY KEY,
+                    status TEXT NOT NULL,
+                    created_at TEXT NOT NULL,
+                    updated_at TEXT NOT NULL,
+                    image_b64 TEXT,
+                    user_info_json TEXT NOT NULL,
+                    result_json TEXT,
+                    error TEXT,
+                    owner TEXT,
+                    heartbeat_at REAL
+                )
+            """)
+            # Tables created before jobs had owners
+            columns = {row[1] for row in conn.execute("PRAGMA table_info(scan_jobs)")}
+            for column, column_type in (("owner", "TEXT"), ("heartbeat_at", "REAL")):
+                if column not in columns:
+                    conn.execute(f"ALTER TABLE scan_jobs ADD COLUMN {column} {column_type}")
+            conn.execute("CREATE INDEX IF NOT EXISTS idx_scan_jobs_status ON scan_jobs (status, created_at)")
+
+    @staticmethod
+    def _now():
+        return datetime.utcnow().isoformat() + "Z"
+
+    def _update(self, job_id, status, result_json=None, error=None):
+        with self.repository.transaction() as conn:
+            # The image is only needed until the job finishes. Only the owner may finish
+            # a job: if this process stalled and it was taken over, the new owner's result wins.
+            conn.execute(
+                """UPDATE scan_jobs
+                   SET status = ?, updated_at = ?, result_json = ?, error = ?, image_b64 = NULL
+                   WHERE id = ? AND owner = ? AND status = 'running'""",
+                (status, self._now(), result_json, error, job_id, self.owner)
+            )
+
+    def _claim(self, job_id):
+        """Marks a queued job as running. Returns its payload, or None if already claimed."""
+        with self.repository.transaction(immediate=True) as conn:
+            cur = conn.execute(
+                """UPDATE scan_jobs SET status = 'running', updated_at = ?, owner = ?, heartbeat_at = ?
+                   WHERE id = ? AND status = 'queued'""",
+                (self._now(), self.owner, time.time(), job_id)
+            )
+            if cur.rowcount != 1:
+                return None
+            row = conn.execute(
+                "SELECT image_b64, user_info_json FROM scan_jobs WHERE id = ?", (job_id,)
+            ).fetchone()
+        return row[0], json.loads(row[1])
+
+    # --- Workers ---
+    def _requeue_stale(self, conn):
+        """Puts running jobs whose owner stopped sending heartbeats back to 'queued'."""
+        return conn.execute(
+            """UPDATE scan_jobs SET status = 'queued', updated_at = ?, owner = NULL
+               WHERE status = 'running' AND (heartbeat_at IS NULL OR heartbeat_at < ?)
+               RETURNING id""",
+            (self._now(), time.time() - self.stale_seconds)
+        ).fetchall()
+
+    def _enqueue(self, job_ids):
+        with self._lock:
+            self._pending += len(job_ids)
+        for job_id in job_ids:
+            self._queue.put(job_id)
+
+    def start(self):
+        """Re-queues unfinished jobs from a previous run and starts the worker and heartbeat threads."""
+        if self._threads:
+            return
+        with self.repository.transaction(immediate=True) as conn:
+            # Jobs that were mid-run when their process stopped go back to the queue.
+            # Queued jobs may also be in a sibling process's queue; claiming decides who runs them.
+            self._requeue_stale(conn)
+            recovered = [row[0] for row in conn.execute(
+                "SELECT id FROM scan_jobs WHERE status = 'queued' ORDER BY created_at"
+            )]
+        self._enqueue(recovered)
+        if recovered:
+            print(f"Recovered {len(recovered)} unfinished scan jobs")
+
+        for n in range(self.workers):
+            thread = threading.Thread(target=self._worker, name=f"scan-job-worker-{n}", daemon=True)
+            thread.start()
+            self._threads.append(thread)
+        thread = threading.Thread(target=self._maintain, name="scan-job-heartbeat", daemon=True)
+        thread.start()
+        self._threads.append(thread)
+
+    def _maintain(self):
+        """Heartbeats this process's running jobs, takes over stale ones and purges old results."""
+        while True:
+            time.sleep(self.heartbeat_seconds)
+            try:
+                with self.repository.transaction(immediate=True) as conn:
+                    conn.execute("UPDATE scan_jobs SET heartbeat_at = ? WHERE owner = ? AND status = 'running'",
+                                 (time.time(), self.owner))
+                    stale = [row[0] for row in self._requeue_stale(conn)]
+                    cutoff = datetime.utcfromtimestamp(time.time() - self.result_ttl_seconds).isoformat() + "Z"
+                    purged = conn.execute(
+                        "DELETE FROM scan_jobs WHERE status IN ('done', 'failed') AND updated_at < ?", (cutoff,)
+                    ).rowcount
+                self._enqueue(stale)
+                if stale:
+                    print(f"Took over {len(stale)} scan jobs from stopped workers")
+                if purged:
+                    print(f"Purged {purged} finished scan jobs")
+            except Exception as e:
+                print(f"Scan job heartbeat error: {e}")
+
+    def _worker(self):
+        while True:
+            job_id = self._queue.get()
+            try:
+                self._run(job_id)
+            except Exception as e:
+                print(f"Scan job worker error for job {job_id}: {e}")
+            finally:
+                with self._changed:
+                    self._pending -= 1
+                    self._changed.notify_all()
+                self._queue.task_done()
+
+    def _run(self, job_id):
+        payload = self._claim(job_id)
+        if payload is None:
+            return
+        img_b64, user_info = payload
+        token = set_request_id(job_id)  # Log lines from the job carry its id
+        try:
+            try:
+                result = self.process_fn(img_b64, user_info)
+            except Exception as e:
+                print(f"Scan job {job_id} failed: {e.__class__.__name__}: {e}")
+                self._update(job_id, "failed", error=str(e) or e.__class__.__name__)
+                log_event("scan_job", status="failed")
+                return
+            self._update(job_id, "done", result_json=json.dumps(result))
+            log_event("scan_job", status="done")
+        finally:
+            reset_request_id(token)
+
+    # --- Public API ---
+    def submit(self, img_b64, user_info):
+        """
+        Persists a new job and queues it for processing.
+
+        Returns:
+            str: The job id.
+
+        Raises:
+            QueueFullError: If the queue already holds max_depth unfinished jobs.
+        """
+        with self._lock:
+            if self._pending >= self.max_depth:
+                raise QueueFullError(f"Scan queue is full ({self.max_depth} jobs pending).")
+            self._pending += 1
+        job_id = uuid.uuid4().hex
+        now = self._now()
+        try:
+            with self.repository.transaction() as conn:
+                conn.execute(
+                    """INSERT INTO scan_jobs (id, status, created_at, updated_at, image_b64, user_info_json)
+                       VALUES (?, 'queued', ?, ?, ?, ?)""",
+                    (job_id, now, now, img_b64, json.dumps(user_info))
+                )
+        except Exception:
+            with self._lock:
+                self._pending -= 1
+            raise
+        self._queue.put(job_id)
+        return job_id
+
+    def get(self, job_id):
+        """Returns the public view of a job, or None if it doesn't exist."""
+        row = self.repository.connection().execute(
+            "SELECT status, created_at, updated_at, result_json, error FROM scan_jobs WHERE id = ?",
+            (job_id,)
+        ).fetchone()
+        if not row:
+            return None
+        status, created_at, updated_at, result_json, error = row
+        job = {"job_id": job_id, "status": status, "created_at": created_at, "updated_at": updated_at}
+        if status == "done":
+            job["result"] = json.loads(result_json)
+        elif status == "failed":
+            job["error"] = error
+        return job
+
+    def wait(self, job_id, timeout):
+        """Long-polls until the job finishes or `timeout` seconds pass, then returns get(job_id)."""
+        deadline = time.monotonic() + timeout
+        job = self.get(job_id)
+        while job and job["status"] not in TERMINAL_STATUSES:
+            remaining = deadline - time.monotonic()
+            if remaining <= 0:
+                break
+            # Wake on any local job change; re-check at least once a second in case
+            # the job is being run by another process sharing the database.
+            with self._changed:
+                self._changed.wait(min(remaining, 1.0))
+            job = self.get(job_id)
+        return job
+
+    def depth(self):
+        """Number of unfinished jobs owned by this process."""
+        with self._lock:
+            return self._pending
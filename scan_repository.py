@@ -0,0 +1,428 @@
+# scan_repository.py - SQLite storage layer for scans (pooled connections, WAL, migrations)
+import base64
+import json
+import sqlite3
+import threading
+import zlib
+from contextlib import contextmanager
+from datetime import datetime
+
+from config import DB_CACHE_SIZE_KIB, DB_SYNCHRONOUS, DB_BUSY_TIMEOUT_MS, SCAN_STORE_RAW_RESULTS
+
+
+# --- Result Encoding ---
+def _compress(result_json_str):
+    return zlib.compress(result_json_str.encode("utf-8"), 6)
+
+
+def compress_result(result_json_str):
+    """zlib-compresses a result JSON string for the result_blob column (None if raw results are off)."""
+    if not SCAN_STORE_RAW_RESULTS or result_json_str is None:
+        return None
+    return _compress(result_json_str)
+
+
+def decompress_result(blob):
+    """Inverse of compress_result(); returns the parsed result, or None if nothing was stored."""
+    if blob is None:
+        return None
+    return json.loads(zlib.decompress(blob).decode("utf-8"))
+
+
+def _number(value):
+    try:
+        return float(value) if value is not None else None
+    except (TypeError, ValueError):
+        return None
+
+
+def normalize_predictions(result):
+    """
+    Flattens a model response into (class, confidence, x, y, width, height) tuples.
+
+    Handles detection responses ({"predictions": [{"class", "confidence", "x", ...}]}),
+    single-label classification ({"predictions": [{"class", "confidence"}]} or a bare
+    list) and multi-label classification ({"predictions": {class: {"confidence"}}}).
+    Box fields are None for classification results.
+    """
+    predictions = result.get("predictions") if isinstance(result, dict) else result
+    if isinstance(predictions, dict):
+        predictions = [
+            {"class": name, **(value if isinstance(value, dict) else {"confidence": value})}
+            for name, value in predictions.items()
+        ]
+    if not isinstance(predictions, list):
+        return []
+    rows = []
+    for prediction in predictions:
+        if not isinstance(prediction, dict) or prediction.get("class") is None:
+            continue
+        rows.append((
+            str(prediction["class"]),
+            _number(prediction.get("confidence")) or 0.0,
+            _number(prediction.get("x")),
+            _number(prediction.get("y")),
+            _number(prediction.get("width")),
+            _number(prediction.get("height")),
+        ))
+    return rows
+
+
+_BACKFILL_BATCH_SIZE = 500
+
+
+def _backfill_predictions(conn):
+    """
+    Migration 9: fills predictions and result_blob from the result_json text of existing rows,
+    a batch at a time. Existing results are always kept (even with SCAN_STORE_RAW_RESULTS
+    off): migration 10 drops the text column, and rescore.py re-scores from result_blob.
+    """
+    last_id = backfilled = 0
+    while True:
+        rows = conn.execute(
+            "SELECT id, result_json FROM scans WHERE id > ? AND result_json IS NOT NULL ORDER BY id LIMIT ?",
+            (last_id, _BACKFILL_BATCH_SIZE)
+        ).fetchall()
+        if not rows:
+            break
+        for scan_id, result_json_str in rows:
+            try:
+                result = json.loads(result_json_str)
+            except (TypeError, ValueError):
+                result = None
+            conn.executemany(SQL_INSERT_PREDICTION, [(scan_id, *row) for row in normalize_predictions(result)])
+            conn.execute("UPDATE scans SET result_blob = ? WHERE id = ?", (_compress(result_json_str), scan_id))
+        backfilled += len(rows)
+        last_id = rows[-1][0]
+    print(f"Backfilled predictions for {backfilled} scans")
+
+
+# --- Schema Migrations ---
+# Each entry upgrades the schema by one version; PRAGMA user_version records how many
+# have been applied. Existing scans.db files start at version 0 and only run what's missing.
+# Entries are SQL statements, or callables taking the connection for data migrations.
+MIGRATIONS = [
+    # 1: Base scans table (matches databases created before migrations existed)
+    """
+    CREATE TABLE IF NOT EXISTS scans (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        fullName TEXT NOT NULL,
+        age INTEGER NOT NULL,
+        gender TEXT NOT NULL,
+        contact TEXT,
+        timestamp TEXT NOT NULL,
+        result_json TEXT NOT NULL,
+        primary_class TEXT
+    )
+    """,
+    # 2: Serve the previous-scan lookup from an index instead of a full table scan
+    "CREATE INDEX IF NOT EXISTS idx_scans_contact_timestamp ON scans (contact, timestamp)",
+    # 3: Keyset pagination over the whole history ordered by (timestamp, id)
+    "CREATE INDEX IF NOT EXISTS idx_scans_timestamp_id ON scans (timestamp, id)",
+    # 4: History filtered by predicted class
+    "CREATE INDEX IF NOT EXISTS idx_scans_class_timestamp_id ON scans (primary_class, timestamp, id)",
+    # 5: One row per prediction, so class/confidence queries don't parse JSON
+    """
+    CREATE TABLE IF NOT EXISTS predictions (
+        id INTEGER PRIMARY KEY,
+        scan_id INTEGER NOT NULL REFERENCES scans (id) ON DELETE CASCADE,
+        class TEXT NOT NULL,
+        confidence REAL NOT NULL,
+        x REAL,
+        y REAL,
+        width REAL,
+        height REAL
+    )
+    """,
+    # 6: Predictions of a scan
+    "CREATE INDEX IF NOT EXISTS idx_predictions_scan ON predictions (scan_id)",
+    # 7: Scans by class above a confidence threshold
+    "CREATE INDEX IF NOT EXISTS idx_predictions_class_confidence ON predictions (class, confidence, scan_id)",
+    # 8: Full model response, zlib-compressed (NULL when SCAN_STORE_RAW_RESULTS is off)
+    "ALTER TABLE scans ADD COLUMN result_blob BLOB",
+    # 9: Normalise existing rows
+    _backfill_predictions,
+    # 10: The text copy is no longer needed (requires SQLite 3.35+)
+    "ALTER TABLE scans DROP COLUMN result_json",
+]
+
+# --- Statements ---
+# Kept as constants so sqlite3's per-connection statement cache reuses the prepared form.
+SQL_LATEST_FOR_CONTACT = """SELECT id, timestamp, primary_class FROM scans
+                            WHERE contact = ? ORDER BY timestamp DESC LIMIT 1"""
+SQL_INSERT_SCAN = """INSERT INTO scans
+                     (fullName, age, gender, contact, timestamp, result_blob, primary_class)
+                     VALUES (?, ?, ?, ?, ?, ?, ?)"""
+SQL_INSERT_PREDICTION = """INSERT INTO predictions (scan_id, class, confidence, x, y, width, height)
+                           VALUES (?, ?, ?, ?, ?, ?, ?)"""
+SQL_PREDICTIONS_FOR_SCAN = """SELECT class, confidence, x, y, width, height FROM predictions
+                              WHERE scan_id = ? ORDER BY confidence DESC"""
+PREDICTION_COLUMNS = ("class", "confidence", "x", "y", "width", "height")
+# Columns read from scans for history rows; rows returned to callers replace result_blob
+# with "predictions" and the decoded "result" (see SCAN_COLUMNS).
+_HISTORY_SELECT = ("id", "fullName", "age", "gender", "contact", "timestamp", "primary_class", "result_blob")
+SCAN_COLUMNS = ("id", "fullName", "age", "gender", "contact", "timestamp", "primary_class", "predictions", "result")
+EXPORT_FETCH_SIZE = 500
+
+
+def encode_cursor(timestamp, scan_id):
+    """Encodes a (timestamp, id) position as an opaque URL-safe pagination cursor."""
+    return base64.urlsafe_b64encode(json.dumps([timestamp, scan_id]).encode("utf-8")).decode("ascii")
+
+
+def decode_cursor(cursor):
+    """Decodes a cursor from encode_cursor(), raising ValueError if it is malformed."""
+    try:
+        timestamp, scan_id = json.loads(base64.urlsafe_b64decode(cursor.encode("ascii")))
+    except Exception as e:
+        raise ValueError("Invalid cursor.") from e
+    if not isinstance(timestamp, str) or not isinstance(scan_id, int):
+        raise ValueError("Invalid cursor.")
+    return timestamp, scan_id
+
+
+def _history_query(contact=None, primary_class=None, since=None, until=None, min_confidence=None, before=None):
+    """Builds the WHERE clause for scan history queries, newest first."""
+    clauses, params = [], []
+    if contact:
+        clauses.append("contact = ?")
+        params.append(contact)
+    if min_confidence is not None:
+        # Any prediction (of primary_class, if given) at or above the threshold
+        class_clause = "p.class = ? AND " if primary_class else ""
+        clauses.append(
+            f"EXISTS (SELECT 1 FROM predictions p WHERE p.scan_id = scans.id AND {class_clause}p.confidence >= ?)"
+        )
+        params.extend([primary_class, min_confidence] if primary_class else [min_confidence])
+    elif primary_class:
+        clauses.append("primary_class = ?")
+        params.append(primary_class)
+    if since:
+        clauses.append("timestamp >= ?")
+        params.append(since)
+    if until:
+        clauses.append("timestamp < ?")
+        params.append(until)
+    if before:
+        # Keyset pagination: continue strictly after the last row of the previous page
+        clauses.append("(timestamp, id) < (?, ?)")
+        params.extend(before)
+    where = f"WHERE {' AND '.join(clauses)}" if clauses else ""
+    sql = f"SELECT {', '.join(_HISTORY_SELECT)} FROM scans {where} ORDER BY timestamp DESC, id DESC"
+    return sql, params
+
+
+class ScanRepository:
+    """
+    Owns access to the scans database.
+
+    Each thread gets one long-lived connection (WAL journal, tuned pragmas, statement
+    cache) instead of opening a new connection per query. Use transaction() to group
+    statements; connections run in autocommit mode otherwise.
+    """
+
+    def __init__(self, db_path, cache_size_kib=DB_CACHE_SIZE_KIB, synchronous=DB_SYNCHRONOUS,
+                 busy_timeout_ms=DB_BUSY_TIMEOUT_MS):
+        self.db_path = db_path
+        self.cache_size_kib = cache_size_kib
+        self.synchronous = synchronous
+        self.busy_timeout_ms = busy_timeout_ms
+        self._local = threading.local()
+
+    # --- Connections ---
+    def connection(self):
+        """Returns this thread's connection, opening and configuring it on first use."""
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(
+                self.db_path,
+                timeout=self.busy_timeout_ms / 1000,
+                isolation_level=None,  # Autocommit; transactions are explicit
+                cached_statements=256,
+            )
+            conn.execute("PRAGMA journal_mode = WAL")
+            conn.execute(f"PRAGMA synchronous = {self.synchronous}")
+            conn.execute(f"PRAGMA cache_size = -{int(self.cache_size_kib)}")
+            conn.execute("PRAGMA temp_store = MEMORY")
+            conn.execute("PRAGMA foreign_keys = ON")  # predictions cascade with their scan
+            conn.execute(f"PRAGMA busy_timeout = {int(self.busy_timeout_ms)}")
+            self._local.conn = conn
+        return conn
+
+    @contextmanager
+    def transaction(self, immediate=False):
+        """
+        Runs the enclosed statements in one transaction on this thread's connection.
+        Commits on success and rolls back on any exception. Nested use joins the outer one.
+
+        Args:
+            immediate (bool): Take the write lock up front (BEGIN IMMEDIATE), so a
+                              read-then-write sequence can't be interleaved by another writer.
+        """
+        conn = self.connection()
+        if conn.in_transaction:
+            yield conn
+            return
+        conn.execute("BEGIN IMMEDIATE" if immediate else "BEGIN")
+        try:
+            yield conn
+        except BaseException:
+            conn.rollback()
+            raise
+        else:
+            conn.commit()
+
+    def close(self):
+        """Closes this thread's connection (it is reopened on next use)."""
+        conn = getattr(self._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            self._local.conn = None
+
+    # --- Schema ---
+    def migrate(self):
+        """Applies any schema migrations the database hasn't seen yet. Returns the new version."""
+        with self.transaction(immediate=True) as conn:
+            version = conn.execute("PRAGMA user_version").fetchone()[0]
+            pending = MIGRATIONS[version:]
+            for number, migration in enumerate(pending, start=version + 1):
+                if callable(migration):
+                    migration(conn)
+                else:
+                    conn.execute(migration)
+                print(f"Applied scans schema migration {number}")
+            # PRAGMA doesn't accept bound parameters
+            conn.execute(f"PRAGMA user_version = {len(MIGRATIONS)}")
+        if any(callable(migration) for migration in pending):
+            # Data migrations rewrite rows; give the freed pages back to the filesystem
+            self.connection().execute("VACUUM")
+        return len(MIGRATIONS)
+
+    # --- Scans ---
+    @staticmethod
+    def _predictions(conn, scan_ids):
+        """Returns {scan_id: [prediction dict, ...]} (highest confidence first) for the given scans."""
+        by_scan = {scan_id: [] for scan_id in scan_ids}
+        if not by_scan:
+            return by_scan
+        placeholders = ", ".join("?" * len(by_scan))
+        rows = conn.execute(
+            f"""SELECT scan_id, {', '.join(PREDICTION_COLUMNS)} FROM predictions
+                WHERE scan_id IN ({placeholders}) ORDER BY scan_id, confidence DESC""",
+            tuple(by_scan),
+        ).fetchall()
+        for scan_id, *values in rows:
+            by_scan[scan_id].append(dict(zip(PREDICTION_COLUMNS, values)))
+        return by_scan
+
+    @staticmethod
+    def latest_scan_for_contact(conn, contact):
+        """
+        Returns the contact's most recent scan as structured data, or None:
+        {"scan_id", "timestamp", "primary_class", "predictions": [{"class", "confidence", "x", "y", "width", "height"}]}
+        """
+        if not contact:
+            return None
+        row = conn.execute(SQL_LATEST_FOR_CONTACT, (contact,)).fetchone()
+        if row is None:
+            return None
+        scan_id, timestamp, primary_class = row
+        predictions = [dict(zip(PREDICTION_COLUMNS, values))
+                       for values in conn.execute(SQL_PREDICTIONS_FOR_SCAN, (scan_id,))]
+        return {"scan_id": scan_id, "timestamp": timestamp, "primary_class": primary_class,
+                "predictions": predictions}
+
+    @staticmethod
+    def insert_scan(conn, user_info, result, result_json_str, primary_class):
+        """Inserts one scan row and its predictions on `conn` and returns the scan id."""
+        cur = conn.execute(
+            SQL_INSERT_SCAN,
+            (
+                user_info.get("fullName", "N/A"),
+                user_info.get("age", 0),
+                user_info.get("gender", "N/A"),
+                user_info.get("contact"), # Store None if not provided
+                datetime.utcnow().isoformat() + "Z", # ISO 8601 UTC format
+                compress_result(result_json_str),
+                primary_class
+            )
+        )
+        scan_id = cur.lastrowid
+        conn.executemany(SQL_INSERT_PREDICTION, [(scan_id, *row) for row in normalize_predictions(result)])
+        return scan_id
+
+    # --- History ---
+    def _history_rows(self, conn, rows):
+        """Turns selected scan rows into SCAN_COLUMNS dicts with predictions and the decoded result."""
+        predictions = self._predictions(conn, [row[0] for row in rows])
+        shaped = []
+        for row in rows:
+            scan = dict(zip(_HISTORY_SELECT, row))
+            blob = scan.pop("result_blob")
+            scan["predictions"] = predictions[scan["id"]]
+            scan["result"] = decompress_result(blob)
+            shaped.append(scan)
+        return shaped
+
+    def list_scans(self, contact=None, primary_class=None, since=None, until=None, min_confidence=None,
+                   cursor=None, limit=50):
+        """
+        Returns one page of scan history, newest first, using keyset pagination.
+
+        Args:
+            contact, primary_class (str, optional): Exact-match filters.
+            since (str, optional): ISO timestamp, inclusive lower bound.
+            until (str, optional): ISO timestamp, exclusive upper bound.
+            min_confidence (float, optional): Only scans with a prediction (of primary_class,
+                if given) at or above this confidence.
+            cursor (str, optional): next_cursor from the previous page.
+            limit (int): Page size.
+
+        Returns:
+            tuple: (rows, next_cursor) where rows are dicts with SCAN_COLUMNS keys and
+                   next_cursor is None on the last page.
+
+        Raises:
+            ValueError: If the cursor is malformed.
+        """
+        before = decode_cursor(cursor) if cursor else None
+        sql, params = _history_query(contact, primary_class, since, until, min_confidence, before)
+        conn = self.connection()
+        # Fetch one extra row to know whether another page exists
+        rows = conn.execute(f"{sql} LIMIT ?", (*params, limit + 1)).fetchall()
+        next_cursor = None
+        if len(rows) > limit:
+            rows = rows[:limit]
+            next_cursor = encode_cursor(rows[-1][5], rows[-1][0])
+        return self._history_rows(conn, rows), next_cursor
+
+    def iter_scans(self, contact=None, primary_class=None, since=None, until=None, min_confidence=None):
+        """
+        Yields every matching scan as a dict (same shape as list_scans()), newest first,
+        fetching EXPORT_FETCH_SIZE rows at a time so memory use stays constant regardless
+        of table size.
+        """
+        sql, params = _history_query(contact, primary_class, since, until, min_confidence)
+        conn = self.connection()
+        cur = conn.execute(sql, params)
+        try:
+            while True:
+                rows = cur.fetchmany(EXPORT_FETCH_SIZE)
+                if not rows:
+                    break
+                yield from self._history_rows(conn, rows)
+        finally:
+            cur.close()
+
+
+_repositories = {}
+_repositories_lock = threading.Lock()
+
+
+def get_repository(db_path):
+    """Returns the shared ScanRepository for a database path."""
+    with _repositories_lock:
+        repository = _repositories.get(db_path)
+        if repository is None:
+            repository = _repositories[db_path] = ScanRepository(db_path)
+        return repository
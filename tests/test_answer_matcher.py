@@ -0,0 +1,59 @@
+# test_answer_matcher.py - Local quiz answer matching (answer_matcher.py)
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from answer_matcher import match_answer  # noqa: E402
+from config import QUIZ_LOCAL_MATCH_THRESHOLD  # noqa: E402
+from quiz_model import CompiledQuiz  # noqa: E402
+
+with open(os.path.join(ROOT, "breast_cancer_quiz.json"), encoding="utf-8") as f:
+    QUIZ_DATA = json.load(f)
+QUIZ = CompiledQuiz(QUIZ_DATA)
+
+
+def _option(question_id, answer, compiled=True):
+    """Returns the option text matched with enough confidence to skip the LLM, or None."""
+    question = QUIZ.by_id[question_id] if compiled else next(
+        q for q in QUIZ_DATA["questions"] if q["id"] == question_id)
+    match = match_answer(question, answer)
+    if match is None or match.confidence < QUIZ_LOCAL_MATCH_THRESHOLD:
+        return None
+    return question["options"][match.option_index]["text"]
+
+
+@pytest.mark.parametrize("compiled", [True, False])
+@pytest.mark.parametrize("question_id, answer, expected", [
+    (1, "I'm 52", "50-59"),
+    (1, "52 years old", "50-59"),
+    (1, "about 75", "70 or older"),
+    (7, "11", "11 years old"),
+    (9, "2 drinks a week", "1-3 drinks"),
+    (9, "none", "None"),
+    (11, "about 3 hours", "3-4 hours"),
+    (11, "3 hours a week", "3-4 hours"),
+    (13, "25", "Age 20-29"),
+    (13, "I was 25 years old", "Age 20-29"),
+])
+def test_numeric_answers_in_the_questions_units_match(question_id, answer, expected, compiled):
+    assert _option(question_id, answer, compiled) == expected
+
+
+@pytest.mark.parametrize("compiled", [True, False])
+@pytest.mark.parametrize("question_id, answer", [
+    (1, "born in 1975"),              # Year of birth, not an age
+    (1, "1975"),
+    (1, "260"),                       # Outside any plausible age
+    (11, "about 20 minutes"),         # Minutes, not hours
+    (11, "30 minutes a day"),
+    (9, "2 drinks a day"),            # Per day, the question asks per week
+    (13, "25 weeks"),                 # Length of the pregnancy, not an age
+    (13, "10 years ago"),
+])
+def test_numbers_in_other_units_are_left_to_the_llm(question_id, answer, compiled):
+    assert _option(question_id, answer, compiled) is None
@@ -0,0 +1,28 @@
+# test_api_common.py - Request parsing shared by app.py and asgi_app.py (api_common.py)
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from api_common import history_filters  # noqa: E402
+
+
+@pytest.mark.parametrize("value, expected", [
+    ("2025-01-01T00:00:00+02:00", "2024-12-31T22:00:00.000000Z"),
+    ("2025-01-01T10:30:00-05:00", "2025-01-01T15:30:00.000000Z"),
+    ("2025-01-01T10:00:00Z", "2025-01-01T10:00:00.000000Z"),
+    ("2025-01-01T10:00:00.25", "2025-01-01T10:00:00.250000Z"),
+    ("2025-01-01", "2025-01-01T00:00:00.000000Z"),
+])
+def test_since_and_until_are_normalised_to_stored_utc_form(value, expected):
+    filters = history_filters({"since": value, "until": value})
+    assert filters["since"] == expected
+    assert filters["until"] == expected
+
+
+def test_invalid_timestamp_is_rejected():
+    with pytest.raises(ValueError, match="'until'"):
+        history_filters({"until": "last tuesday"})
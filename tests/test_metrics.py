@@ -0,0 +1,35 @@
+# test_metrics.py - Process-wide metrics served at /metrics (app.py)
+import importlib
+import os
+import shutil
+import sys
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from answer_matcher import matcher_stats, record_resolution  # noqa: E402
+
+
+def _metric(text, name):
+    return next(float(line.split()[-1]) for line in text.splitlines() if line.startswith(name))
+
+
+def test_quiz_matcher_hit_rate_is_exported(tmp_path, monkeypatch):
+    # The app opens scans.db (and reads its data files) relative to the working directory
+    for name in ("breast_cancer.txt", "breast_cancer_quiz.json"):
+        shutil.copy(os.path.join(ROOT, name), tmp_path)
+    monkeypatch.chdir(tmp_path)
+    app = importlib.import_module("app").app
+
+    before = matcher_stats()
+    record_resolution("local")
+    record_resolution("local")
+    record_resolution("llm")
+    stats = matcher_stats()
+    assert stats["local"] == before["local"] + 2
+    assert stats["llm"] == before["llm"] + 1
+
+    text = app.test_client().get("/metrics").get_data(as_text=True)
+    assert _metric(text, 'quiz_answers_resolved_total{source="local"}') == stats["local"]
+    assert _metric(text, 'quiz_answers_resolved_total{source="llm"}') == stats["llm"]
+    assert abs(_metric(text, "quiz_local_hit_rate") - stats["local_hit_rate"]) < 1e-6
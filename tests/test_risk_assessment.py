@@ -0,0 +1,70 @@
+# test_risk_assessment.py - Answer mapping when the Groq call fails (risk_assessment.py)
+import asyncio
+import json
+import os
+import sys
+
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+import risk_assessment  # noqa: E402
+from quiz_model import CompiledQuiz  # noqa: E402
+
+with open(os.path.join(ROOT, "breast_cancer_quiz.json"), encoding="utf-8") as f:
+    QUIZ = CompiledQuiz(json.load(f))
+
+
+@pytest.fixture
+def groq_down(monkeypatch):
+    def fail(*args, **kwargs):
+        raise ConnectionError("Groq unavailable")
+
+    async def fail_async(*args, **kwargs):
+        fail()
+
+    monkeypatch.setattr(risk_assessment, "groq_chat_completion", fail)
+    monkeypatch.setattr(risk_assessment, "groq_chat_completion_async", fail_async)
+
+
+def _map_both(question_id, answer):
+    question = QUIZ.by_id[question_id]
+    return [
+        risk_assessment.map_answer(question, answer, "gsk_test"),
+        asyncio.run(risk_assessment.map_answer_async(question, answer, "gsk_test")),
+    ]
+
+
+def test_low_confidence_guess_is_not_scored(groq_down):
+    for result in _map_both(1, "I think it was somewhere in the middle"):
+        assert result["matched_option"] == "N/A"
+        assert result["score"] == 0
+        assert result["resolved_by"] == "local_fallback"
+
+
+def test_confident_local_match_is_still_used(groq_down):
+    question = QUIZ.by_id[6]
+    # Below QUIZ_LOCAL_MATCH_THRESHOLD (so Groq is asked) but above the fallback floor
+    for result in _map_both(6, "very dense"):
+        assert result["resolved_by"] == "local_fallback"
+        assert result["matched_option"] == "C"
+        assert result["score"] == question["options"][2]["points"]
+
+
+def test_mapping_stats_count_fallbacks(groq_down):
+    results = _map_both(1, "somewhere in the middle") + [risk_assessment.map_answer(QUIZ.by_id[3], "no", "gsk_test")]
+    stats = risk_assessment.score_quiz(QUIZ, results)["mapping_stats"]
+    assert stats == {"local": 1, "llm": 0, "fallback": 2}
+
+
+def test_missing_gemini_key_returns_failure_message():
+    scored = risk_assessment.score_quiz(QUIZ, [])
+    args = dict(score=scored["total_score"], risk_level=scored["risk_level"],
+                interpretation=scored["interpretation"], answers=[], user_name="User", api_key="")
+    outputs = [
+        risk_assessment.gemini_final_call(**args),
+        asyncio.run(risk_assessment.gemini_final_call_async(**args)),
+    ]
+    for output in outputs:
+        assert output.startswith(risk_assessment.GEMINI_FAILURE_PREFIX)
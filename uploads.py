@@ -0,0 +1,98 @@
+# uploads.py - Streaming binary upload handling for scan images
+import struct
+import tempfile
+
+CHUNK_SIZE = 64 * 1024
+
+# JPEG start-of-frame markers that carry the image dimensions (excludes DHT/JPG/DAC)
+_JPEG_SOF_MARKERS = {0xC0, 0xC1, 0xC2, 0xC3, 0xC5, 0xC6, 0xC7, 0xC9, 0xCA, 0xCB, 0xCD, 0xCE, 0xCF}
+
+
+class UploadTooLargeError(ValueError):
+    """Raised when an upload body exceeds the configured size limit."""
+
+
+def read_upload(stream, max_bytes, spool_bytes=1024 * 1024):
+    """
+    Streams an upload body into a spooled temporary buffer and returns its bytes.
+
+    Bodies smaller than `spool_bytes` stay in memory; larger ones are spooled to disk
+    while streaming, so the only full in-memory copy is the bytes object returned.
+
+    Args:
+        stream: A file-like object with read(n) (e.g. request.stream or FileStorage.stream).
+        max_bytes (int): Maximum accepted body size.
+        spool_bytes (int): Size above which the buffer rolls over to a temp file.
+
+    Returns:
+        bytes: The upload body.
+
+    Raises:
+        UploadTooLargeError: If the body is larger than max_bytes.
+    """
+    with tempfile.SpooledTemporaryFile(max_size=spool_bytes) as spool:
+        total = 0
+        while True:
+            chunk = stream.read(CHUNK_SIZE)
+            if not chunk:
+                break
+            total += len(chunk)
+            if total > max_bytes:
+                raise UploadTooLargeError(f"Upload exceeds the {max_bytes} byte limit.")
+            spool.write(chunk)
+        spool.seek(0)
+        return spool.read()
+
+
+def _jpeg_dimensions(data):
+    """Walks JPEG segment headers up to the first SOF marker without decoding pixels."""
+    offset = 2
+    length = len(data)
+    while offset + 4 <= length:
+        if data[offset] != 0xFF:
+            raise ValueError("Corrupt JPEG header.")
+        marker = data[offset + 1]
+        if marker == 0xFF:  # Fill byte
+            offset += 1
+            continue
+        if marker in (0xD8, 0x01) or 0xD0 <= marker <= 0xD7:  # Standalone markers
+            offset += 2
+            continue
+        segment_length = struct.unpack(">H", data[offset + 2:offset + 4])[0]
+        if marker in _JPEG_SOF_MARKERS:
+            if offset + 9 > length:
+                break
+            height, width = struct.unpack(">HH", data[offset + 5:offset + 9])
+            return width, height
+        if marker == 0xDA:  # Start of scan before any SOF
+            break
+        offset += 2 + segment_length
+    raise ValueError("JPEG header has no frame dimensions.")
+
+
+def read_image_header(data):
+    """
+    Identifies a JPEG or PNG image from its header bytes without decoding it.
+
+    Args:
+        data (bytes): The image bytes (only the header is inspected).
+
+    Returns:
+        tuple: (format, width, height) where format is "jpeg" or "png".
+
+    Raises:
+        ValueError: If the data is not a supported image or its header is malformed.
+    """
+    if data[:3] == b"\xff\xd8\xff":
+        width, height = _jpeg_dimensions(data)
+        image_format = "jpeg"
+    elif data[:8] == b"\x89PNG\r\n\x1a\n":
+        if len(data) < 24 or data[12:16] != b"IHDR":
+            raise ValueError("Corrupt PNG header.")
+        width, height = struct.unpack(">II", data[16:24])
+        image_format = "png"
+    else:
+        raise ValueError("Unsupported image type (expected JPEG or PNG).")
+    if width == 0 or height == 0:
+        raise ValueError("Image has zero width or height.")
+    return image_format, width, height